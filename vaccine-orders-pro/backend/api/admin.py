@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Product, DosePack, Batch, Order, OrderItem, OrderStatusHistory, UserProfile
+from .models import Product, DosePack, Batch, Order, OrderItem, OrderStatusHistory, UserProfile, StockThreshold
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
@@ -98,3 +98,9 @@ class OrderStatusHistoryAdmin(admin.ModelAdmin):
     list_filter = ('status', 'changed_at')
     search_fields = ('order__order_number', 'changed_by__username')
     readonly_fields = ('order', 'status', 'changed_by', 'changed_at')
+
+@admin.register(StockThreshold)
+class StockThresholdAdmin(admin.ModelAdmin):
+    list_display = ('product', 'min_available_packs', 'cover_weeks', 'expiry_warning_days', 'weekly_velocity', 'updated_at')
+    search_fields = ('product__name',)
+    readonly_fields = ('weekly_velocity', 'updated_at')
@@ -0,0 +1,144 @@
+"""Materialized stock alerts (`StockAlert`).
+
+Alerts are recomputed per product, so they can be kept current cheaply:
+
+* batch and threshold writes refresh their product's alerts (api/signals.py);
+* code that bypasses signals (`bulk_update`, e.g. api/allocation.py) calls
+  `refresh_alerts()` with the products it touched;
+* `manage.py refresh_stock_alerts`, run daily, refreshes order velocities
+  and rebuilds every product's alerts, which also rolls batches into the
+  `expiring`/`expired` windows as dates pass.
+
+A product is low on stock when its available packs are at or below
+`low_stock_level()`. A batch with stock on hand is `expiring` within the
+product's warning window and `expired` once its expiry date has passed.
+"""
+import math
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Product, Batch, OrderItem, StockAlert, StockThreshold
+
+DEFAULTS = {
+    'LOW_STOCK_PACKS': 100,
+    'EXPIRY_WARNING_DAYS': 30,
+    'VELOCITY_WEEKS': 8,
+}
+
+
+def alert_settings():
+    return {**DEFAULTS, **getattr(settings, 'STOCK_ALERTS', {})}
+
+
+def low_stock_level(threshold, config=None):
+    config = config or alert_settings()
+    if threshold is None:
+        return config['LOW_STOCK_PACKS']
+    level = config['LOW_STOCK_PACKS'] if threshold.min_available_packs is None else threshold.min_available_packs
+    if threshold.cover_weeks:
+        level = max(level, math.ceil(threshold.weekly_velocity * threshold.cover_weeks))
+    return level
+
+
+def expiry_warning_days(threshold, config=None):
+    config = config or alert_settings()
+    if threshold is None or threshold.expiry_warning_days is None:
+        return config['EXPIRY_WARNING_DAYS']
+    return threshold.expiry_warning_days
+
+
+def desired_alerts(product_ids, today=None):
+    """{(product_id, batch_id, kind): (value, threshold)} as they should be now."""
+    config = alert_settings()
+    today = today or timezone.localdate()
+    thresholds = StockThreshold.objects.filter(product_id__in=product_ids).in_bulk(field_name='product_id')
+    desired = {}
+    for product_id, available in Product.objects.filter(pk__in=product_ids).values_list('id', 'available_packs'):
+        level = low_stock_level(thresholds.get(product_id), config)
+        if available <= level:
+            desired[(product_id, None, StockAlert.LOW_STOCK)] = (available, level)
+
+    warning_days = {pid: expiry_warning_days(thresholds.get(pid), config) for pid in product_ids}
+    horizon = today + timedelta(days=max(warning_days.values(), default=0))
+    batches = (
+        Batch.objects.filter(product_id__in=product_ids, quantity__gt=0, expiry_date__lte=horizon)
+        .exclude(status='shipped')
+        .values_list('id', 'product_id', 'expiry_date')
+    )
+    for batch_id, product_id, expiry_date in batches:
+        days_left = (expiry_date - today).days
+        window = warning_days[product_id]
+        if days_left < 0:
+            desired[(product_id, batch_id, StockAlert.EXPIRED)] = (days_left, 0)
+        elif days_left <= window:
+            desired[(product_id, batch_id, StockAlert.EXPIRING)] = (days_left, window)
+    return desired
+
+
+def refresh_alerts(product_ids, today=None):
+    """Bring the alerts of `product_ids` up to date; returns (created, updated, deleted)."""
+    product_ids = {pid for pid in product_ids if pid}
+    if not product_ids:
+        return 0, 0, 0
+    desired = desired_alerts(product_ids, today)
+
+    stale, changed = [], []
+    now = timezone.now()
+    for alert in StockAlert.objects.filter(product_id__in=product_ids):
+        key = (alert.product_id, alert.batch_id, alert.kind)
+        wanted = desired.pop(key, None)
+        if wanted is None:
+            stale.append(alert.pk)
+        elif wanted != (alert.value, alert.threshold):
+            alert.value, alert.threshold = wanted
+            alert.updated_at = now
+            changed.append(alert)
+
+    if stale:
+        StockAlert.objects.filter(pk__in=stale).delete()
+    if changed:
+        StockAlert.objects.bulk_update(changed, ['value', 'threshold', 'updated_at'])
+    if desired:
+        StockAlert.objects.bulk_create([
+            StockAlert(product_id=product_id, batch_id=batch_id, kind=kind, value=value, threshold=threshold)
+            for (product_id, batch_id, kind), (value, threshold) in desired.items()
+        ])
+    return len(desired), len(changed), len(stale)
+
+
+def rebuild_alerts(chunk_size=500, today=None):
+    """Refresh every product's alerts; returns (created, updated, deleted)."""
+    totals = [0, 0, 0]
+    product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(product_ids), chunk_size):
+        counts = refresh_alerts(product_ids[start:start + chunk_size], today)
+        totals = [total + count for total, count in zip(totals, counts)]
+    return tuple(totals)
+
+
+def refresh_velocities(weeks=None):
+    """Recompute `weekly_velocity` for thresholds that use `cover_weeks`; returns rows updated."""
+    weeks = weeks or alert_settings()['VELOCITY_WEEKS']
+    thresholds = list(StockThreshold.objects.filter(cover_weeks__isnull=False))
+    if not thresholds:
+        return 0
+    since = timezone.now() - timedelta(weeks=weeks)
+    ordered = dict(
+        OrderItem.objects.filter(
+            product_id__in=[t.product_id for t in thresholds],
+            order__created_at__gte=since,
+        )
+        .exclude(order__status='cancelled')
+        .values('product_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('product_id', 'total')
+    )
+    for threshold in thresholds:
+        total = Decimal(ordered.get(threshold.product_id) or 0)
+        threshold.weekly_velocity = (total / weeks).quantize(Decimal('0.01'))
+    StockThreshold.objects.bulk_update(thresholds, ['weekly_velocity'])
+    return len(thresholds)
@@ -0,0 +1,141 @@
+"""Set-based FEFO stock allocation used when an order is confirmed.
+
+All batches for every product on the order are locked with one ordered
+`SELECT ... FOR UPDATE`, allocations are computed in memory (first expiry,
+first out), and the result is written back with one `bulk_update` per model
+and one `bulk_create` of inventory logs. The number of queries does not
+depend on how many lines the order has or how many batches each line spans.
+"""
+from collections import defaultdict
+
+from django.db.models import F
+from django.utils import timezone
+
+from .alerts import refresh_alerts
+from .cache import catalog_cache
+from .inventory import apply_stock_deltas, refresh_nearest_expiry
+from .models import Product, Batch, DosePack, InventoryLog
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def allocate_order(order, performed_by=None):
+    """Reserve batch stock for every line of `order`.
+
+    Must be called inside `transaction.atomic()`. Raises `InsufficientStock`
+    if a product runs out of batches and has no dose pack to fall back on.
+    Returns the list of `InventoryLog` rows written.
+    """
+    items = [
+        item for item in order.items.select_related('product', 'dose_pack')
+        if item.product_id and int(item.quantity or 0) > 0
+    ]
+    if not items:
+        return []
+
+    product_ids = sorted({item.product_id for item in items})
+    # Lock in (product, expiry, id) order so concurrent confirmations
+    # acquire row locks in the same sequence and cannot deadlock.
+    batches_by_product = defaultdict(list)
+    for batch in (
+        Batch.objects.select_for_update()
+        .filter(product_id__in=product_ids)
+        .exclude(status=Batch.EXPIRED)
+        .order_by('product_id', 'expiry_date', 'id')
+    ):
+        batches_by_product[batch.product_id].append(batch)
+
+    reason = f'Confirmed order {order.order_number}'
+    logs = []
+    touched_batches = {}
+    touched_dose_packs = {}
+    reserved_delta = defaultdict(int)
+    units_delta = defaultdict(int)
+    products_with_dose_packs = None
+
+    for item in items:
+        product = item.product
+        units_per_pack = int(getattr(item.dose_pack, 'units_per_pack', 1) or 1) if item.dose_pack else 1
+        packs_needed = int(item.quantity)
+        remaining_packs = packs_needed
+
+        for batch in batches_by_product[product.id]:
+            available_packs = batch.quantity - batch.quantity_reserved
+            if available_packs <= 0:
+                continue
+            take = min(available_packs, remaining_packs)
+            batch.quantity_reserved += take
+            touched_batches[batch.id] = batch
+            reserved_delta[product.id] += take
+            logs.append(InventoryLog(
+                product=product,
+                batch=batch,
+                action='reserved',
+                quantity_changed=-(take * units_per_pack),
+                reason=reason,
+                related_order=order,
+                performed_by=performed_by,
+            ))
+            remaining_packs -= take
+            if remaining_packs <= 0:
+                break
+
+        if remaining_packs > 0:
+            if products_with_dose_packs is None:
+                products_with_dose_packs = set(
+                    DosePack.objects.filter(product_id__in=product_ids)
+                    .values_list('product_id', flat=True)
+                    .distinct()
+                )
+            if product.id not in products_with_dose_packs:
+                raise InsufficientStock(
+                    f"Insufficient stock for product {product.id} - needs {packs_needed}, short {remaining_packs}"
+                )
+            # Dose packs exist but no inventory batches - deduct from the dose pack
+            if item.dose_pack:
+                dose_pack = touched_dose_packs.setdefault(item.dose_pack.id, item.dose_pack)
+                new_units = max(0, dose_pack.units_per_pack - remaining_packs)
+                units_delta[product.id] += new_units - dose_pack.units_per_pack
+                dose_pack.units_per_pack = new_units
+                logs.append(InventoryLog(
+                    product=product,
+                    batch=None,
+                    action='confirmed',
+                    quantity_changed=-remaining_packs,
+                    reason=f'{reason} (no batches, deducted from dose pack)',
+                    related_order=order,
+                    performed_by=performed_by,
+                ))
+
+    now = timezone.now()
+    if touched_batches:
+        for batch in touched_batches.values():
+            batch.updated_at = now
+        Batch.objects.bulk_update(list(touched_batches.values()), ['quantity_reserved', 'updated_at'])
+    if touched_dose_packs:
+        for dose_pack in touched_dose_packs.values():
+            dose_pack.updated_at = now
+        DosePack.objects.bulk_update(list(touched_dose_packs.values()), ['units_per_pack', 'updated_at'])
+    if logs:
+        InventoryLog.objects.bulk_create(logs)
+
+    # bulk_update bypasses the model signals, so maintain the stock totals here
+    apply_stock_deltas({
+        product_id: {
+            'available': -reserved_delta[product_id],
+            'reserved': reserved_delta[product_id],
+            'units': units_delta[product_id],
+        }
+        for product_id in product_ids
+    })
+    refresh_nearest_expiry(reserved_delta.keys())
+    # Keep product.available_stock in sync (remaining dose pack units plus
+    # available batch packs), once per affected product.
+    Product.objects.filter(pk__in=product_ids).update(
+        available_stock=F('total_units') + F('available_packs')
+    )
+    refresh_alerts(product_ids)
+    catalog_cache.bump_version_on_commit()
+    return logs
@@ -0,0 +1,182 @@
+"""Token authentication with the token -> user lookup cached.
+
+DRF's `TokenAuthentication` runs `Token.objects.select_related('user')` on
+every request; the SPA sends `Authorization: Token ...` on nearly every call.
+`CachedTokenAuthentication` keeps resolved users in a bounded in-process
+LRU, optionally backed by Django's cache so workers share the lookups.
+Cached users are copies without any related rows (e.g. the profile) a
+request loaded onto them.
+
+Entries are dropped when a token is deleted (dj_rest_auth logout) or its
+user is saved or deleted (deactivation, permission changes); see
+api/signals.py. With BACKEND='django' this also bumps the token's
+generation in the shared cache, which every in-process hit checks (one
+cache round trip), so all workers see the change on their next request.
+With BACKEND='locmem' other workers are not told: their entries live at
+most `LOCAL_TTL` seconds. Writes that bypass signals, such as
+`QuerySet.update()` on users, are picked up once entries expire (`TTL`).
+
+Configured with the ``TOKEN_AUTH_CACHE`` setting::
+
+    TOKEN_AUTH_CACHE = {
+        'ENABLED': True,
+        'MAX_ENTRIES': 1024,     # in-process LRU size cap
+        'TTL': 60,               # seconds an entry is trusted
+        'LOCAL_TTL': 5,          # cap on TTL with BACKEND='locmem'
+        'BACKEND': 'locmem',     # or 'django' to also use Django's cache
+        'CACHE_ALIAS': 'default',
+    }
+"""
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_ENTRIES': 1024,
+    'TTL': 60,
+    'LOCAL_TTL': 5,
+    'BACKEND': 'locmem',
+    'CACHE_ALIAS': 'default',
+}
+
+
+def token_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'TOKEN_AUTH_CACHE', {})}
+
+
+def _detached(user):
+    """A copy of `user` without the related rows (profile, ...) a request loaded onto it."""
+    user = copy.copy(user)
+    user._state.fields_cache = {}
+    user.__dict__.pop('_prefetched_objects_cache', None)
+    return user
+
+
+class TokenCache:
+    """Thread-safe LRU of token key -> (expires_at, generation, user) with an optional shared tier."""
+
+    key_prefix = 'auth-token:'
+    generation_prefix = 'auth-token-gen:'
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _shared(self, config):
+        return caches[config['CACHE_ALIAS']] if config['BACKEND'] == 'django' else None
+
+    def generation(self, key):
+        """The token's current generation in the shared tier (None without one).
+
+        Read it before loading the user and pass it to `set`, so a write that
+        lands in between leaves the entry already outdated. A missing
+        generation is created rather than trusted, so an evicted one never
+        revives older entries.
+        """
+        shared = self._shared(token_cache_settings())
+        if shared is None:
+            return None
+        shared.add(self.generation_prefix + key, uuid.uuid4().hex, None)
+        return shared.get(self.generation_prefix + key)
+
+    def get(self, key):
+        config = token_cache_settings()
+        shared = self._shared(config)
+        # In-process entries are only trusted while their generation is current
+        current = shared.get(self.generation_prefix + key) if shared is not None else None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now and entry[1] == current:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return copy.copy(entry[2])
+            if entry is not None:
+                del self._data[key]
+        stored = shared.get(self.key_prefix + key) if shared is not None and current is not None else None
+        with self._lock:
+            if stored is None or stored[0] != current:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._remember(key, stored[0], stored[1], config)
+        return copy.copy(stored[1])
+
+    def set(self, key, user, generation=None):
+        config = token_cache_settings()
+        user = _detached(user)
+        self._remember(key, generation, user, config)
+        shared = self._shared(config)
+        if shared is not None:
+            shared.set(self.key_prefix + key, (generation, user), config['TTL'])
+
+    def _remember(self, key, generation, user, config):
+        # Without a shared tier nothing tells this worker about other workers' writes
+        ttl = config['TTL'] if config['BACKEND'] == 'django' else min(config['TTL'], config['LOCAL_TTL'])
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, generation, user)
+            self._data.move_to_end(key)
+            while len(self._data) > config['MAX_ENTRIES']:
+                self._data.popitem(last=False)
+
+    def invalidate(self, keys):
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+        shared = self._shared(token_cache_settings())
+        if shared is not None and keys:
+            shared.delete_many([self.key_prefix + key for key in keys])
+            # Outdates the in-process entries of every other worker
+            shared.set_many({self.generation_prefix + key: uuid.uuid4().hex for key in keys}, None)
+
+    def invalidate_user(self, user_id):
+        """Drop every cached entry for `user_id` (a user has at most one token)."""
+        with self._lock:
+            keys = [key for key, (_, _, user) in self._data.items() if user.pk == user_id]
+        keys += Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+        self.invalidate(set(keys))
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Drop-in replacement for `TokenAuthentication` that caches the lookup."""
+
+    def authenticate_credentials(self, key):
+        if not token_cache_settings()['ENABLED']:
+            return super().authenticate_credentials(key)
+        user = token_cache.get(key)
+        if user is None:
+            generation = token_cache.generation(key)
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user, generation)
+            return user, token
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        # request.auth: an unsaved stand-in for the row we did not load
+        token = Token(key=key, user=user)
+        token._state.adding = False
+        return user, token
@@ -0,0 +1,102 @@
+"""Available-to-promise (ATP) checks for prospective order lines.
+
+`check_availability()` answers for a whole cart at once with three queries:
+products (lead times), dose packs, and unreserved batch stock grouped by
+(product, expiry date). Lines are then evaluated in memory the way
+`allocate_order` would allocate them: first expiry, first out, with earlier
+lines for the same product consuming stock before later ones. Only batches
+that are still in date on the requested delivery date count.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Product, DosePack, Batch
+
+UNKNOWN_PRODUCT = 'unknown_product'
+INVALID_DOSE_PACK = 'invalid_dose_pack'
+LEAD_TIME = 'lead_time'
+INSUFFICIENT_STOCK = 'insufficient_stock'
+
+# Batches in these states never count towards availability
+UNAVAILABLE_BATCH_STATUSES = ('expired', 'shipped')
+
+
+def _stock_buckets(product_ids):
+    """{product_id: [[expiry_date, unreserved_packs], ...]} in expiry order."""
+    buckets = defaultdict(list)
+    rows = (
+        Batch.objects.filter(product_id__in=product_ids, quantity__gt=F('quantity_reserved'))
+        .exclude(status__in=UNAVAILABLE_BATCH_STATUSES)
+        .values('product_id', 'expiry_date')
+        .annotate(packs=Sum(F('quantity') - F('quantity_reserved')))
+        .order_by('product_id', 'expiry_date')
+    )
+    for row in rows:
+        buckets[row['product_id']].append([row['expiry_date'], row['packs']])
+    return buckets
+
+
+def check_availability(lines, today=None):
+    """Evaluate `[{product, dose_pack?, quantity, requested_delivery_date?}, ...]`.
+
+    Returns one dict per line, in order, with `feasible`, the packs
+    `available` to it, the `shortfall`, the `earliest_delivery_date` the
+    product's lead time allows, and `reasons` when it is not feasible.
+    """
+    today = today or timezone.localdate()
+    product_ids = {line['product'] for line in lines}
+    lead_times = dict(Product.objects.filter(pk__in=product_ids).values_list('id', 'lead_time_days'))
+    dose_pack_ids = {line['dose_pack'] for line in lines if line.get('dose_pack')}
+    dose_packs = dict(DosePack.objects.filter(pk__in=dose_pack_ids).values_list('id', 'product_id')) if dose_pack_ids else {}
+    buckets = _stock_buckets(lead_times.keys())
+
+    results = []
+    for index, line in enumerate(lines):
+        product_id, quantity = line['product'], line['quantity']
+        result = {
+            'index': index,
+            'product': product_id,
+            'dose_pack': line.get('dose_pack'),
+            'quantity': quantity,
+            'requested_delivery_date': line.get('requested_delivery_date'),
+        }
+        if product_id not in lead_times:
+            results.append({**result, 'feasible': False, 'available': 0, 'shortfall': quantity,
+                            'earliest_delivery_date': None, 'reasons': [UNKNOWN_PRODUCT]})
+            continue
+
+        reasons = []
+        if line.get('dose_pack') and dose_packs.get(line['dose_pack']) != product_id:
+            reasons.append(INVALID_DOSE_PACK)
+        earliest = today + timedelta(days=max(lead_times[product_id] or 0, 0))
+        delivery = line.get('requested_delivery_date') or earliest
+        if delivery < earliest:
+            reasons.append(LEAD_TIME)
+            delivery = earliest
+
+        # Stock must still be in date when it is delivered
+        eligible = [bucket for bucket in buckets[product_id] if bucket[0] >= delivery]
+        available = sum(packs for _, packs in eligible)
+        if available < quantity:
+            reasons.append(INSUFFICIENT_STOCK)
+        if not reasons:
+            # Later lines for the same product see what this one leaves behind
+            remaining = quantity
+            for bucket in eligible:
+                take = min(bucket[1], remaining)
+                bucket[1] -= take
+                remaining -= take
+                if not remaining:
+                    break
+        results.append({
+            **result,
+            'feasible': not reasons,
+            'available': available,
+            'shortfall': max(quantity - available, 0),
+            'earliest_delivery_date': earliest,
+            'reasons': reasons,
+        })
+    return results
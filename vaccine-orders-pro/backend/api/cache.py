@@ -0,0 +1,202 @@
+"""Versioned response cache for the public catalog endpoints.
+
+Rendered list/detail payloads are stored under keys that embed the current
+catalog version. Any write that can change what the catalog shows (product,
+dose pack or batch changes, stock reservations, stock adjustments) bumps the
+version, which makes every previously cached payload unreachable at once.
+
+The storage backend is configured with the ``CATALOG_CACHE`` setting::
+
+    CATALOG_CACHE = {
+        'BACKEND': 'locmem',     # or 'django' to use Django's cache framework
+        'MAX_ENTRIES': 256,      # LRU size cap for the locmem backend
+        'CACHE_ALIAS': 'default',  # cache alias for the django backend
+        'TIMEOUT': 60,           # seconds an entry lives (both backends)
+    }
+
+The locmem backend keeps the version per process, so a bump made by another
+process (a second gunicorn worker, or cron commands such as
+`expire_batches`, `refresh_stock_alerts` and `verify_stock_totals --fix`)
+never reaches it; its entries, including the memoized ETag validators, are
+then only bounded by `TIMEOUT`. Bumps only propagate across processes with
+the django backend pointed at a shared cache (Redis, Memcached, database)
+in `CACHES`; Django's default cache is a per-process LocMemCache and does
+not help.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+class LocMemLRUBackend:
+    """Thread-safe in-process LRU store with a hard entry cap and per-entry expiry.
+
+    `timeout=None` keeps entries until they are evicted or the version bumps.
+    """
+
+    def __init__(self, max_entries=256, timeout=None):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._version = 1
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                return None
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get_version(self):
+        return self._version
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+            # Entries for older versions can never be read again.
+            self._data.clear()
+            return self._version
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DjangoCacheBackend:
+    """Store entries and the version key in one of Django's configured caches."""
+
+    version_key = 'catalog:version'
+
+    def __init__(self, alias='default', timeout=60):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def get_version(self):
+        version = self.cache.get(self.version_key)
+        if version is None:
+            self.cache.add(self.version_key, 1, None)
+            version = self.cache.get(self.version_key, 1)
+        return version
+
+    def bump_version(self):
+        try:
+            return self.cache.incr(self.version_key)
+        except ValueError:
+            self.cache.add(self.version_key, 2, None)
+            return self.cache.get(self.version_key, 2)
+
+    def clear(self):
+        self.bump_version()
+
+
+def _build_backend(config):
+    backend = config.get('BACKEND', 'locmem')
+    if backend == 'django':
+        return DjangoCacheBackend(
+            alias=config.get('CACHE_ALIAS', 'default'),
+            timeout=config.get('TIMEOUT', 60),
+        )
+    if backend == 'locmem':
+        return LocMemLRUBackend(max_entries=config.get('MAX_ENTRIES', 256), timeout=config.get('TIMEOUT', 60))
+    raise ValueError(f"Unknown CATALOG_CACHE backend: {backend!r}")
+
+
+class CatalogCache:
+    """Facade over the configured backend that tracks hit/miss counters."""
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = _build_backend(getattr(settings, 'CATALOG_CACHE', {}))
+        return self._backend
+
+    def enabled(self):
+        return getattr(settings, 'CATALOG_CACHE', {}).get('ENABLED', True)
+
+    def make_key(self, *parts):
+        return ':'.join(['catalog', str(self.backend.get_version())] + [str(p) for p in parts])
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def bump_version(self):
+        return self.backend.bump_version()
+
+    def bump_version_on_commit(self):
+        """Invalidate once the surrounding transaction commits.
+
+        Bumping before commit would let a concurrent reader cache the
+        pre-commit state under the new version.
+        """
+        transaction.on_commit(self.bump_version)
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'backend': type(self.backend).__name__,
+            'version': self.backend.get_version(),
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else 0.0,
+        }
+
+    def reset(self, backend=None):
+        """Drop all entries and counters (and optionally swap the backend)."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+        if backend is not None:
+            self._backend = backend
+        elif self._backend is not None:
+            self._backend.clear()
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,281 @@
+"""Set-based writes for the server-side cart.
+
+The client PUTs the whole cart on every quantity change, so `replace_cart_items`
+diffs the incoming lines against the stored rows on the
+`(cart, product, dose_pack)` key instead of deleting and recreating them:
+changed rows go out in one `bulk_update`, new rows in one `bulk_create` and
+dropped rows in one DELETE. Product and dose pack ids are only looked up
+(with `in_bulk`) for lines that are not in the cart yet, so bumping the
+quantity of one line costs a single UPDATE.
+
+Reads go through `prefetch_cart()`: the lines, their products and dose packs
+come back in one joined query, loading only the product columns the compact
+`CartProductSerializer` snapshot needs unless the full products are asked for.
+
+`checkout_cart()` turns the stored cart into an order in one transaction:
+the order, its items (one `bulk_create`) and the initial status history row
+are inserted and the cart is emptied with one DELETE, so a failure leaves
+both the cart and the order book untouched.
+
+`merge_cart()` folds the anonymous, client-side cart into the stored one on
+login with the same diff: one `bulk_update` for lines both sides have and
+one `bulk_create` for the rest. (An `INSERT ... ON CONFLICT` upsert cannot
+be used because lines without a dose pack never conflict: NULLs are
+distinct in the unique key.)
+"""
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from .models import Product, DosePack, Batch, Cart, CartItem, Order, OrderItem, OrderStatusHistory
+
+LINE_FIELDS = ('quantity', 'requested_delivery_date', 'special_instructions')
+# Product columns read by CartProductSerializer
+SNAPSHOT_PRODUCT_FIELDS = (
+    'id', 'name', 'brand', 'species', 'image', 'image_url', 'image_alt',
+    'minimum_order_qty', 'lead_time_days', 'available_packs',
+)
+
+
+def cart_items_queryset(expand_products=False):
+    items = CartItem.objects.select_related('product', 'dose_pack').order_by('id')
+    if expand_products:
+        # Everything the full ProductSerializer renders
+        return items.prefetch_related(
+            Prefetch('product__dose_packs', queryset=DosePack.objects.order_by('id')),
+            Prefetch('product__batches', queryset=Batch.objects.order_by('expiry_date', 'id')),
+        )
+    return items.only(
+        'id', 'cart_id', 'product_id', 'dose_pack_id', *LINE_FIELDS,
+        *(f'product__{field}' for field in SNAPSHOT_PRODUCT_FIELDS),
+    )
+
+
+def prefetch_cart(cart, expand_products=False):
+    """Load `cart.items` (with products and dose packs) for serialization."""
+    prefetch_related_objects([cart], Prefetch('items', queryset=cart_items_queryset(expand_products)))
+    return cart
+
+
+def _as_id(value):
+    if isinstance(value, dict):
+        value = value.get('id')
+    if value in (None, ''):
+        return None
+    if isinstance(value, bool) or not str(value).isdigit():
+        raise ValidationError({'items': f'Invalid id: {value!r}.'})
+    return int(value)
+
+
+def _as_date(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, date):
+        return value
+    try:
+        parsed = parse_date(str(value))
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({'items': f'Invalid requested_delivery_date: {value!r}.'})
+    return parsed
+
+
+def _as_quantity(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        raise ValidationError({'items': f'Invalid quantity: {value!r}.'})
+
+
+def clean_lines(items_data):
+    """{(product_id, dose_pack_id): {field: value}} for the incoming lines.
+
+    Lines without a product or with a quantity below one are dropped; when a
+    key repeats, the last line wins.
+    """
+    lines = {}
+    for item in items_data:
+        product_id = _as_id(item.get('product'))
+        quantity = _as_quantity(item.get('quantity'))
+        if product_id is None or quantity < 1:
+            continue
+        lines[(product_id, _as_id(item.get('dose_pack')))] = {
+            'quantity': quantity,
+            'requested_delivery_date': _as_date(item.get('requested_delivery_date')),
+            'special_instructions': item.get('special_instructions') or '',
+        }
+    return lines
+
+
+def resolve_keys(keys):
+    """The subset of `(product_id, dose_pack_id)` keys that reference existing rows."""
+    product_ids = {product_id for product_id, _ in keys}
+    dose_pack_ids = {dose_pack_id for _, dose_pack_id in keys if dose_pack_id}
+    products = Product.objects.only('id').in_bulk(product_ids) if product_ids else {}
+    dose_packs = DosePack.objects.only('id', 'product_id').in_bulk(dose_pack_ids) if dose_pack_ids else {}
+    return {
+        (product_id, dose_pack_id) for product_id, dose_pack_id in keys
+        if product_id in products
+        and (dose_pack_id is None or (dose_pack_id in dose_packs and dose_packs[dose_pack_id].product_id == product_id))
+    }
+
+
+def _stored_lines(cart, lines):
+    """({key: CartItem} for stored rows matching `lines`, [pks of the other rows])."""
+    existing = {}
+    others = []
+    for item in cart.items.only('id', 'product_id', 'dose_pack_id', *LINE_FIELDS).order_by('id'):
+        key = (item.product_id, item.dose_pack_id)
+        if key in lines and key not in existing:
+            existing[key] = item
+        else:
+            others.append(item.pk)
+    return existing, others
+
+
+def _new_items(cart, lines, existing):
+    new_keys = resolve_keys(lines.keys() - existing.keys())
+    return [
+        CartItem(cart=cart, product_id=product_id, dose_pack_id=dose_pack_id, **lines[(product_id, dose_pack_id)])
+        for product_id, dose_pack_id in lines if (product_id, dose_pack_id) in new_keys
+    ]
+
+
+@transaction.atomic
+def replace_cart_items(cart, items_data):
+    """Make `cart` hold exactly `items_data`; returns (created, updated, deleted).
+
+    Lines that reference unknown products or a dose pack of another product
+    are skipped, so a cart holding a since-deleted product stays writable.
+    """
+    lines = clean_lines(items_data)
+    existing, stale = _stored_lines(cart, lines)
+
+    now = timezone.now()
+    changed = []
+    for key, item in existing.items():
+        values = lines[key]
+        if any(getattr(item, field) != values[field] for field in LINE_FIELDS):
+            for field in LINE_FIELDS:
+                setattr(item, field, values[field])
+            item.updated_at = now
+            changed.append(item)
+
+    created = _new_items(cart, lines, existing)
+
+    if stale:
+        CartItem.objects.filter(pk__in=stale).delete()
+    if changed:
+        CartItem.objects.bulk_update(changed, [*LINE_FIELDS, 'updated_at'])
+    if created:
+        CartItem.objects.bulk_create(created)
+    return len(created), len(changed), len(stale)
+
+
+MERGE_SUM = 'sum'
+MERGE_MAX = 'max'
+MERGE_STRATEGIES = (MERGE_SUM, MERGE_MAX)
+
+
+@transaction.atomic
+def merge_cart(user, items_data, strategy=MERGE_SUM):
+    """Merge a client-side cart into `user`'s stored cart and return the cart.
+
+    Stored lines not in `items_data` are kept. Matching lines combine their
+    quantities by `strategy` and keep the stored delivery date and
+    instructions unless those are blank; the rest are inserted.
+    """
+    cart, _ = Cart.objects.get_or_create(user=user)
+    # Serialize concurrent merges (e.g. two tabs logging in) on the cart row
+    cart = Cart.objects.select_for_update().get(pk=cart.pk)
+    lines = clean_lines(items_data)
+    existing, _ = _stored_lines(cart, lines)
+
+    now = timezone.now()
+    changed = []
+    for key, item in existing.items():
+        incoming = lines[key]
+        if strategy == MERGE_MAX:
+            quantity = max(item.quantity, incoming['quantity'])
+        else:
+            quantity = item.quantity + incoming['quantity']
+        merged = {
+            'quantity': quantity,
+            'requested_delivery_date': item.requested_delivery_date or incoming['requested_delivery_date'],
+            'special_instructions': item.special_instructions or incoming['special_instructions'],
+        }
+        if any(getattr(item, field) != merged[field] for field in LINE_FIELDS):
+            for field in LINE_FIELDS:
+                setattr(item, field, merged[field])
+            item.updated_at = now
+            changed.append(item)
+
+    created = _new_items(cart, lines, existing)
+    if changed:
+        CartItem.objects.bulk_update(changed, [*LINE_FIELDS, 'updated_at'])
+    if created:
+        CartItem.objects.bulk_create(created)
+    return cart
+
+
+def unit_price_for(product, dose_pack):
+    """Server-side unit price of a cart line.
+
+    The catalog carries no list prices yet (orders are quoted after
+    confirmation), so lines are priced at zero; client-sent prices are never
+    trusted.
+    """
+    return Decimal('0.00')
+
+
+@transaction.atomic
+def checkout_cart(user, notes=''):
+    """Place the user's cart as a new `requested` order and empty the cart.
+
+    Raises `ValidationError` when the cart is empty or a line's product no
+    longer exists. Lines without a delivery date get the product's lead time.
+    """
+    # Locking the cart row makes a double-submitted checkout wait and then find it empty
+    cart = Cart.objects.select_for_update().filter(user=user).first()
+    items = list(cart.items.select_related('product', 'dose_pack').order_by('id')) if cart else []
+    if not items:
+        raise ValidationError({'items': 'Cart is empty.'})
+    missing = [item.pk for item in items if item.product is None]
+    if missing:
+        raise ValidationError({'items': f'Cart lines {missing} reference products that no longer exist.'})
+
+    today = timezone.localdate()
+    order_items = []
+    for item in items:
+        product, dose_pack = item.product, item.dose_pack
+        order_items.append(OrderItem(
+            product=product,
+            product_name=product.name,
+            dose_pack=dose_pack,
+            doses=dose_pack.doses if dose_pack else 0,
+            quantity=item.quantity,
+            unit_price=unit_price_for(product, dose_pack),
+            requested_delivery_date=item.requested_delivery_date or today + timedelta(days=max(product.lead_time_days, 0)),
+            special_instructions=item.special_instructions,
+        ))
+
+    order = Order.objects.create(
+        user=user,
+        order_number=f"ORD{uuid.uuid4().hex[:12].upper()}",
+        notes=notes,
+        status=Order.STATUS_CHOICES[0][0],
+        total_amount=sum((line.unit_price * line.quantity for line in order_items), Decimal('0.00')),
+    )
+    for line in order_items:
+        line.order = order
+    OrderItem.objects.bulk_create(order_items)
+    OrderStatusHistory.objects.create(order=order, status=order.status, changed_by=None)
+    CartItem.objects.filter(cart=cart).delete()
+    return order
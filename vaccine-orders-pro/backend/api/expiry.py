@@ -0,0 +1,67 @@
+"""Expiry sweeper: moves batches past their expiry date to `status='expired'`.
+
+Run daily from cron via `manage.py expire_batches`. Each chunk is one
+transaction: the batch ids are read (and locked) in expiry order through
+the partial `batch_unexpired_expiry_idx` index, flipped with one UPDATE,
+logged with one `bulk_create`, and the affected products' stock totals,
+nearest expiry, alerts and the catalog cache are refreshed. Expired batches
+are then skipped by allocation and excluded from the stock totals.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .alerts import refresh_alerts
+from .cache import catalog_cache
+from .inventory import apply_stock_deltas, refresh_nearest_expiry
+from .models import Batch, InventoryLog
+
+# Batches already gone from the warehouse are left alone
+SKIPPED_STATUSES = (Batch.EXPIRED, 'shipped')
+
+
+def due_batches(today=None):
+    today = today or timezone.localdate()
+    return Batch.objects.filter(expiry_date__lt=today).exclude(status__in=SKIPPED_STATUSES)
+
+
+def expire_batches(today=None, chunk_size=1000, performed_by=None):
+    """Expire every batch past its expiry date; returns (batches, products) touched."""
+    today = today or timezone.localdate()
+    expired = 0
+    products = set()
+    while True:
+        with transaction.atomic():
+            rows = list(
+                due_batches(today).select_for_update()
+                .order_by('expiry_date', 'id')
+                .values_list('id', 'product_id', 'batch_number', 'expiry_date', 'quantity', 'quantity_reserved')
+                [:chunk_size]
+            )
+            if not rows:
+                break
+            Batch.objects.filter(pk__in=[row[0] for row in rows]).update(
+                status=Batch.EXPIRED, updated_at=timezone.now()
+            )
+            written_off = defaultdict(int)
+            logs = []
+            for batch_id, product_id, batch_number, expiry_date, quantity, reserved in rows:
+                available = quantity - reserved
+                written_off[product_id] += available
+                logs.append(InventoryLog(
+                    product_id=product_id,
+                    batch_id=batch_id,
+                    action='expired',
+                    quantity_changed=-available,
+                    reason=f'Batch {batch_number} expired on {expiry_date.isoformat()}',
+                    performed_by=performed_by,
+                ))
+            InventoryLog.objects.bulk_create(logs)
+            apply_stock_deltas({pid: {'available': -packs} for pid, packs in written_off.items()})
+            refresh_nearest_expiry(written_off.keys())
+            refresh_alerts(written_off.keys())
+            catalog_cache.bump_version_on_commit()
+        expired += len(rows)
+        products.update(written_off)
+    return expired, len(products)
@@ -0,0 +1,85 @@
+"""Faceted catalog filtering backed by the `ProductFacetCount` table.
+
+Counts are catalog-wide and are adjusted by +1/-1 on product create,
+delete and facet-value changes (see `api.signals`), so the facet API reads
+a few dozen rows instead of running a GROUP BY per facet on every request.
+`manage.py rebuild_facet_counts` recomputes the table from scratch.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Product, ProductFacetCount
+
+FACET_FIELDS = Product.FACET_FIELDS
+
+
+def adjust_facet_counts(old_values, new_values):
+    """Move one product's contribution from `old_values` to `new_values`.
+
+    Either side may be None (product created / deleted).
+    """
+    for facet in FACET_FIELDS:
+        old = old_values.get(facet) if old_values else None
+        new = new_values.get(facet) if new_values else None
+        if old == new:
+            continue
+        if old is not None:
+            ProductFacetCount.objects.filter(facet=facet, value=old).update(count=F('count') - 1)
+        if new is not None:
+            updated = ProductFacetCount.objects.filter(facet=facet, value=new).update(count=F('count') + 1)
+            if not updated:
+                row, created = ProductFacetCount.objects.get_or_create(facet=facet, value=new, defaults={'count': 1})
+                if not created:
+                    ProductFacetCount.objects.filter(pk=row.pk).update(count=F('count') + 1)
+
+
+def facet_counts():
+    """{facet: [{'value', 'count'}, ...]} for every facet, most common first."""
+    counts = {facet: [] for facet in FACET_FIELDS}
+    for facet, value, count in (
+        ProductFacetCount.objects.filter(count__gt=0)
+        .order_by('facet', '-count', 'value')
+        .values_list('facet', 'value', 'count')
+    ):
+        if facet in counts:
+            counts[facet].append({'value': value, 'count': count})
+    return counts
+
+
+def parse_facet_filters(params):
+    """Read `?species=poultry&brand=A&brand=B` style filters from query params."""
+    filters = {}
+    for facet in FACET_FIELDS:
+        values = [v for v in params.getlist(facet) if v != '']
+        if not values:
+            continue
+        if facet == 'cold_chain_required':
+            values = [v.lower() in ('1', 'true', 'yes') for v in values]
+        filters[facet] = values
+    return filters
+
+
+def filter_by_facets(queryset, filters):
+    """AND across facets, OR within a facet; each facet column is indexed."""
+    for facet, values in filters.items():
+        queryset = queryset.filter(**{f'{facet}__in': values})
+    return queryset
+
+
+@transaction.atomic
+def rebuild_facet_counts():
+    totals = defaultdict(int)
+    for facet in FACET_FIELDS:
+        for row in Product.objects.order_by().values(facet).annotate(n=Count('id')):
+            value = row[facet]
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            totals[(facet, value)] += row['n']
+    ProductFacetCount.objects.all().delete()
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(facet=facet, value=value, count=count)
+        for (facet, value), count in totals.items()
+    ])
+    return len(totals)
@@ -0,0 +1,120 @@
+"""In-memory SPA shell (`index.html`) for `FrontendCatchallView`.
+
+The shell is read once per process and kept in memory with its gzip (and,
+when the optional `brotli` package is installed, brotli) encodings and a
+strong ETag per encoding. Each request costs one `os.stat()` to notice a
+redeploy (mtime/inode/size change), instead of two `exists()` calls and a
+full read.
+
+`manage.py warmup_frontend` (run after `collectstatic`) writes the
+compressed variants next to `index.html` as `index.html.gz` / `.br`, so
+workers load them instead of compressing on their first request.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+
+def shell_candidates():
+    base_dir = Path(settings.BASE_DIR)
+    return [Path(settings.STATIC_ROOT) / 'index.html', base_dir.parent / 'dist' / 'index.html']
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=11)
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+class Shell:
+    def __init__(self, path, stat, content):
+        self.path = path
+        self.signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        digest = hashlib.sha256(content).hexdigest()[:32]
+        # encoding -> (body, strong etag); strong ETags must differ per encoding
+        self.variants = {'identity': (content, f'"{digest}"')}
+        for encoding in available_encodings():
+            body = self._precompressed(path, stat, encoding) or compress(content, encoding)
+            if len(body) < len(content):
+                self.variants[encoding] = (body, f'"{digest}-{encoding}"')
+
+    @staticmethod
+    def _precompressed(path, stat, encoding):
+        sibling = Path(str(path) + ENCODING_SUFFIXES[encoding])
+        try:
+            if sibling.stat().st_mtime_ns >= stat.st_mtime_ns:
+                return sibling.read_bytes()
+        except OSError:
+            pass
+        return None
+
+    def negotiate(self, accept_encoding):
+        """(encoding, body, etag) for the best encoding the client accepts."""
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.variants:
+                return (encoding,) + self.variants[encoding]
+        return ('identity',) + self.variants['identity']
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if name and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class ShellCache:
+    def __init__(self):
+        self._shell = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """The current shell, reloaded if the file changed; None if there is none."""
+        shell = self._shell
+        if shell is not None:
+            try:
+                stat = os.stat(shell.path)
+            except OSError:
+                stat = None
+            if stat is not None and (stat.st_ino, stat.st_mtime_ns, stat.st_size) == shell.signature:
+                return shell
+        return self.load()
+
+    def load(self):
+        with self._lock:
+            for path in shell_candidates():
+                try:
+                    stat = os.stat(path)
+                    content = path.read_bytes()
+                except OSError:
+                    continue
+                self._shell = Shell(path, stat, content)
+                return self._shell
+            self._shell = None
+            return None
+
+    def clear(self):
+        self._shell = None
+
+
+shell_cache = ShellCache()
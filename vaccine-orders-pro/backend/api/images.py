@@ -0,0 +1,290 @@
+"""Resized WebP/JPEG variants of uploaded Product and Batch images.
+
+Variants live under `MEDIA_ROOT/<DIRECTORY>/<digest>/<width>.<ext>`, where
+`digest` is a hash of the source image's content, so a variant URL never
+changes meaning and can be cached forever. They are generated when an image
+is uploaded (see api/signals.py) or by `manage.py build_image_variants`
+(for images uploaded before this module existed); serializers only look
+them up. A small manifest per source image, under `<DIRECTORY>/_sources/`,
+maps the image's storage name to its digest and widths.
+
+Disk use is capped at `MAX_BYTES`: whenever variants are generated, the
+least recently used directories no current Product or Batch row references
+are removed until the total fits. A directory's mtime is its last use: it
+is set when the variants are built and refreshed (at most once per
+`TOUCH_INTERVAL` seconds per process) when api/media.py serves one of them.
+Variants served straight from disk by the web server record no use, so
+eviction there falls back to build order.
+
+Settings (`IMAGE_VARIANTS` in core/settings.py):
+    ENABLED, WIDTHS, FORMATS ('webp', 'jpeg'), QUALITY, DIRECTORY,
+    MAX_BYTES, TOUCH_INTERVAL
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'WIDTHS': (160, 320, 640, 1024),
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'DIRECTORY': 'variants',
+    'MAX_BYTES': 512 * 1024 * 1024,
+    'TOUCH_INTERVAL': 3600,
+}
+
+# format name -> (Pillow format, file extension)
+FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+# Subdirectory of the variant root holding the per-source manifests
+MANIFESTS = '_sources'
+# Seconds before a lookup that found no variants reads the manifest again
+MISS_TTL = 30
+
+# image name -> (retry_at or None, (digest, widths) or None)
+_index = {}
+# digest -> time.monotonic() of the last use this process recorded
+_touched = {}
+
+
+def variant_settings():
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_VARIANTS', {})}
+
+
+def variant_root():
+    return Path(settings.MEDIA_ROOT) / variant_settings()['DIRECTORY']
+
+
+def _source_path(field_file):
+    if not field_file or not field_file.name:
+        return None
+    try:
+        return field_file.path
+    except (NotImplementedError, ValueError):
+        # Storage without local paths (e.g. object storage): no variants
+        return None
+
+
+def _content_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:24]
+
+
+def _target_widths(source_width, widths):
+    # Never upscale; an image narrower than every width gets one variant at its own size
+    return [w for w in sorted(widths) if w <= source_width] or [source_width]
+
+
+def _generate(path, directory, config):
+    """Write any missing variants of `path` into `directory`; returns the widths."""
+    with Image.open(path) as source:
+        source = ImageOps.exif_transpose(source)
+        widths = _target_widths(source.width, config['WIDTHS'])
+        directory.mkdir(parents=True, exist_ok=True)
+        for width in widths:
+            height = max(1, round(source.height * width / source.width))
+            resized = None
+            for name in config['FORMATS']:
+                pil_format, extension = FORMATS[name]
+                target = directory / f'{width}.{extension}'
+                if target.exists():
+                    continue
+                if resized is None:
+                    resized = source.resize((width, height), Image.LANCZOS) if width != source.width else source.copy()
+                image = resized
+                if pil_format == 'JPEG' and image.mode != 'RGB':
+                    image = _flatten(image)
+                elif pil_format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA')
+                # Write then rename so other workers never see a partial file
+                partial = directory / f'.{width}.{extension}.{os.getpid()}'
+                image.save(partial, pil_format, quality=config['QUALITY'])
+                os.replace(partial, target)
+    return widths
+
+
+def _flatten(image):
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def _manifest_path(name):
+    return variant_root() / MANIFESTS / hashlib.sha256(name.encode()).hexdigest()[:24]
+
+
+def _read_manifest(name):
+    try:
+        manifest = json.loads(_manifest_path(name).read_text())
+        return manifest['digest'], manifest['widths']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_manifest(name, digest, widths):
+    path = _manifest_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f'.{path.name}.{os.getpid()}')
+    partial.write_text(json.dumps({'name': name, 'digest': digest, 'widths': widths}))
+    os.replace(partial, path)
+
+
+def lookup_variants(field_file):
+    """(digest, widths) for an image's existing variants, or None.
+
+    Never hashes, generates or evicts anything: this runs while serializing
+    responses. The answer is memoized per image name (storage names are
+    never reused for different content); misses are retried after
+    `MISS_TTL` seconds so variants built by another process show up.
+    """
+    if not variant_settings()['ENABLED'] or not field_file or not field_file.name:
+        return None
+    name = field_file.name
+    cached = _index.get(name)
+    now = time.monotonic()
+    if cached is not None and (cached[0] is None or cached[0] > now):
+        return cached[1]
+    variants = _read_manifest(name)
+    _index[name] = (None if variants else now + MISS_TTL, variants)
+    return variants
+
+
+def ensure_variants(field_file, quota=True):
+    """(digest, widths) for an image's variants, generating missing ones.
+
+    Called after an upload commits (api/signals.py) and by the
+    `build_image_variants` command, never on the request path. Returns None
+    when variants are disabled or the image is missing, unreadable or not
+    stored on the local filesystem. With `quota`, evicts unreferenced
+    variants afterwards (see `enforce_quota`).
+    """
+    config = variant_settings()
+    if not config['ENABLED']:
+        return None
+    path = _source_path(field_file)
+    if path is None:
+        return None
+    existing = _read_manifest(field_file.name)
+    if existing is not None and (variant_root() / existing[0]).is_dir():
+        _index[field_file.name] = (None, existing)
+        return existing
+
+    try:
+        digest = _content_digest(path)
+        widths = _generate(path, variant_root() / digest, config)
+        os.utime(variant_root() / digest)
+        _write_manifest(field_file.name, digest, widths)
+    except (OSError, Image.DecompressionBombError) as exc:
+        logger.warning('Could not build image variants for %s: %s', path, exc)
+        return None
+    _index[field_file.name] = (None, (digest, widths))
+    if quota:
+        enforce_quota()
+    return digest, widths
+
+
+def variant_srcsets(field_file, request=None):
+    """{'webp': 'url 160w, url 320w', 'jpeg': ...} for an image, or None."""
+    variants = lookup_variants(field_file)
+    if variants is None:
+        return None
+    digest, widths = variants
+    config = variant_settings()
+    base = f"{settings.MEDIA_URL.rstrip('/')}/{config['DIRECTORY']}/{digest}"
+    if request is not None:
+        base = request.build_absolute_uri(base)
+    return {
+        name: ', '.join(f'{base}/{width}.{FORMATS[name][1]} {width}w' for width in widths)
+        for name in config['FORMATS']
+    }
+
+
+def mark_used(digest):
+    """Record that a variant of `digest` was served, for the LRU quota."""
+    if digest == MANIFESTS:
+        return
+    now = time.monotonic()
+    last = _touched.get(digest)
+    if last is not None and now - last < variant_settings()['TOUCH_INTERVAL']:
+        return
+    _touched[digest] = now
+    try:
+        os.utime(variant_root() / digest)
+    except OSError:
+        pass
+
+
+def referenced_images():
+    """Names of the images current Product and Batch rows point at."""
+    from .models import Batch, Product
+
+    names = set()
+    for model in (Product, Batch):
+        names.update(model.objects.exclude(image__isnull=True).exclude(image='').values_list('image', flat=True))
+    return names
+
+
+def enforce_quota():
+    """Delete the least recently used unreferenced variant directories until under MAX_BYTES.
+
+    Directories of images that current rows still use are never removed,
+    so the total may stay above the cap. Returns the number removed.
+    """
+    root = variant_root()
+    if not root.is_dir():
+        return 0
+    referenced = referenced_images()
+    in_use = set()
+    manifests = {}  # digest -> manifest files pointing at it
+    for path in (root / MANIFESTS).glob('*') if (root / MANIFESTS).is_dir() else ():
+        try:
+            manifest = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        manifests.setdefault(manifest.get('digest'), []).append(path)
+        if manifest.get('name') in referenced:
+            in_use.add(manifest.get('digest'))
+
+    entries = []
+    total = 0
+    for directory in root.iterdir():
+        if not directory.is_dir() or directory.name == MANIFESTS:
+            continue
+        try:
+            size = sum(f.stat().st_size for f in directory.iterdir())
+            last_used = directory.stat().st_mtime
+        except OSError:
+            continue
+        entries.append((last_used, size, directory))
+        total += size
+
+    limit = variant_settings()['MAX_BYTES']
+    removed = 0
+    for last_used, size, directory in sorted(entries, key=lambda entry: entry[0]):
+        if total <= limit:
+            break
+        if directory.name in in_use:
+            continue
+        shutil.rmtree(directory, ignore_errors=True)
+        for path in manifests.get(directory.name, ()):
+            path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,121 @@
+"""Maintenance of the denormalized stock columns on `Product`.
+
+`Product.available_packs`, `reserved_packs`, `total_units` and
+`nearest_expiry` mirror what used to be computed per request from the
+product's batches and dose packs. Batch and dose pack writes adjust them
+with atomic `F()` deltas (see `api.signals`); code paths that bypass model
+signals (`bulk_update`, `QuerySet.update`) must call these helpers directly.
+`manage.py verify_stock_totals` recomputes them from scratch.
+
+Expired batches (`status='expired'`, set by `manage.py expire_batches`)
+add nothing to `available_packs` or `nearest_expiry`.
+"""
+from django.db.models import F, Sum, Min, IntegerField, Subquery, OuterRef, Value, Case, When
+from django.db.models.functions import Coalesce
+
+from .models import Product, Batch, DosePack
+
+
+def apply_stock_delta(product_id, available=0, reserved=0, units=0):
+    """Atomically shift a product's stored totals by the given deltas."""
+    if not product_id or not (available or reserved or units):
+        return
+    Product.objects.filter(pk=product_id).update(
+        available_packs=F('available_packs') + available,
+        reserved_packs=F('reserved_packs') + reserved,
+        total_units=F('total_units') + units,
+    )
+
+
+def apply_stock_deltas(deltas, chunk_size=500):
+    """Apply many `apply_stock_delta` calls as one UPDATE per chunk.
+
+    `deltas` maps product id to a dict with any of `available`, `reserved`
+    and `units`.
+    """
+    deltas = {pid: d for pid, d in deltas.items() if pid and any(d.values())}
+    product_ids = list(deltas)
+    for start in range(0, len(product_ids), chunk_size):
+        chunk = product_ids[start:start + chunk_size]
+        updates = {}
+        for key, field in (('available', 'available_packs'), ('reserved', 'reserved_packs'), ('units', 'total_units')):
+            whens = [When(pk=pid, then=Value(deltas[pid][key])) for pid in chunk if deltas[pid].get(key)]
+            if whens:
+                updates[field] = F(field) + Case(*whens, default=Value(0), output_field=IntegerField())
+        Product.objects.filter(pk__in=chunk).update(**updates)
+
+
+def _batch_subquery(expression, include_expired=True):
+    batches = Batch.objects.filter(product=OuterRef('pk'))
+    if not include_expired:
+        batches = batches.exclude(status=Batch.EXPIRED)
+    return Subquery(
+        batches
+        .order_by()
+        .values('product')
+        .annotate(value=expression)
+        .values('value')[:1]
+    )
+
+
+def nearest_expiry_subquery():
+    return Subquery(
+        Batch.objects.filter(product=OuterRef('pk'), quantity__gt=F('quantity_reserved'))
+        .exclude(status=Batch.EXPIRED)
+        .order_by()
+        .values('product')
+        .annotate(value=Min('expiry_date'))
+        .values('value')[:1]
+    )
+
+
+def refresh_nearest_expiry(product_ids):
+    """Recompute `nearest_expiry` for the given products in one UPDATE.
+
+    A minimum cannot be maintained with deltas, so it is re-derived from
+    the product's batches whenever one of them changes.
+    """
+    product_ids = [pid for pid in set(product_ids) if pid]
+    if product_ids:
+        Product.objects.filter(pk__in=product_ids).update(nearest_expiry=nearest_expiry_subquery())
+
+
+def _expected_stock_expressions():
+    zero = Value(0)
+    return {
+        'available_packs': Coalesce(
+            _batch_subquery(Sum(F('quantity') - F('quantity_reserved')), include_expired=False),
+            zero,
+            output_field=IntegerField(),
+        ),
+        'reserved_packs': Coalesce(
+            _batch_subquery(Sum('quantity_reserved')), zero, output_field=IntegerField()
+        ),
+        'total_units': Coalesce(
+            Subquery(
+                DosePack.objects.filter(product=OuterRef('pk'))
+                .order_by()
+                .values('product')
+                .annotate(value=Sum('units_per_pack'))
+                .values('value')[:1]
+            ),
+            zero,
+            output_field=IntegerField(),
+        ),
+        'nearest_expiry': nearest_expiry_subquery(),
+    }
+
+
+def annotate_expected_stock(queryset):
+    """Annotate `expected_<field>` for each stock field, computed from batches and dose packs."""
+    return queryset.annotate(
+        **{f'expected_{name}': expression for name, expression in _expected_stock_expressions().items()}
+    )
+
+
+def recompute_stock_totals(product_ids=None):
+    """Rewrite the stored totals from scratch; returns the number of products updated."""
+    queryset = Product.objects.all()
+    if product_ids is not None:
+        queryset = queryset.filter(pk__in=product_ids)
+    return queryset.update(**_expected_stock_expressions())
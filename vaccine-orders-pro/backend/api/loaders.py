@@ -0,0 +1,113 @@
+"""Request-scoped identity maps for related rows, in the spirit of DataLoader.
+
+Serializers used to fetch `UserProfile` (and products / dose packs) one row
+at a time, so a response could load the same profile dozens of times. A
+`Loader` collects the keys a response will need (`prime`) and fetches all
+outstanding keys with one `IN` query the first time any of them is read;
+every row (and every miss) is then memoized for the rest of the request.
+
+`get_loader(context, model, field)` returns the loader shared by all
+serializers rendering the same request, and `attach()` stores loaded rows in
+Django's relation cache, so `order.user.profile` just works afterwards.
+List serializers built with `LoaderListSerializer` call the child's
+`prime_loaders(instances)` before rendering, which is how every related set
+costs one query however deeply the serializer tree nests.
+"""
+from rest_framework import serializers
+from django.db import models
+
+
+class Loader:
+    """Batching, memoizing lookup of `queryset` rows by `field`."""
+
+    def __init__(self, queryset, field='pk'):
+        self.queryset = queryset
+        self.field = field
+        self.attname = 'pk' if field == 'pk' else queryset.model._meta.get_field(field).attname
+        self._cache = {}
+        self._pending = set()
+
+    def prime(self, keys):
+        """Queue `keys` to be fetched with the next batch."""
+        self._pending.update(key for key in keys if key is not None and key not in self._cache)
+
+    def add(self, instances):
+        """Seed the identity map with rows that are already loaded."""
+        for instance in instances:
+            self._cache.setdefault(getattr(instance, self.attname), instance)
+
+    def load_many(self, keys):
+        """{key: row or None} for `keys`, fetching everything outstanding in one query."""
+        keys = [key for key in keys if key is not None]
+        self.prime(keys)
+        if self._pending:
+            pending, self._pending = self._pending, set()
+            found = {
+                getattr(row, self.attname): row
+                for row in self.queryset.filter(**{f'{self.field}__in': pending})
+            }
+            for key in pending:
+                self._cache[key] = found.get(key)
+        return {key: self._cache[key] for key in keys}
+
+    def load(self, key):
+        if key is None:
+            return None
+        return self.load_many([key])[key]
+
+
+def get_loader(context, model, field='pk'):
+    """The request's loader for `model` rows keyed by `field`.
+
+    Loaders live on the underlying `HttpRequest`, so every serializer in the
+    request shares them; without a request they live in the context dict.
+    """
+    request = context.get('request')
+    holder = getattr(request, '_request', request)
+    if holder is None:
+        registry = context.setdefault('_loaders', {})
+    else:
+        registry = holder.__dict__.setdefault('_loaders', {})
+    key = (model, field)
+    if key not in registry:
+        registry[key] = Loader(model._default_manager.all(), field)
+    return registry[key]
+
+
+def attach(instances, relation, loader):
+    """Fill the `relation` cache of `instances` from `loader` (one query at most).
+
+    `relation` is a forward foreign key / one-to-one (keyed by its `_id`
+    column) or a reverse one-to-one (keyed by the instance's pk, with the
+    loader keyed by the remote field). Instances whose relation is already
+    cached, e.g. through `select_related`, are left alone; a missing reverse
+    one-to-one row is cached as absent and still raises `DoesNotExist`.
+    """
+    instances = [instance for instance in instances if instance is not None]
+    if not instances:
+        return
+    field = instances[0]._meta.get_field(relation)
+    attname = field.attname if field.concrete else 'pk'
+    # Reading a deferred key column would cost a query per instance
+    pending = [
+        instance for instance in instances
+        if not field.is_cached(instance) and attname not in instance.get_deferred_fields()
+    ]
+    if not pending:
+        return
+    loader.add(field.get_cached_value(instance) for instance in instances
+               if field.is_cached(instance) and field.get_cached_value(instance) is not None)
+    rows = loader.load_many(getattr(instance, attname) for instance in pending)
+    for instance in pending:
+        field.set_cached_value(instance, rows.get(getattr(instance, attname)))
+
+
+class LoaderListSerializer(serializers.ListSerializer):
+    """Primes the request loaders for the whole list before rendering it."""
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        prime = getattr(self.child, 'prime_loaders', None)
+        if prime is not None:
+            prime(items)
+        return [self.child.to_representation(item) for item in items]
@@ -0,0 +1,112 @@
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.allocation import allocate_order
+from api.models import Product, DosePack, Batch, Order, OrderItem, InventoryLog
+
+
+def legacy_allocate_order(order, performed_by=None):
+    """The per-item, per-batch loop `set_status` used before api/allocation.py."""
+    for item in order.items.select_related('product', 'dose_pack').all():
+        product = item.product
+        if not product:
+            continue
+        units_per_pack = 1
+        if item.dose_pack:
+            units_per_pack = getattr(item.dose_pack, 'units_per_pack', 1) or 1
+        packs_needed = int(item.quantity or 0)
+        if packs_needed <= 0:
+            continue
+        batches_qs = Batch.objects.select_for_update().filter(product=product).order_by('expiry_date')
+        remaining_packs = packs_needed
+        for batch in batches_qs:
+            available_packs = batch.quantity - batch.quantity_reserved
+            if available_packs <= 0:
+                continue
+            take = min(available_packs, remaining_packs)
+            batch.quantity_reserved = batch.quantity_reserved + take
+            batch.save()
+            InventoryLog.objects.create(
+                product=product,
+                batch=batch,
+                action='reserved',
+                quantity_changed=-(take * int(units_per_pack)),
+                reason=f'Confirmed order {order.order_number}',
+                related_order=order,
+                performed_by=performed_by,
+            )
+            remaining_packs -= take
+            if remaining_packs <= 0:
+                break
+        dose_pack_units = sum(dp.units_per_pack for dp in product.dose_packs.all())
+        batch_packs = sum(b.quantity - b.quantity_reserved for b in Batch.objects.filter(product=product))
+        product.available_stock = int(dose_pack_units + batch_packs)
+        product.save()
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare the set-based order allocation engine with the legacy per-item loop (data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=40, help='Order lines (one product each)')
+        parser.add_argument('--batches', type=int, default=5, help='Batches per product')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        results = {'legacy': [], 'engine': []}
+        for _ in range(options['repeat']):
+            for name, allocate in (('legacy', legacy_allocate_order), ('engine', allocate_order)):
+                try:
+                    with transaction.atomic():
+                        order, user = self._build_order(options['lines'], options['batches'])
+                        with CaptureQueriesContext(connection) as ctx:
+                            started = time.perf_counter()
+                            allocate(order, performed_by=user)
+                            elapsed = (time.perf_counter() - started) * 1000
+                        results[name].append((len(ctx.captured_queries), elapsed))
+                        raise _Rollback
+                except _Rollback:
+                    pass
+
+        self.stdout.write(f"{options['lines']} lines x {options['batches']} batches per product")
+        for name, runs in results.items():
+            queries = runs[0][0]
+            best = min(ms for _, ms in runs)
+            self.stdout.write(f'{name:>7}: {queries:5d} queries  {best:8.2f} ms (best of {len(runs)})')
+
+    def _build_order(self, lines, batches_per_product):
+        suffix = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(username=f'bench-{suffix}')
+        order = Order.objects.create(user=user, order_number=f'BENCH{suffix}', total_amount=Decimal('0'))
+        today = date.today()
+        for line in range(lines):
+            product = Product.objects.create(
+                name=f'Bench product {line}', brand='Bench', species='poultry', product_type='live',
+                manufacturer='Bench', description='', active_ingredients='', storage_temp_range='2-8C',
+                administration_notes='',
+            )
+            dose_pack = DosePack.objects.create(product=product, doses=100, units_per_pack=1)
+            Batch.objects.bulk_create([
+                Batch(
+                    product=product, batch_number=f'BENCH-{suffix}-{line}-{b}',
+                    expiry_date=today + timedelta(days=30 * (b + 1)), quantity=10,
+                )
+                for b in range(batches_per_product)
+            ])
+            OrderItem.objects.create(
+                order=order, product=product, product_name=product.name, dose_pack=dose_pack,
+                doses=dose_pack.doses, quantity=10 * batches_per_product - 5, unit_price=Decimal('1.00'),
+                requested_delivery_date=today,
+            )
+        return order, user
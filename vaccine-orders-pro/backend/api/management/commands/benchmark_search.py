@@ -0,0 +1,80 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Product
+from api.search import fts_available, icontains_queryset, ranked_product_ids, rebuild_index, tokenize
+
+WORDS = (
+    'newcastle', 'gumboro', 'bursal', 'marek', 'bronchitis', 'coryza', 'fowl', 'pox', 'laryngotracheitis',
+    'mycoplasma', 'salmonella', 'circovirus', 'parvovirus', 'erysipelas', 'influenza', 'pleuropneumonia',
+    'live', 'killed', 'attenuated', 'emulsion', 'adjuvant', 'spray', 'drinking', 'water', 'injection',
+    'broiler', 'layer', 'breeder', 'piglet', 'sow', 'strain', 'lasota', 'clone', 'hitchner', 'rispens',
+)
+BRANDS = ('MERIAL', 'HIPRA', 'CEVA', 'ZOETIS', 'MSD', 'BIOVAC', 'KEPRO')
+QUERIES = ('newc', 'gumboro live', 'mareks', 'coryza emulsion', 'ceva broiler', 'pleuro', 'salmonella water', 'zzz')
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare full-text product search with an icontains scan on a synthetic catalog (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            self.stderr.write('Full-text index is not available on this database; run migrations first.')
+            return
+        rng = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                self._populate(options['products'], rng)
+                rebuild_index()
+                self.stdout.write(f"Built {options['products']} products in {time.perf_counter() - started:.1f}s")
+                self.stdout.write(f"{'query':<20} {'fts ms':>9} {'icontains ms':>13} {'hits':>6}")
+                for query in QUERIES:
+                    fts_ms, hits = self._time(lambda: ranked_product_ids(query, limit=20), options['repeat'])
+                    scan_ms, _ = self._time(
+                        lambda: list(icontains_queryset(tokenize(query)).values_list('id', flat=True)[:20]),
+                        options['repeat'],
+                    )
+                    self.stdout.write(f'{query:<20} {fts_ms:9.2f} {scan_ms:13.2f} {len(hits):6d}')
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _time(self, fn, repeat):
+        best, result = None, None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def _populate(self, count, rng, chunk=5000):
+        for start in range(0, count, chunk):
+            Product.objects.bulk_create([
+                Product(
+                    name=' '.join(rng.sample(WORDS, 3)).title() + f' {i}',
+                    brand=rng.choice(BRANDS),
+                    species=rng.choice(('poultry', 'swine')),
+                    product_type=rng.choice(('live', 'killed', 'attenuated')),
+                    manufacturer=rng.choice(BRANDS) + ' Ltd',
+                    description=' '.join(rng.choices(WORDS, k=25)),
+                    active_ingredients=' '.join(rng.choices(WORDS, k=6)),
+                    storage_temp_range='2-8C',
+                    tags='["' + '", "'.join(rng.sample(WORDS, 3)) + '"]',
+                    administration_notes=' '.join(rng.choices(WORDS, k=10)),
+                )
+                for i in range(start, min(start + chunk, count))
+            ])
@@ -0,0 +1,89 @@
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from api.models import Product, DosePack, Batch
+
+MODES = (
+    ('products', 'product-list', {}),
+    ('products', 'product-list', {'fields': 'id,name,brand,image_url,total_stock'}),
+    ('products', 'product-list', {'fields': 'id,name,image_url', 'expand': 'dose_packs'}),
+    ('products', 'product-list', {'expand': 'batches'}),
+    ('batches', 'batch-list', {'page_size': 200}),
+    ('batches', 'batch-list', {'page_size': 200, 'fields': 'id,batch_number,expiry_date,available_quantity'}),
+)
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare payload size and response time of full vs ?fields=/?expand= responses (data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--batches', type=int, default=4, help='Batches per product')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(), override_settings(CATALOG_CACHE={'ENABLED': False}, ALLOWED_HOSTS=['*']):
+                admin = self._populate(options['products'], options['batches'])
+                client = APIClient()
+                client.force_authenticate(user=admin)
+                self.stdout.write(f"{options['products']} products x {options['batches']} batches")
+                self.stdout.write(f"{'mode':<74} {'bytes':>10} {'ms':>9} {'queries':>8}")
+                for label, url_name, params in MODES:
+                    size, ms, queries = self._measure(client, reverse(url_name), params, options['repeat'])
+                    query = '&'.join(f'{k}={v}' for k, v in params.items()) or '(full)'
+                    self.stdout.write(f'{label + " " + query:<74} {size:10d} {ms:9.2f} {queries:8d}')
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _measure(self, client, url, params, repeat):
+        best, size, queries = None, 0, 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = client.get(url, params, HTTP_ACCEPT='application/json')
+                elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                raise RuntimeError(f'{url} {params} returned {response.status_code}')
+            best = elapsed if best is None else min(best, elapsed)
+            size, queries = len(response.content), len(ctx.captured_queries)
+        return size, best, queries
+
+    def _populate(self, count, batches_per_product):
+        admin = User.objects.create_user(username='bench-sparse-admin', is_staff=True)
+        filler = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 20
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Bench product {i}', brand='Bench', species='poultry', product_type='live',
+                manufacturer='Bench', description=filler, active_ingredients=filler[:300],
+                storage_temp_range='2-8C', administration_notes=filler,
+                image_url=f'https://cdn.example.com/products/{i}.png',
+            )
+            for i in range(count)
+        ])
+        DosePack.objects.bulk_create([
+            DosePack(product=product, doses=doses, units_per_pack=1)
+            for product in products for doses in (100, 500)
+        ])
+        today = date.today()
+        Batch.objects.bulk_create([
+            Batch(
+                product=product, batch_number=f'BENCH-{product.pk}-{b}',
+                expiry_date=today + timedelta(days=30 * (b + 1)), quantity=10,
+                image_url=f'https://cdn.example.com/batches/{product.pk}-{b}.png',
+            )
+            for product in products for b in range(batches_per_product)
+        ])
+        return admin
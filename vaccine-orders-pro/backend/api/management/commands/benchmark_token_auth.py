@@ -0,0 +1,58 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+
+from api.authentication import CachedTokenAuthentication, token_cache
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request token authentication cost of DRF TokenAuthentication vs the cached backend (data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=50, help='Distinct tokens cycled through')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                keys = self._populate(options['users'])
+                factory = RequestFactory()
+                requests = [
+                    Request(factory.get('/api/auth/user/', HTTP_AUTHORIZATION=f'Token {key}'))
+                    for key in keys
+                ]
+                self.stdout.write(f"{options['requests']} requests over {len(keys)} tokens")
+                self.stdout.write(f"{'backend':<28} {'us/request':>11} {'queries/request':>16}")
+                token_cache.clear()
+                for label, backend in (('TokenAuthentication', TokenAuthentication()),
+                                       ('CachedTokenAuthentication', CachedTokenAuthentication())):
+                    micros, queries = self._measure(backend, requests, options['requests'])
+                    self.stdout.write(f'{label:<28} {micros:11.1f} {queries:16.3f}')
+                self.stdout.write(f'cache: {token_cache.stats()}')
+                raise _Rollback
+        except _Rollback:
+            token_cache.clear()
+
+    def _measure(self, backend, requests, count):
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            for i in range(count):
+                user, _ = backend.authenticate(requests[i % len(requests)])
+            elapsed = time.perf_counter() - started
+        return elapsed / count * 1e6, len(ctx.captured_queries) / count
+
+    def _populate(self, count):
+        users = User.objects.bulk_create([User(username=f'bench-auth-{i}') for i in range(count)])
+        tokens = Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users])
+        return [token.key for token in tokens]
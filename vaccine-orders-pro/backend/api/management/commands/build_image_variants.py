@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.images import enforce_quota, ensure_variants
+from api.models import Batch, Product
+
+
+class Command(BaseCommand):
+    help = 'Build missing WebP/JPEG variants for every uploaded Product and Batch image'
+
+    def handle(self, *args, **options):
+        built = skipped = 0
+        for model in (Product, Batch):
+            rows = model.objects.exclude(image__isnull=True).exclude(image='').only('id', 'image')
+            for row in rows.iterator():
+                if ensure_variants(row.image, quota=False) is None:
+                    skipped += 1
+                else:
+                    built += 1
+        removed = enforce_quota()
+        self.stdout.write(self.style.SUCCESS(
+            f'Image variants: {built} images ready, {skipped} skipped, {removed} unused directories evicted'
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api.expiry import due_batches, expire_batches
+
+
+class Command(BaseCommand):
+    help = 'Mark batches past their expiry date as expired and write them off (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Treat this ISO date as today (default: today)')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many batches are due')
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            today = parse_date(options['date'])
+            if today is None:
+                raise CommandError('--date must be YYYY-MM-DD')
+        if options['dry_run']:
+            self.stdout.write(f'{due_batches(today).count()} batches are due to expire')
+            return
+        batches, products = expire_batches(today, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Expired {batches} batches across {products} products'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.alerts import rebuild_alerts, refresh_velocities
+
+
+class Command(BaseCommand):
+    help = 'Refresh order velocities and rebuild stock alerts for every product (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-velocity', action='store_true', help='Keep the stored weekly velocities')
+        parser.add_argument('--weeks', type=int, default=None, help='Order history window for velocities')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not options['skip_velocity']:
+            rows = refresh_velocities(options['weeks'])
+            self.stdout.write(f'Refreshed velocity for {rows} thresholds')
+        created, updated, deleted = rebuild_alerts(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Stock alerts: {created} created, {updated} updated, {deleted} cleared'
+        ))
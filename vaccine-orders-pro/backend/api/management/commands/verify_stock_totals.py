@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.inventory import annotate_expected_stock, recompute_stock_totals
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Verify the denormalized stock totals on Product against batches and dose packs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rewrite drifted totals from scratch')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Products checked per query')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        drifted = []
+        checked = 0
+        last_id = 0
+        while True:
+            chunk = list(
+                annotate_expected_stock(Product.objects.filter(pk__gt=last_id).order_by('pk'))
+                .values('pk', 'name', *Product.STOCK_FIELDS, *[f'expected_{f}' for f in Product.STOCK_FIELDS])[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1]['pk']
+            checked += len(chunk)
+            for row in chunk:
+                diffs = {
+                    field: (row[field], row[f'expected_{field}'])
+                    for field in Product.STOCK_FIELDS
+                    if row[field] != row[f'expected_{field}']
+                }
+                if diffs:
+                    drifted.append(row['pk'])
+                    detail = ', '.join(f'{f}: stored={s} expected={e}' for f, (s, e) in diffs.items())
+                    self.stdout.write(self.style.WARNING(f"Product {row['pk']} ({row['name']}): {detail}"))
+
+        if drifted and options['fix']:
+            with transaction.atomic():
+                for start in range(0, len(drifted), chunk_size):
+                    recompute_stock_totals(drifted[start:start + chunk_size])
+            self.stdout.write(self.style.SUCCESS(f'Fixed {len(drifted)} of {checked} products'))
+        elif drifted:
+            self.stdout.write(self.style.ERROR(f'{len(drifted)} of {checked} products have drifted totals (use --fix)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'All {checked} products have correct stock totals'))
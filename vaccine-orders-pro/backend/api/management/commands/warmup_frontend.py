@@ -0,0 +1,25 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.frontend import ENCODING_SUFFIXES, available_encodings, compress, shell_cache
+
+
+class Command(BaseCommand):
+    help = 'Precompress the SPA shell (index.html.gz/.br) after collectstatic and check it loads'
+
+    def handle(self, *args, **options):
+        shell_cache.clear()
+        shell = shell_cache.load()
+        if shell is None:
+            raise CommandError('No index.html found; run the frontend build and collectstatic first')
+        content = shell.variants['identity'][0]
+        for encoding in available_encodings():
+            target = Path(str(shell.path) + ENCODING_SUFFIXES[encoding])
+            body = compress(content, encoding)
+            target.write_bytes(body)
+            self.stdout.write(f'{target.name}: {len(content)} -> {len(body)} bytes')
+        # Reload so the cached shell picks up the files just written
+        shell_cache.clear()
+        shell_cache.load()
+        self.stdout.write(self.style.SUCCESS(f'Frontend shell ready: {shell.path}'))
@@ -0,0 +1,163 @@
+"""Serve uploaded media (`MEDIA_ROOT`) efficiently when Django has to do it.
+
+Replaces `django.views.static.serve`, which reads whole files into the
+worker and sends no caching headers:
+
+* files are streamed with `FileResponse`, which lets gunicorn use zero-copy
+  `sendfile()` through `wsgi.file_wrapper`;
+* `If-Modified-Since` / `If-None-Match` are answered with 304;
+* a single `Range: bytes=a-b` is answered with 206 (multi-range requests get
+  the whole file, which RFC 9110 allows);
+* content-hashed image variants (api/images.py) are marked immutable for a
+  year, other uploads get `MEDIA_MAX_AGE`;
+* with `MEDIA_ACCEL_REDIRECT` set (e.g. '/protected-media/'), the response is
+  an empty `X-Accel-Redirect` hand-off and nginx sends the bytes itself.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from pathlib import Path
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+from .images import mark_used, variant_settings
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class _RangeFile:
+    """A file positioned at a range start that reads at most `length` bytes.
+
+    Exposes `fileno()` so gunicorn can still `sendfile()` it (it sends from
+    the current offset for Content-Length bytes).
+    """
+
+    def __init__(self, handle, start, length):
+        handle.seek(start)
+        self.handle = handle
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.handle.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.handle.fileno()
+
+    def close(self):
+        self.handle.close()
+
+
+def _resolve(path):
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = Path(safe_join(settings.MEDIA_ROOT, path))
+    except SuspiciousFileOperation:
+        raise Http404('Media file not found')
+    return path, full_path
+
+
+def _is_immutable(path):
+    return path.startswith(variant_settings()['DIRECTORY'] + '/')
+
+
+def _parse_range(header, size):
+    """(start, end) inclusive for a single satisfiable range, 'unsatisfiable', or None to ignore."""
+    match = _RANGE_RE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return 'unsatisfiable'
+    return start, end
+
+
+def _range_applies(request, etag, mtime):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == mtime
+
+
+def serve_media(request, path):
+    path, full_path = _resolve(path)
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('Media file not found')
+    if not full_path.is_file():
+        raise Http404('Media file not found')
+    if _is_immutable(path):
+        # Keeps variants that are still being requested out of the quota's way
+        mark_used(path.split('/')[1])
+
+    mtime = int(stat.st_mtime)
+    etag = '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+    content_type, encoding = mimetypes.guess_type(str(full_path))
+    content_type = content_type or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=mtime)
+    if response is None:
+        accel_prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT', '')
+        if accel_prefix:
+            # nginx serves the bytes (and Ranges) from an `internal` location
+            response = HttpResponse(content_type=content_type)
+            # nginx percent-decodes the URI; quoting keeps spaces, '%', '?' and non-ASCII names intact
+            response['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{quote(path)}"
+        else:
+            response = _file_response(request, full_path, stat.st_size, content_type, etag, mtime)
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    if _is_immutable(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'MEDIA_MAX_AGE', 3600))
+    return response
+
+
+def _file_response(request, full_path, size, content_type, etag, mtime):
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header and _range_applies(request, etag, mtime):
+        byte_range = _parse_range(range_header, size)
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    handle = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(handle, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(_RangeFile(handle, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,54 @@
+from django.db import migrations, models
+from django.db.models import F, Sum, Min
+
+
+def backfill_stock_totals(apps, schema_editor):
+    Product = apps.get_model("api", "Product")
+    Batch = apps.get_model("api", "Batch")
+    DosePack = apps.get_model("api", "DosePack")
+    for product in Product.objects.all().iterator():
+        batches = Batch.objects.filter(product=product)
+        totals = batches.aggregate(
+            available=Sum(F("quantity") - F("quantity_reserved")),
+            reserved=Sum("quantity_reserved"),
+        )
+        product.available_packs = totals["available"] or 0
+        product.reserved_packs = totals["reserved"] or 0
+        product.total_units = DosePack.objects.filter(product=product).aggregate(
+            units=Sum("units_per_pack")
+        )["units"] or 0
+        product.nearest_expiry = batches.filter(quantity__gt=F("quantity_reserved")).aggregate(
+            nearest=Min("expiry_date")
+        )["nearest"]
+        product.save(update_fields=["available_packs", "reserved_packs", "total_units", "nearest_expiry"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_dosepack_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="available_packs",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="reserved_packs",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="total_units",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="nearest_expiry",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_stock_totals, migrations.RunPython.noop),
+    ]
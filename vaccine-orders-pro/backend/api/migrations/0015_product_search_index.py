@@ -0,0 +1,57 @@
+from django.db import migrations
+
+FIELDS = ("name", "brand", "manufacturer", "description", "active_ingredients", "tags")
+
+
+def _columns(prefix=""):
+    return ", ".join(f"{prefix}{field}" for field in FIELDS)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        # A standalone FTS5 table (not external-content) kept in sync from
+        # Product signals: triggers on api_product would be silently dropped
+        # whenever a later migration makes SQLite rebuild that table.
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE api_product_fts USING fts5({_columns()}, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+        except Exception:
+            # SQLite built without FTS5: search falls back to icontains.
+            return
+        schema_editor.execute(
+            f"INSERT INTO api_product_fts(rowid, {_columns()}) SELECT id, {_columns()} FROM api_product"
+        )
+    elif vendor == "postgresql":
+        weighted = " || ".join(
+            f"setweight(to_tsvector('simple', coalesce({field}, '')), '{weight}')"
+            for field, weight in zip(FIELDS, ("A", "A", "B", "D", "C", "B"))
+        )
+        schema_editor.execute(
+            f"ALTER TABLE api_product ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({weighted}) STORED"
+        )
+        schema_editor.execute(
+            "CREATE INDEX api_product_search_vector_gin ON api_product USING GIN (search_vector)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS api_product_fts")
+    elif vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS api_product_search_vector_gin")
+        schema_editor.execute("ALTER TABLE api_product DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_keyset_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:01
+
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def parse_tags(value):
+    try:
+        raw = json.loads(value or "[]")
+    except (TypeError, ValueError):
+        raw = str(value).split(",")
+    if not isinstance(raw, list):
+        raw = [raw]
+    names = []
+    for item in raw:
+        name = str(item).strip().lower()[:100]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def populate_product_tags(apps, schema_editor):
+    Product = apps.get_model("api", "Product")
+    Tag = apps.get_model("api", "Tag")
+    ProductTag = apps.get_model("api", "ProductTag")
+    tags = {}
+    links = []
+    for product_id, value in Product.objects.values_list("id", "tags").iterator():
+        for name in parse_tags(value):
+            if name not in tags:
+                tags[name] = Tag.objects.create(name=name)
+            links.append(ProductTag(product_id=product_id, tag=tags[name]))
+    ProductTag.objects.bulk_create(links, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_tags', to='api.product')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_tags', to='api.tag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', 'product'], name='producttag_tag_product_idx')],
+                'unique_together': {('product', 'tag')},
+            },
+        ),
+        migrations.RunPython(populate_product_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:02
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+
+FACET_FIELDS = ("species", "product_type", "brand", "manufacturer", "cold_chain_required")
+
+
+def populate_facet_counts(apps, schema_editor):
+    Product = apps.get_model("api", "Product")
+    ProductFacetCount = apps.get_model("api", "ProductFacetCount")
+    totals = defaultdict(int)
+    for facet in FACET_FIELDS:
+        for row in Product.objects.order_by().values(facet).annotate(n=Count("id")):
+            value = row[facet]
+            if isinstance(value, bool):
+                value = "true" if value else "false"
+            totals[(facet, value)] += row["n"]
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(facet=facet, value=value, count=count)
+        for (facet, value), count in totals.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_product_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=32)),
+                ('value', models.CharField(max_length=255)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['species'], name='product_species_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['product_type'], name='product_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['brand'], name='product_brand_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['manufacturer'], name='product_manufacturer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['cold_chain_required'], name='product_cold_chain_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='productfacetcount',
+            unique_together={('facet', 'value')},
+        ),
+        migrations.RunPython(populate_facet_counts, migrations.RunPython.noop),
+    ]
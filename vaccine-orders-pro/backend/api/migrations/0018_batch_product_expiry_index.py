@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_product_facets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='batch',
+            index=models.Index(fields=['product', 'expiry_date', 'id'], name='batch_product_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:12
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_stock_alerts(apps, schema_editor):
+    # No thresholds exist yet, so every product uses the configured defaults
+    Product = apps.get_model("api", "Product")
+    Batch = apps.get_model("api", "Batch")
+    StockAlert = apps.get_model("api", "StockAlert")
+    config = getattr(settings, "STOCK_ALERTS", {})
+    level = config.get("LOW_STOCK_PACKS", 100)
+    window = config.get("EXPIRY_WARNING_DAYS", 30)
+    today = timezone.localdate()
+    alerts = [
+        StockAlert(product_id=product_id, kind="low_stock", value=available, threshold=level)
+        for product_id, available in Product.objects.filter(available_packs__lte=level).values_list("id", "available_packs")
+    ]
+    batches = (
+        Batch.objects.filter(quantity__gt=0, expiry_date__lte=today + timedelta(days=window))
+        .exclude(status="shipped")
+        .values_list("id", "product_id", "expiry_date")
+    )
+    for batch_id, product_id, expiry_date in batches.iterator():
+        days_left = (expiry_date - today).days
+        kind, threshold = ("expired", 0) if days_left < 0 else ("expiring", window)
+        alerts.append(StockAlert(product_id=product_id, batch_id=batch_id, kind=kind, value=days_left, threshold=threshold))
+    StockAlert.objects.bulk_create(alerts, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_batch_product_expiry_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockThreshold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_available_packs', models.IntegerField(blank=True, null=True)),
+                ('cover_weeks', models.DecimalField(blank=True, decimal_places=1, max_digits=5, null=True)),
+                ('expiry_warning_days', models.IntegerField(blank=True, null=True)),
+                ('weekly_velocity', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stock_threshold', to='api.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('low_stock', 'Low stock'), ('expiring', 'Expiring soon'), ('expired', 'Expired with stock')], max_length=15)),
+                ('value', models.IntegerField()),
+                ('threshold', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_alerts', to='api.batch')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_alerts', to='api.product')),
+            ],
+            options={
+                'ordering': ['kind', 'product_id', 'id'],
+                'indexes': [models.Index(fields=['kind', 'product', 'id'], name='stockalert_kind_product_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('batch__isnull', True)), fields=('product', 'kind'), name='stockalert_product_kind_uniq'), models.UniqueConstraint(condition=models.Q(('batch__isnull', False)), fields=('batch', 'kind'), name='stockalert_batch_kind_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_stock_alerts, migrations.RunPython.noop),
+    ]
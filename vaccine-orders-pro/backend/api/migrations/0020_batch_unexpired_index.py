@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_stock_alerts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='batch',
+            index=models.Index(condition=models.Q(('status', 'expired'), _negated=True), fields=['expiry_date', 'id'], name='batch_unexpired_expiry_idx'),
+        ),
+    ]
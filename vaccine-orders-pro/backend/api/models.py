@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Prefetch
 from django.contrib.auth.models import User
 
 class UserProfile(models.Model):
@@ -10,6 +11,19 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.company_name}"
 
+class ProductQuerySet(models.QuerySet):
+    def for_catalog(self, relations=('dose_packs', 'batches')):
+        """Prefetch everything `ProductSerializer` touches so a catalog page
+        costs a fixed number of queries regardless of how many products it has.
+
+        `relations` narrows the prefetches to the nested lists actually rendered."""
+        prefetches = {
+            'dose_packs': Prefetch('dose_packs', queryset=DosePack.objects.order_by('id')),
+            'batches': Prefetch('batches', queryset=Batch.objects.order_by('expiry_date', 'id')),
+        }
+        return self.prefetch_related(*(prefetches[name] for name in relations))
+
+
 class Product(models.Model):
     SPECIES_CHOICES = [
         ('poultry', 'Poultry'),
@@ -37,28 +51,127 @@ class Product(models.Model):
     minimum_order_qty = models.IntegerField(default=1)
     lead_time_days = models.IntegerField(default=3)
     available_stock = models.IntegerField(default=0)
+    # Denormalized stock totals, maintained incrementally from Batch/DosePack
+    # writes (see api/inventory.py). Verify with `manage.py verify_stock_totals`.
+    available_packs = models.IntegerField(default=0)
+    reserved_packs = models.IntegerField(default=0)
+    total_units = models.IntegerField(default=0)
+    nearest_expiry = models.DateField(null=True, blank=True)
     administration_notes = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    STOCK_FIELDS = ('available_packs', 'reserved_packs', 'total_units', 'nearest_expiry')
+    FACET_FIELDS = ('species', 'product_type', 'brand', 'manufacturer', 'cold_chain_required')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['species'], name='product_species_idx'),
+            models.Index(fields=['product_type'], name='product_type_idx'),
+            models.Index(fields=['brand'], name='product_brand_idx'),
+            models.Index(fields=['manufacturer'], name='product_manufacturer_idx'),
+            models.Index(fields=['cold_chain_required'], name='product_cold_chain_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the tag sync skip saves that did not touch `tags`
+        instance._loaded_tags = instance.__dict__.get('tags')
+        # Lets the image variant hook skip saves that did not replace `image`
+        instance._loaded_image = instance.__dict__.get('image')
+        instance._facet_snapshot = instance.facet_values()
+        return instance
+
+    def facet_values(self):
+        """{facet: value} as stored in `ProductFacetCount` (see api/facets.py)."""
+        values = {}
+        for field in self.FACET_FIELDS:
+            value = self.__dict__.get(field)
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            values[field] = value
+        return values
+
+    def save(self, *args, **kwargs):
+        # The stock columns are only ever written with F() deltas or a full
+        # recompute; a plain save of a (possibly stale) instance must not
+        # overwrite them.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.STOCK_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def get_image_url(self):
         """Return the image URL, preferring uploaded image over image_url field"""
         if self.image and self.image.name:
             return self.image.url
         return self.image_url or '/placeholder.svg'
 
+class ProductFacetCount(models.Model):
+    """Precomputed number of products per facet value, kept current incrementally."""
+    facet = models.CharField(max_length=32)
+    value = models.CharField(max_length=255)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('facet', 'value')
+
+    def __str__(self):
+        return f"{self.facet}={self.value} ({self.count})"
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class ProductTag(models.Model):
+    """Normalized, indexed copy of `Product.tags` (see api/tags.py)."""
+    product = models.ForeignKey(Product, related_name='product_tags', on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, related_name='product_tags', on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('product', 'tag')
+        indexes = [
+            models.Index(fields=['tag', 'product'], name='producttag_tag_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} - {self.tag_id}"
+
+
 class DosePack(models.Model):
     product = models.ForeignKey(Product, related_name='dose_packs', on_delete=models.CASCADE)
     doses = models.IntegerField()
     units_per_pack = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stock_snapshot = instance.stock_state()
+        return instance
+
+    def stock_state(self):
+        """(product_id, units_per_pack) as last persisted, used for stock deltas."""
+        return (self.__dict__.get('product_id'), self.__dict__.get('units_per_pack'))
 
     def __str__(self):
         return f"{self.doses} doses - {self.product.name}"
 
 class Batch(models.Model):
+    EXPIRED = 'expired'
     BATCH_STATUS_CHOICES = [
         ('available', 'Available'),
         ('reserved', 'Reserved'),
@@ -83,8 +196,44 @@ class Batch(models.Model):
 
     class Meta:
         ordering = ['expiry_date']
+        indexes = [
+            models.Index(fields=['expiry_date', 'id'], name='batch_expiry_id_idx'),
+            # /api/batches/?product=<id>, listed in (expiry_date, id) order
+            models.Index(fields=['product', 'expiry_date', 'id'], name='batch_product_expiry_idx'),
+            # Only batches the expiry sweeper still has to look at
+            models.Index(
+                fields=['expiry_date', 'id'], condition=~models.Q(status='expired'), name='batch_unexpired_expiry_idx'
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stock_snapshot = instance.stock_state()
+        instance._loaded_image = instance.__dict__.get('image')
+        instance._loaded_product_id = instance.__dict__.get('product_id')
+        return instance
+
+    def stock_state(self):
+        """(product_id, available packs, reserved packs) used for stock deltas.
+
+        Expired batches contribute no available packs. Values are None when
+        the instance was loaded without the fields they depend on.
+        """
+        quantity = self.__dict__.get('quantity')
+        reserved = self.__dict__.get('quantity_reserved')
+        batch_status = self.__dict__.get('status')
+        if quantity is None or reserved is None or batch_status is None:
+            available = None
+        elif batch_status == self.EXPIRED:
+            available = 0
+        else:
+            available = quantity - reserved
+        return (self.__dict__.get('product_id'), available, reserved)
 
     def available_quantity(self):
+        if self.status == self.EXPIRED:
+            return 0
         return self.quantity - self.quantity_reserved
 
     def __str__(self):
@@ -109,6 +258,13 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination: staff see all orders, customers only their own
+            models.Index(fields=['created_at', 'id'], name='order_created_id_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_id_idx'),
+        ]
+
     def __str__(self):
         return self.order_number
 
@@ -149,6 +305,10 @@ class InventoryLog(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='invlog_created_id_idx'),
+            models.Index(fields=['product', 'created_at', 'id'], name='invlog_product_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.action} ({self.quantity_changed})"
@@ -172,6 +332,10 @@ class OrderStatusHistory(models.Model):
     class Meta:
         ordering = ['changed_at']
         verbose_name_plural = 'Order Status Histories'
+        indexes = [
+            models.Index(fields=['changed_at', 'id'], name='statushist_changed_id_idx'),
+            models.Index(fields=['order', 'changed_at', 'id'], name='statushist_order_changed_idx'),
+        ]
 
     def __str__(self):
         return f"{self.order.order_number} - {self.status} by {self.changed_by.username if self.changed_by else 'System'}"
@@ -181,7 +345,8 @@ class Cart(models.Model):
     """A simple per-user shopping cart stored on the server.
 
     The app keeps one `Cart` per authenticated `User`. Anonymous carts are
-    stored client-side and merged into the server cart on login.
+    stored client-side and merged into the server cart on login
+    (`POST /api/cart/merge/`).
     """
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -206,3 +371,59 @@ class CartItem(models.Model):
 
     def __str__(self):
         return f"{self.product.name if self.product else 'Unknown'} x {self.quantity} in {self.cart.user.username}'s cart"
+
+
+class StockThreshold(models.Model):
+    """Per-product alert thresholds; products without a row use `settings.STOCK_ALERTS`.
+
+    The low-stock level is the larger of `min_available_packs` and
+    `cover_weeks` worth of demand at `weekly_velocity` (packs ordered per
+    week, refreshed by `manage.py refresh_stock_alerts`).
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='stock_threshold')
+    min_available_packs = models.IntegerField(null=True, blank=True)
+    cover_weeks = models.DecimalField(max_digits=5, decimal_places=1, null=True, blank=True)
+    expiry_warning_days = models.IntegerField(null=True, blank=True)
+    weekly_velocity = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Thresholds for {self.product.name}"
+
+
+class StockAlert(models.Model):
+    """Materialized low-stock / expiry alerts, maintained by api/alerts.py.
+
+    Product-level `low_stock` rows have no batch; `expiring` and `expired`
+    rows are per batch. `value` is available packs (low_stock) or days to
+    expiry, `threshold` the level it was compared against.
+    """
+    LOW_STOCK = 'low_stock'
+    EXPIRING = 'expiring'
+    EXPIRED = 'expired'
+    KIND_CHOICES = [
+        (LOW_STOCK, 'Low stock'),
+        (EXPIRING, 'Expiring soon'),
+        (EXPIRED, 'Expired with stock'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_alerts')
+    batch = models.ForeignKey(Batch, on_delete=models.CASCADE, null=True, blank=True, related_name='stock_alerts')
+    kind = models.CharField(max_length=15, choices=KIND_CHOICES)
+    value = models.IntegerField()
+    threshold = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['kind', 'product_id', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'kind'], condition=models.Q(batch__isnull=True), name='stockalert_product_kind_uniq'),
+            models.UniqueConstraint(fields=['batch', 'kind'], condition=models.Q(batch__isnull=False), name='stockalert_batch_kind_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'product', 'id'], name='stockalert_kind_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.product.name}"
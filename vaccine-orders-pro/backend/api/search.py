@@ -0,0 +1,140 @@
+"""Ranked, prefix-matching product search.
+
+Backed by a persistent full-text index created in migration 0015:
+
+* SQLite: an FTS5 table (`api_product_fts`, rowid = product id) kept in
+  sync from Product signals, ranked with bm25(). Writes that bypass signals
+  (`bulk_create`, raw SQL) need `manage.py rebuild_search_index`.
+* PostgreSQL: a stored generated `search_vector` tsvector column with a GIN
+  index, ranked with ts_rank().
+
+Other backends (or SQLite builds without FTS5) fall back to an `icontains`
+scan so the endpoint keeps working, just without ranking.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Product
+
+SEARCH_FIELDS = ('name', 'brand', 'manufacturer', 'description', 'active_ingredients', 'tags')
+FTS_TABLE = 'api_product_fts'
+# bm25 column weights, in SEARCH_FIELDS order
+FTS_WEIGHTS = (10.0, 5.0, 3.0, 1.0, 2.0, 4.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return _TOKEN_RE.findall((query or '').lower())
+
+
+# Databases (by NAME) where the FTS table is known to exist
+_fts_databases = set()
+
+
+def fts_available():
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor != 'sqlite':
+        return False
+    name = str(connection.settings_dict['NAME'])
+    if name in _fts_databases:
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        found = cursor.fetchone() is not None
+    if found:
+        _fts_databases.add(name)
+    return found
+
+
+def index_product(product):
+    """Refresh one product's row in the SQLite FTS table (Postgres derives it)."""
+    if connection.vendor != 'sqlite' or not fts_available():
+        return
+    columns = ', '.join(SEARCH_FIELDS)
+    placeholders = ', '.join(['%s'] * len(SEARCH_FIELDS))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (%s, {placeholders})",
+            [product.pk] + [getattr(product, field) or '' for field in SEARCH_FIELDS],
+        )
+
+
+def unindex_product(product_id):
+    if connection.vendor != 'sqlite' or not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+
+
+def rebuild_index():
+    """Repopulate the SQLite FTS table from `api_product`; returns rows indexed."""
+    if connection.vendor != 'sqlite' or not fts_available():
+        return 0
+    columns = ', '.join(SEARCH_FIELDS)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}(rowid, {columns}) SELECT id, {columns} FROM api_product")
+        return cursor.rowcount
+
+
+def _sqlite_ranked_ids(tokens, limit):
+    # Every token must match; each is quoted (no FTS syntax injection) and
+    # prefix-matched with `*`.
+    match = ' '.join('"%s"*' % token.replace('"', '""') for token in tokens)
+    weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s",
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _postgres_ranked_ids(tokens, limit):
+    tsquery = ' & '.join(f'{token}:*' for token in tokens)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT id FROM api_product, to_tsquery('simple', %s) AS query "
+            "WHERE search_vector @@ query ORDER BY ts_rank(search_vector, query) DESC, id LIMIT %s",
+            [tsquery, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def ranked_product_ids(query, limit=20):
+    """Ids of the best matching products, best first."""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    if fts_available():
+        if connection.vendor == 'postgresql':
+            return _postgres_ranked_ids(tokens, limit)
+        return _sqlite_ranked_ids(tokens, limit)
+    return list(icontains_queryset(tokens).values_list('id', flat=True)[:limit])
+
+
+def icontains_queryset(tokens):
+    """Unindexed scan: every token must appear in at least one search field."""
+    queryset = Product.objects.all()
+    for token in tokens:
+        condition = Q()
+        for field in SEARCH_FIELDS:
+            condition |= Q(**{f'{field}__icontains': token})
+        queryset = queryset.filter(condition)
+    return queryset.order_by('name', 'id')
+
+
+def search_products(query, limit=20, queryset=None):
+    """Matching products in rank order (a list, since rank is not a column)."""
+    ids = ranked_product_ids(query, limit)
+    if not ids:
+        return []
+    queryset = queryset if queryset is not None else Product.objects.for_catalog()
+    found = queryset.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
@@ -1,27 +1,135 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import Product, DosePack, Batch, Order, OrderItem, UserProfile, InventoryLog, OrderStatusHistory
-from .models import Cart, CartItem
+from .models import Cart, CartItem, StockAlert
 from decimal import Decimal
 import uuid
 
+from .cart import replace_cart_items
+from .images import variant_srcsets
+from .loaders import LoaderListSerializer, attach, get_loader
+
+
+def split_param(values):
+    """Names from repeated and/or comma-separated query values (`?fields=a,b&fields=c`)."""
+    names = []
+    for value in values:
+        names.extend(name.strip() for name in value.split(',') if name.strip())
+    return names
+
+
+class SparseFieldsetMixin:
+    """`?fields=` / `?expand=` support for read endpoints.
+
+    `?fields=id,name` limits the top-level representation to those fields.
+    Nested serializers listed in `expandable_fields` are only rendered when
+    named in `fields` or `expand` once either parameter is present; without
+    them the full representation is returned as before. Views resolve the
+    selection with `sparse_field_names()` and pass it in the serializer
+    context as `sparse_fields`, and can load just the columns it reads with
+    `sparse_only_fields()`.
+    """
+    expandable_fields = ()
+    # Columns read by fields that are not model columns themselves
+    sparse_field_sources = {}
+
+    @classmethod
+    def sparse_field_names(cls, query_params):
+        """Selected field names in declaration order, or None for the full representation."""
+        fields = split_param(query_params.getlist('fields'))
+        expand = split_param(query_params.getlist('expand'))
+        if not fields and not expand:
+            return None
+        available = list(cls().fields)
+        unknown = [name for name in fields if name not in available]
+        unknown += [name for name in expand if name not in cls.expandable_fields]
+        if unknown:
+            raise serializers.ValidationError({'fields': f"Unknown or non-expandable fields: {', '.join(unknown)}"})
+        if fields:
+            selected = set(fields) | set(expand)
+        else:
+            selected = {name for name in available if name not in cls.expandable_fields} | set(expand)
+        return [name for name in available if name in selected]
+
+    @classmethod
+    def sparse_only_fields(cls, names):
+        """Model columns needed to render `names`, or None if that cannot be worked out."""
+        model = cls.Meta.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+        declared = cls().fields
+        columns = [model._meta.pk.name]
+        for name in names:
+            if name in cls.sparse_field_sources:
+                sources = cls.sparse_field_sources[name]
+            elif declared[name].source in concrete:
+                sources = (declared[name].source,)
+            elif name in cls.expandable_fields:
+                # Reverse relations are prefetched by primary key
+                continue
+            else:
+                return None
+            columns.extend(source for source in sources if source not in columns)
+        return columns
+
+    def get_fields(self):
+        fields = super().get_fields()
+        names = self.context.get('sparse_fields')
+        if names is None or not self._is_sparse_root():
+            return fields
+        return {name: field for name, field in fields.items() if name in names}
+
+    def _is_sparse_root(self):
+        # Only the top-level serializer (or the child of a top-level many=True list)
+        root = self.root
+        return root is self or (isinstance(root, serializers.ListSerializer) and root.child is self)
+
+
 class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
         fields = ('company_name',)
 
+def prime_user_profiles(context, users):
+    """Load `profile` for all `users` through the request's identity map."""
+    attach(users, 'profile', get_loader(context, UserProfile, 'user'))
+
+
+class OrderUserLoaderMixin:
+    """Resolves `order.user` and its profile through the request loaders."""
+
+    def prime_loaders(self, orders):
+        if 'user' not in self.fields and 'user_company_name' not in self.fields:
+            # left out by ?fields=
+            return
+        attach(orders, 'user', get_loader(self.context, User))
+        prime_user_profiles(self.context, [order.user for order in orders])
+
+    def get_user_company_name(self, obj):
+        """Get company name from user's profile"""
+        self.prime_loaders([obj])
+        try:
+            return obj.user.profile.company_name
+        except UserProfile.DoesNotExist:
+            return None
+
+
 class UserSerializer(serializers.ModelSerializer):
     company_name = serializers.SerializerMethodField()
 
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'is_staff', 'is_superuser', 'company_name')
-    
+        list_serializer_class = LoaderListSerializer
+
+    def prime_loaders(self, users):
+        prime_user_profiles(self.context, users)
+
     def get_company_name(self, obj):
         """Get company name from profile, or return default 'dada'"""
+        # `obj.profile` is free when the queryset used select_related('user__profile')
+        prime_user_profiles(self.context, [obj])
         try:
-            profile = UserProfile.objects.get(user=obj)
-            return profile.company_name
+            return obj.profile.company_name
         except UserProfile.DoesNotExist:
             return 'dada'
 
@@ -30,50 +138,55 @@ class DosePackSerializer(serializers.ModelSerializer):
         model = DosePack
         fields = '__all__'
 
-class BatchSerializer(serializers.ModelSerializer):
+class BatchSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     available_quantity = serializers.SerializerMethodField()
     image = serializers.ImageField(required=False, allow_null=True, use_url=True)
+    image_srcset = serializers.SerializerMethodField()
+    sparse_field_sources = {
+        'available_quantity': ('quantity', 'quantity_reserved', 'status'),
+        'image_srcset': ('image',),
+    }
 
     class Meta:
         model = Batch
-        fields = ('id', 'batch_number', 'product', 'expiry_date', 'quantity', 'quantity_reserved', 'available_quantity', 'status', 'storage_location', 'image_url', 'image_alt', 'image', 'created_at', 'updated_at')
+        fields = ('id', 'batch_number', 'product', 'expiry_date', 'quantity', 'quantity_reserved', 'available_quantity', 'status', 'storage_location', 'image_url', 'image_alt', 'image', 'image_srcset', 'created_at', 'updated_at')
     
     def get_available_quantity(self, obj):
         return obj.available_quantity()
 
-class ProductSerializer(serializers.ModelSerializer):
+    def get_image_srcset(self, obj):
+        return variant_srcsets(obj.image, self.context.get('request'))
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     dose_packs = DosePackSerializer(many=True, read_only=True)
     batches = BatchSerializer(many=True, read_only=True)
-    total_stock = serializers.SerializerMethodField()
-    total_units = serializers.SerializerMethodField()
+    # Served from the denormalized stock columns maintained by api/inventory.py
+    total_stock = serializers.IntegerField(source='available_packs', read_only=True)
+    total_units = serializers.IntegerField(read_only=True)
     image = serializers.ImageField(required=False, allow_null=True, use_url=True)
     image_alt = serializers.CharField(required=False, allow_blank=True)
     # Allow clients to provide `image_url` when creating/updating products.
     # On read, we still want to return an absolute URL (handled in to_representation).
     image_url = serializers.CharField(required=False, allow_blank=True)
+    # {'webp': 'url 160w, ...', 'jpeg': ...} for uploaded images, else null
+    image_srcset = serializers.SerializerMethodField()
+    expandable_fields = ('dose_packs', 'batches')
+    sparse_field_sources = {'image_url': ('image', 'image_url'), 'image_srcset': ('image',)}
 
     class Meta:
         model = Product
         fields = '__all__'
-    
-    def get_total_stock(self, obj):
-        """Calculate total available stock from all batches"""
-        return sum(batch.available_quantity() for batch in obj.batches.all())
-
-    def get_total_units(self, obj):
-        """Calculate total units from dose packs (sum of units_per_pack values)."""
-        total = 0
-        for dp in obj.dose_packs.all():
-            try:
-                units_per_pack = int(getattr(dp, 'units_per_pack', 0) or 0)
-            except Exception:
-                units_per_pack = 0
-            total += units_per_pack
-        return total
-    
+        read_only_fields = ('available_packs', 'reserved_packs', 'nearest_expiry')
+
+    def get_image_srcset(self, obj):
+        return variant_srcsets(obj.image, self.context.get('request'))
+
     def to_representation(self, instance):
         """Return serialized data, ensuring `image_url` is an absolute URL when possible."""
         data = super().to_representation(instance)
+        if 'image_url' not in data:
+            # left out by ?fields=
+            return data
         try:
             url = instance.get_image_url()
             request = self.context.get('request') if hasattr(self, 'context') else None
@@ -86,10 +199,49 @@ class ProductSerializer(serializers.ModelSerializer):
             data['image_url'] = data.get('image_url')
         return data
 
+class StockAlertSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    batch_number = serializers.CharField(source='batch.batch_number', read_only=True, default=None)
+    expiry_date = serializers.DateField(source='batch.expiry_date', read_only=True, default=None)
+
+    class Meta:
+        model = StockAlert
+        fields = ('id', 'kind', 'product', 'product_name', 'batch', 'batch_number', 'expiry_date', 'value', 'threshold', 'created_at', 'updated_at')
+        read_only_fields = fields
+
+
+class AvailabilityLineSerializer(serializers.Serializer):
+    """One prospective order line for `/api/availability/`."""
+    product = serializers.IntegerField()
+    dose_pack = serializers.IntegerField(required=False, allow_null=True)
+    quantity = serializers.IntegerField(min_value=1)
+    requested_delivery_date = serializers.DateField(required=False, allow_null=True)
+
+
+class AvailabilityRequestSerializer(serializers.Serializer):
+    lines = AvailabilityLineSerializer(many=True, allow_empty=False, max_length=200)
+
+
+class DeferredPrimaryKeyField(serializers.PrimaryKeyRelatedField):
+    """Primary key field that only type-checks the id on input.
+
+    The referenced rows are looked up in bulk by the parent serializer
+    (one `in_bulk` per model) instead of one query per nested item.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
-    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all())
-    dose_pack = serializers.PrimaryKeyRelatedField(queryset=DosePack.objects.all(), allow_null=True, required=False)
-    batch = serializers.PrimaryKeyRelatedField(queryset=Batch.objects.all(), allow_null=True, required=False)
+    product = DeferredPrimaryKeyField(queryset=Product.objects.all())
+    dose_pack = DeferredPrimaryKeyField(queryset=DosePack.objects.all(), allow_null=True, required=False)
+    batch = DeferredPrimaryKeyField(queryset=Batch.objects.all(), allow_null=True, required=False)
     product_name = serializers.CharField(read_only=True)
     doses = serializers.IntegerField(read_only=True)
     order = serializers.PrimaryKeyRelatedField(read_only=True)
@@ -111,25 +263,20 @@ class OrderStatusHistorySerializer(serializers.ModelSerializer):
             return obj.changed_by.username
         return 'System'
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(OrderUserLoaderMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
     status_history = OrderStatusHistorySerializer(many=True, read_only=True)
     user = UserSerializer(read_only=True)
     user_company_name = serializers.SerializerMethodField()
     order_number = serializers.CharField(read_only=True)
     total_amount = serializers.DecimalField(read_only=True, max_digits=12, decimal_places=2)
+    expandable_fields = ('items', 'status_history', 'user')
+    sparse_field_sources = {'user_company_name': ('user',)}
 
     class Meta:
         model = Order
         fields = '__all__'
-    
-    def get_user_company_name(self, obj):
-        """Get company name from user's profile"""
-        try:
-            profile = UserProfile.objects.get(user=obj.user)
-            return profile.company_name
-        except UserProfile.DoesNotExist:
-            return None
+        list_serializer_class = LoaderListSerializer
 
     def validate(self, data):
         items = data.get('items', [])
@@ -160,67 +307,117 @@ class OrderSerializer(serializers.ModelSerializer):
             if unit_price < 0:
                 raise serializers.ValidationError({f'items[{idx}].unit_price': 'Unit price must be non-negative.'})
 
+        self._resolve_item_relations(items)
         return data
 
+    def _resolve_item_relations(self, items):
+        """Swap the item ids for instances using one query per model (via the request loaders)."""
+        for field, model in (('product', Product), ('dose_pack', DosePack), ('batch', Batch)):
+            ids = {item[field] for item in items if isinstance(item.get(field), int)}
+            found = get_loader(self.context, model).load_many(ids)
+            for idx, item in enumerate(items):
+                value = item.get(field)
+                if not isinstance(value, int):
+                    continue
+                if found[value] is None:
+                    raise serializers.ValidationError({f'items[{idx}].{field}': f'Invalid {field} id'})
+                item[field] = found[value]
+
     def create(self, validated_data, user=None):
+        """Insert the order and all of its items with a constant number of queries.
+
+        Items arrive with product/dose pack/batch instances already resolved
+        by `validate`, so the total is computed up front, the order is
+        inserted once and the items go in with a single `bulk_create`.
+        """
         items_data = validated_data.pop('items', [])
         # prefer explicit user kwarg, fall back to request context
         if user is None:
             user = self.context.get('request').user if self.context.get('request') else None
 
-        # Generate order number
-        order_number = f"ORD{uuid.uuid4().hex[:12].upper()}"
+        total = sum(
+            (Decimal(str(item.get('unit_price', '0'))) * int(item.get('quantity', 0)) for item in items_data),
+            Decimal('0.00'),
+        )
 
         order = Order.objects.create(
             user=user,
-            order_number=order_number,
+            order_number=f"ORD{uuid.uuid4().hex[:12].upper()}",
             notes=validated_data.get('notes', ''),
             internal_notes=validated_data.get('internal_notes', ''),
             status=validated_data.get('status', Order.STATUS_CHOICES[0][0]),
-            total_amount=Decimal('0.00')
+            total_amount=total,
         )
 
-        total = Decimal('0.00')
-
-        for idx, item in enumerate(items_data):
-            product = item.get('product')
-            dose_pack = item.get('dose_pack', None)
-            quantity = int(item.get('quantity', 0))
-            unit_price = Decimal(str(item.get('unit_price', '0')))
-
-            # If product is provided as a PK, ensure we fetch instance
-            if isinstance(product, int) or isinstance(product, str):
-                from .models import Product as ProductModel, DosePack as DosePackModel
-                try:
-                    product = ProductModel.objects.get(pk=product)
-                except ProductModel.DoesNotExist:
-                    raise serializers.ValidationError({f'items[{idx}].product': 'Invalid product id'})
-
-            if dose_pack:
-                if isinstance(dose_pack, int) or isinstance(dose_pack, str):
-                    from .models import DosePack as DosePackModel
-                    try:
-                        dose_pack = DosePackModel.objects.get(pk=dose_pack)
-                    except DosePackModel.DoesNotExist:
-                        raise serializers.ValidationError({f'items[{idx}].dose_pack': 'Invalid dose_pack id'})
-
-            order_item = OrderItem.objects.create(
+        OrderItem.objects.bulk_create([
+            OrderItem(
                 order=order,
-                product=product,
-                product_name=getattr(product, 'name', ''),
-                dose_pack=dose_pack,
-                doses=(dose_pack.doses if dose_pack else 0),
-                quantity=quantity,
-                unit_price=unit_price,
+                product=item['product'],
+                product_name=getattr(item['product'], 'name', ''),
+                dose_pack=item.get('dose_pack'),
+                doses=(item['dose_pack'].doses if item.get('dose_pack') else 0),
+                quantity=int(item.get('quantity', 0)),
+                unit_price=Decimal(str(item.get('unit_price', '0'))),
                 requested_delivery_date=item.get('requested_delivery_date'),
-                special_instructions=item.get('special_instructions', '')
+                special_instructions=item.get('special_instructions', ''),
             )
+            for item in items_data
+        ])
+        return order
 
-            total += unit_price * quantity
 
-        order.total_amount = total
-        order.save()
-        return order
+class OrderListSerializer(OrderUserLoaderMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    """Read-only order representation for the list endpoint.
+
+    Same shape as `OrderSerializer` output, but every nested value is read
+    from the relations `OrderViewSet.get_queryset` selects/prefetches for
+    lists, so a page of orders costs a fixed number of queries.
+    """
+    items = OrderItemSerializer(many=True, read_only=True)
+    status_history = OrderStatusHistorySerializer(many=True, read_only=True)
+    user = UserSerializer(read_only=True)
+    user_company_name = serializers.SerializerMethodField()
+    expandable_fields = OrderSerializer.expandable_fields
+    sparse_field_sources = OrderSerializer.sparse_field_sources
+
+    class Meta:
+        model = Order
+        fields = '__all__'
+        read_only_fields = [f.name for f in Order._meta.concrete_fields]
+        list_serializer_class = LoaderListSerializer
+
+
+class OrderSummarySerializer(OrderUserLoaderMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    """Header-only order row (the default for order lists); counts come from DB annotations."""
+    username = serializers.CharField(source='user.username', read_only=True)
+    user_company_name = serializers.SerializerMethodField()
+    item_count = serializers.IntegerField(read_only=True)
+    total_quantity = serializers.IntegerField(read_only=True)
+    sparse_field_sources = {'username': ('user',), 'user_company_name': ('user',)}
+
+    class Meta:
+        model = Order
+        fields = ('id', 'order_number', 'status', 'total_amount', 'user', 'username', 'user_company_name', 'item_count', 'total_quantity', 'created_at', 'updated_at')
+        read_only_fields = fields
+        list_serializer_class = LoaderListSerializer
+
+
+class CartProductSerializer(serializers.ModelSerializer):
+    """Compact product snapshot rendered on each cart line."""
+    image_url = serializers.SerializerMethodField()
+    in_stock = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ('id', 'name', 'brand', 'species', 'image_url', 'image_alt', 'minimum_order_qty', 'lead_time_days', 'in_stock')
+
+    def get_image_url(self, obj):
+        url = obj.get_image_url()
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request and url else url
+
+    def get_in_stock(self, obj):
+        return obj.available_packs > 0
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -230,19 +427,31 @@ class CartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ('id', 'product', 'dose_pack', 'quantity', 'requested_delivery_date', 'special_instructions')
+        list_serializer_class = LoaderListSerializer
+
+    def prime_loaders(self, items):
+        # No-ops for lines loaded through api.cart.prefetch_cart()
+        attach(items, 'product', get_loader(self.context, Product))
+        attach(items, 'dose_pack', get_loader(self.context, DosePack))
 
     def to_representation(self, instance):
-        """Return full product and dosepack objects for convenience on GET."""
+        """Return product and dosepack objects for convenience on GET.
+
+        Products are the compact `CartProductSerializer` snapshot unless the
+        context asks for `expand_products`, which renders the full product.
+        """
+        self.prime_loaders([instance])
         data = super().to_representation(instance)
-        # Include full Product object
         if instance.product:
-            data['product'] = ProductSerializer(instance.product, context=self.context).data
+            product_serializer = ProductSerializer if self.context.get('expand_products') else CartProductSerializer
+            data['product'] = product_serializer(instance.product, context=self.context).data
         if instance.dose_pack:
             data['dose_pack'] = DosePackSerializer(instance.dose_pack).data
         return data
 
 
 class CartSerializer(serializers.ModelSerializer):
+    """Load carts with `api.cart.prefetch_cart()` so `items` costs one query."""
     items = CartItemSerializer(many=True)
 
     class Meta:
@@ -250,33 +459,11 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ('id', 'user', 'items')
         read_only_fields = ('user',)
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        # include nested product info for convenience
-        data['items'] = CartItemSerializer(instance.items.all(), many=True).data
-        return data
-
     def create_or_update_for_user(self, user, items_data):
         # Ensure the user has a cart; create if needed
         cart, _ = Cart.objects.get_or_create(user=user)
-        # Replace existing items with provided list
-        cart.items.all().delete()
-        items = []
-        for it in items_data:
-            product = it.get('product')
-            dose_pack = it.get('dose_pack', None)
-            quantity = int(it.get('quantity', 0) or 0)
-            requested_delivery_date = it.get('requested_delivery_date', None)
-            special = it.get('special_instructions', '')
-            ci = CartItem.objects.create(
-                cart=cart,
-                product=Product.objects.get(pk=product) if product else None,
-                dose_pack=(DosePack.objects.get(pk=dose_pack) if dose_pack else None),
-                quantity=quantity,
-                requested_delivery_date=requested_delivery_date,
-                special_instructions=special
-            )
-            items.append(ci)
+        # Diff the provided list against the stored items (see api/cart.py)
+        replace_cart_items(cart, items_data)
         return cart
 
 
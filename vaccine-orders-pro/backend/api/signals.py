@@ -0,0 +1,169 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .cache import catalog_cache
+from .inventory import apply_stock_delta, refresh_nearest_expiry, recompute_stock_totals
+from .models import Product, DosePack, Batch, StockThreshold
+from .search import SEARCH_FIELDS, index_product, unindex_product
+from .tags import sync_product_tags
+from .facets import adjust_facet_counts
+from .images import ensure_variants
+from .alerts import refresh_alerts
+from .authentication import token_cache
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=DosePack)
+@receiver(post_delete, sender=DosePack)
+@receiver(post_save, sender=Batch)
+@receiver(post_delete, sender=Batch)
+def invalidate_catalog_cache(sender, **kwargs):
+    """Any catalog-visible change invalidates all cached catalog payloads."""
+    catalog_cache.bump_version_on_commit()
+
+
+@receiver(post_save, sender=Batch)
+def track_batch_stock(sender, instance, created, **kwargs):
+    # stock_state() is (product, available, reserved); expired batches have no available packs
+    old_product, old_available, old_reserved = (None, 0, 0) if created else getattr(
+        instance, '_stock_snapshot', (None, None, None)
+    )
+    new_product, available, reserved = instance.stock_state()
+    if None in (old_available, old_reserved, available, reserved):
+        # Instance was not loaded with its stock fields; fall back to a full refresh.
+        recompute_stock_totals({old_product, instance.product_id} - {None})
+        instance._stock_snapshot = instance.stock_state()
+        return
+    if old_product and old_product != new_product:
+        apply_stock_delta(old_product, available=-old_available, reserved=-old_reserved)
+        old_available, old_reserved = 0, 0
+    apply_stock_delta(
+        new_product,
+        available=available - old_available,
+        reserved=reserved - old_reserved,
+    )
+    refresh_nearest_expiry([old_product, new_product])
+    instance._stock_snapshot = instance.stock_state()
+
+
+@receiver(post_delete, sender=Batch)
+def untrack_batch_stock(sender, instance, **kwargs):
+    product_id, available, reserved = getattr(instance, '_stock_snapshot', instance.stock_state())
+    if available is None or reserved is None:
+        recompute_stock_totals([product_id])
+    else:
+        apply_stock_delta(product_id, available=-available, reserved=-reserved)
+    refresh_nearest_expiry([product_id])
+
+
+@receiver(post_save, sender=DosePack)
+def track_dose_pack_units(sender, instance, created, **kwargs):
+    old_product, old_units = (None, 0) if created else getattr(instance, '_stock_snapshot', (None, None))
+    if old_units is None:
+        recompute_stock_totals([instance.product_id])
+        instance._stock_snapshot = instance.stock_state()
+        return
+    new_product, units = instance.stock_state()
+    if old_product and old_product != new_product:
+        apply_stock_delta(old_product, units=-old_units)
+        old_units = 0
+    apply_stock_delta(new_product, units=units - old_units)
+    instance._stock_snapshot = instance.stock_state()
+
+
+@receiver(post_delete, sender=DosePack)
+def untrack_dose_pack_units(sender, instance, **kwargs):
+    product_id, units = getattr(instance, '_stock_snapshot', instance.stock_state())
+    apply_stock_delta(product_id, units=-units)
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(SEARCH_FIELDS):
+        return
+    index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product_for_search(sender, instance, **kwargs):
+    unindex_product(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def sync_tags(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'tags' not in update_fields:
+        return
+    if not created and getattr(instance, '_loaded_tags', None) == instance.tags:
+        return
+    sync_product_tags(instance)
+    instance._loaded_tags = instance.tags
+
+
+@receiver(post_save, sender=Product)
+def track_facet_counts(sender, instance, created, **kwargs):
+    old = None if created else getattr(instance, '_facet_snapshot', None)
+    new = instance.facet_values()
+    if not created and old is None:
+        # Not loaded from the DB (e.g. saved with an explicit pk); counts can't be diffed.
+        return
+    adjust_facet_counts(old, new)
+    instance._facet_snapshot = new
+
+
+@receiver(post_delete, sender=Product)
+def untrack_facet_counts(sender, instance, **kwargs):
+    adjust_facet_counts(getattr(instance, '_facet_snapshot', instance.facet_values()), None)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Batch)
+def build_image_variants(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    image = instance.image
+    if not image or image.name == getattr(instance, '_loaded_image', None):
+        return
+    instance._loaded_image = image.name
+    transaction.on_commit(lambda: ensure_variants(image))
+
+
+# Registered after the stock total receivers so alerts see the updated totals
+@receiver(post_save, sender=Batch)
+@receiver(post_delete, sender=Batch)
+@receiver(post_save, sender=StockThreshold)
+@receiver(post_delete, sender=StockThreshold)
+def refresh_stock_alerts(sender, instance, origin=None, **kwargs):
+    product_ids = {instance.product_id}
+    if sender is Batch:
+        # A batch moved to another product leaves alerts behind on the old one
+        product_ids.add(getattr(instance, '_loaded_product_id', None))
+        instance._loaded_product_id = instance.product_id
+    if getattr(origin, 'model', type(origin)) is Product:
+        # Cascading from a product delete: new alerts would outlive the product row
+        product_ids.discard(instance.product_id)
+    refresh_alerts(product_ids)
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    """Logout deletes the token; it must stop authenticating at once."""
+    # Deleting clears the pk (the key) before the commit callback runs
+    key = instance.key
+    token_cache.invalidate([key])
+    # Again after commit, in case a concurrent request re-cached the old row
+    transaction.on_commit(lambda: token_cache.invalidate([key]))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_tokens(sender, instance, update_fields=None, **kwargs):
+    """Deactivation and permission changes must not be masked by cached users."""
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    user_id = instance.pk
+    token_cache.invalidate_user(user_id)
+    transaction.on_commit(lambda: token_cache.invalidate_user(user_id))
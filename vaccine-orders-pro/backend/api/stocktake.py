@@ -0,0 +1,153 @@
+"""Batched stock adjustments (stock-take uploads) for `bulk_update_stock`.
+
+All referenced batches are locked and loaded with one ordered
+`select_for_update().in_bulk()`, changes are applied in memory and written
+with one `UPDATE ... FROM (VALUES ...)` per chunk, and the audit trail goes
+in with one `bulk_create`. Because those writes bypass model signals, the
+product stock totals, nearest expiry, stock alerts and catalog cache are
+maintained here.
+"""
+from collections import defaultdict
+
+from django.db import connection
+from django.utils import timezone
+
+from .alerts import refresh_alerts
+from .cache import catalog_cache
+from .inventory import apply_stock_deltas, refresh_nearest_expiry
+from .models import Batch, InventoryLog
+
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+
+
+def _clean(update):
+    """(batch_id, changes, reason, errors) for one raw update entry."""
+    if not isinstance(update, dict):
+        return None, {}, '', {'non_field_errors': 'Expected an object.'}
+    errors = {}
+    batch_id = update.get('batch_id')
+    if isinstance(batch_id, bool) or not isinstance(batch_id, (int, str)) or not str(batch_id).isdigit():
+        errors['batch_id'] = 'A valid integer is required.'
+        batch_id = None
+    else:
+        batch_id = int(batch_id)
+
+    changes = {}
+    if update.get('quantity') is not None:
+        quantity = update['quantity']
+        if isinstance(quantity, bool) or not str(quantity).lstrip('-').isdigit():
+            errors['quantity'] = 'A valid integer is required.'
+        elif int(quantity) < 0:
+            errors['quantity'] = 'Quantity cannot be negative.'
+        else:
+            changes['quantity'] = int(quantity)
+    if update.get('storage_location') is not None:
+        location = update['storage_location']
+        if not isinstance(location, str) or len(location) > Batch._meta.get_field('storage_location').max_length:
+            errors['storage_location'] = 'Expected a string of at most 100 characters.'
+        else:
+            changes['storage_location'] = location
+    reason = update.get('reason') or 'Bulk adjustment'
+    return batch_id, changes, str(reason), errors
+
+
+def bulk_adjust_batches(updates, performed_by=None):
+    """Apply `[{batch_id, quantity?, storage_location?, reason?}, ...]`.
+
+    Must be called inside `transaction.atomic()`. Returns one result dict
+    per input row, in order: `{'index', 'batch_id', 'status', ...}` where
+    status is updated / unchanged / not_found / invalid.
+    """
+    cleaned = [_clean(update) for update in updates]
+    ids = sorted({batch_id for batch_id, _, _, errors in cleaned if batch_id is not None and not errors})
+    # Ordered locking so concurrent uploads cannot deadlock each other
+    batches = Batch.objects.select_for_update().order_by('pk').in_bulk(ids) if ids else {}
+
+    now = timezone.now()
+    results = []
+    touched = {}
+    logs = []
+    available_delta = defaultdict(int)
+    for index, (batch_id, changes, reason, errors) in enumerate(cleaned):
+        result = {'index': index, 'batch_id': batch_id}
+        if errors:
+            results.append({**result, 'status': INVALID, 'errors': errors})
+            continue
+        batch = batches.get(batch_id)
+        if batch is None:
+            results.append({**result, 'status': NOT_FOUND})
+            continue
+        if changes.get('quantity', batch.quantity) < batch.quantity_reserved:
+            results.append({**result, 'status': INVALID, 'errors': {
+                'quantity': f'Quantity cannot be below the {batch.quantity_reserved} packs already reserved.'
+            }})
+            continue
+
+        old_quantity = batch.quantity
+        changed = [field for field, value in changes.items() if getattr(batch, field) != value]
+        if not changed:
+            results.append({**result, 'status': UNCHANGED, 'quantity': batch.quantity})
+            continue
+        for field in changed:
+            setattr(batch, field, changes[field])
+        batch.updated_at = now
+        touched[batch.pk] = batch
+        delta = batch.quantity - old_quantity
+        if batch.status != Batch.EXPIRED:
+            available_delta[batch.product_id] += delta
+        logs.append(InventoryLog(
+            product_id=batch.product_id,
+            batch=batch,
+            action='adjusted',
+            quantity_changed=delta,
+            reason=reason,
+            performed_by=performed_by,
+        ))
+        results.append({**result, 'status': UPDATED, 'quantity': batch.quantity, 'quantity_changed': delta})
+
+    if touched:
+        write_batches(list(touched.values()), now)
+        InventoryLog.objects.bulk_create(logs, batch_size=500)
+        product_ids = {batch.product_id for batch in touched.values()}
+        apply_stock_deltas({pid: {'available': available_delta[pid]} for pid in product_ids})
+        refresh_nearest_expiry(product_ids)
+        refresh_alerts(product_ids)
+        catalog_cache.bump_version_on_commit()
+    return results
+
+
+def _supports_update_from():
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 33)
+
+
+def write_batches(batches, now, chunk_size=300):
+    """Persist `quantity` and `storage_location` of `batches`, stamping `updated_at`.
+
+    `bulk_update` builds a CASE WHEN per row and field, which costs seconds
+    of Python for a few thousand rows; joining against a VALUES list is one
+    cheap statement per chunk.
+    """
+    if not _supports_update_from():
+        Batch.objects.bulk_update(batches, ['quantity', 'storage_location', 'updated_at'], batch_size=500)
+        return
+    qn = connection.ops.quote_name
+    table = qn(Batch._meta.db_table)
+    updated_at = connection.ops.adapt_datetimefield_value(now)
+    with connection.cursor() as cursor:
+        for start in range(0, len(batches), chunk_size):
+            chunk = batches[start:start + chunk_size]
+            values = ', '.join(['(%s, %s, %s)'] * len(chunk))
+            params = [updated_at]
+            for batch in chunk:
+                params += [batch.pk, batch.quantity, batch.storage_location]
+            cursor.execute(
+                f"UPDATE {table} SET {qn('quantity')} = CAST(v.column2 AS integer), "
+                f"{qn('storage_location')} = v.column3, {qn('updated_at')} = %s "
+                f"FROM (VALUES {values}) AS v WHERE {table}.{qn('id')} = v.column1",
+                params,
+            )
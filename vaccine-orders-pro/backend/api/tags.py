@@ -0,0 +1,82 @@
+"""Normalized product tags.
+
+`Product.tags` stays the API-facing value (a JSON list stored as a string),
+so clients read and write exactly what they did before. Every product save
+mirrors it into `Tag`/`ProductTag` rows, which back the indexed `?tag=`
+filter and the per-tag counts.
+"""
+import json
+
+from django.db.models import Count
+
+from .cache import catalog_cache
+from .models import Tag, ProductTag
+
+
+def parse_tags(value):
+    """Parse the stored tags string into a de-duplicated list of lowercase names."""
+    if isinstance(value, (list, tuple)):
+        raw = value
+    else:
+        try:
+            raw = json.loads(value or '[]')
+        except (TypeError, ValueError):
+            raw = str(value).split(',')
+        if not isinstance(raw, list):
+            raw = [raw]
+    names = []
+    for item in raw:
+        name = str(item).strip().lower()[:100]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def sync_product_tags(product):
+    """Make the product's ProductTag rows match `product.tags`."""
+    names = set(parse_tags(product.tags))
+    current = dict(
+        ProductTag.objects.filter(product=product).values_list('tag__name', 'id')
+    )
+    stale = [link_id for name, link_id in current.items() if name not in names]
+    if stale:
+        ProductTag.objects.filter(id__in=stale).delete()
+    missing = names - set(current)
+    if missing:
+        Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+        tag_ids = Tag.objects.filter(name__in=missing).values_list('id', flat=True)
+        ProductTag.objects.bulk_create(
+            [ProductTag(product=product, tag_id=tag_id) for tag_id in tag_ids],
+            ignore_conflicts=True,
+        )
+
+
+def filter_by_tags(queryset, names, match_all=True):
+    """Products tagged with all (or any) of `names`, via the (tag, product) index."""
+    names = parse_tags(list(names))
+    if not names:
+        return queryset
+    links = ProductTag.objects.filter(tag__name__in=names)
+    if match_all:
+        links = (
+            links.values('product_id')
+            .annotate(matched=Count('tag_id', distinct=True))
+            .filter(matched=len(names))
+        )
+    return queryset.filter(pk__in=links.values('product_id'))
+
+
+def tag_counts():
+    """[{'name', 'count'}] for every tag in use, cached per catalog version."""
+    key = catalog_cache.make_key('tags', 'counts')
+    counts = catalog_cache.get(key) if catalog_cache.enabled() else None
+    if counts is None:
+        counts = list(
+            Tag.objects.annotate(count=Count('product_tags'))
+            .filter(count__gt=0)
+            .order_by('-count', 'name')
+            .values('name', 'count')
+        )
+        if catalog_cache.enabled():
+            catalog_cache.set(key, counts)
+    return counts
@@ -1,9 +1,29 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
 from rest_framework.test import APIClient
 from django.urls import reverse
+from django.core.management import call_command
+from io import BytesIO, StringIO
+from pathlib import Path
+import gzip
+import os
+import tempfile
+from unittest import skipUnless
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
 from django.contrib.auth.models import User
-from .models import Product, DosePack
+from .models import Product, DosePack, Batch, Order, InventoryLog, OrderStatusHistory, UserProfile, ProductTag
+from .models import StockAlert, StockThreshold, Cart
+from .cache import catalog_cache, LocMemLRUBackend
+from . import images
+from .authentication import token_cache
+from .loaders import get_loader
+from .pagination import _seek_filter
+from .serializers import OrderListSerializer, OrderSummarySerializer, UserSerializer
+from rest_framework.authtoken.models import Token
 from decimal import Decimal
+from datetime import date, timedelta
 
 
 class OrderAPITests(TestCase):
@@ -57,6 +77,35 @@ class OrderAPITests(TestCase):
 		resp = self.client.post(url, payload, format='json')
 		self.assertEqual(resp.status_code, 400)
 
+	def test_create_order_query_count_independent_of_line_count(self):
+		self.client.force_authenticate(user=self.user)
+		url = reverse('order-list')
+
+		def post(lines):
+			payload = {'items': [
+				{'product': self.product.id, 'dose_pack': self.dose_pack.id, 'quantity': 1, 'unit_price': '2.00', 'requested_delivery_date': '2026-01-10'}
+				for _ in range(lines)
+			]}
+			with CaptureQueriesContext(connection) as ctx:
+				resp = self.client.post(url, payload, format='json')
+			self.assertEqual(resp.status_code, 201)
+			self.assertEqual(Decimal(resp.data['total_amount']), Decimal('2.00') * lines)
+			self.assertEqual(len(resp.data['items']), lines)
+			return len(ctx.captured_queries)
+
+		post(1)  # warm per-user caches (e.g. the missing profile lookup)
+		self.assertEqual(post(2), post(50))
+
+	def test_create_order_invalid_dose_pack(self):
+		self.client.force_authenticate(user=self.user)
+		payload = {'items': [
+			{'product': self.product.id, 'dose_pack': self.dose_pack.id, 'quantity': 1, 'unit_price': '5.00', 'requested_delivery_date': '2026-01-10'},
+			{'product': self.product.id, 'dose_pack': 9999, 'quantity': 1, 'unit_price': '5.00', 'requested_delivery_date': '2026-01-10'},
+		]}
+		resp = self.client.post(reverse('order-list'), payload, format='json')
+		self.assertEqual(resp.status_code, 400)
+		self.assertIn('items[1].dose_pack', resp.data)
+
 	def test_admin_set_status_and_add_internal_note(self):
 		# create an order as normal user
 		self.client.force_authenticate(user=self.user)
@@ -81,3 +130,1458 @@ class OrderAPITests(TestCase):
 		note_url = reverse('order-add-internal-note', kwargs={'pk': order_id})
 		r3 = self.client.post(note_url, {'note': 'Handled by admin'}, format='json')
 		self.assertEqual(r3.status_code, 200)
+
+
+@override_settings(CATALOG_CACHE={'ENABLED': False})
+class CatalogQueryCountTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+
+	def _make_products(self, count, start=0):
+		for i in range(start, start + count):
+			product = Product.objects.create(
+				name=f'Vaccine {i}', brand='BrandX', species='poultry', product_type='live',
+				manufacturer='Mfg', description='desc', active_ingredients='ing',
+				storage_temp_range='2-8C', administration_notes='notes'
+			)
+			DosePack.objects.create(product=product, doses=100, units_per_pack=2)
+			DosePack.objects.create(product=product, doses=500, units_per_pack=5)
+			Batch.objects.create(product=product, batch_number=f'B{i}-1', expiry_date=date(2030, 1, 1), quantity=10, quantity_reserved=3)
+			Batch.objects.create(product=product, batch_number=f'B{i}-2', expiry_date=date(2031, 1, 1), quantity=5)
+
+	def test_product_list_query_count_is_constant(self):
+		url = reverse('product-list')
+		self._make_products(2)
+		# ETag validators (products, batches, dose packs) + products, dose packs, batches
+		with self.assertNumQueries(6):
+			resp = self.client.get(url)
+		self.assertEqual(len(resp.data), 2)
+
+		self._make_products(10, start=2)
+		with self.assertNumQueries(6):
+			resp = self.client.get(url)
+		self.assertEqual(len(resp.data), 12)
+
+	def test_product_totals_from_prefetched_data(self):
+		self._make_products(1)
+		product = Product.objects.get()
+		resp = self.client.get(reverse('product-detail', kwargs={'pk': product.id}))
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.data['total_stock'], 12)
+		self.assertEqual(resp.data['total_units'], 7)
+		self.assertEqual([b['batch_number'] for b in resp.data['batches']], ['B0-1', 'B0-2'])
+
+
+class CatalogCacheTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		catalog_cache.reset(LocMemLRUBackend(max_entries=8))
+		self.admin = User.objects.create_user(username='admin', password='pass', is_staff=True)
+		self.product = Product.objects.create(
+			name='Vaccine A', brand='BrandX', species='poultry', product_type='live',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes'
+		)
+		self.batch = Batch.objects.create(product=self.product, batch_number='B1', expiry_date=date(2030, 1, 1), quantity=10)
+
+	def tearDown(self):
+		catalog_cache.reset(LocMemLRUBackend())
+
+	def test_second_request_is_served_from_cache(self):
+		url = reverse('product-list')
+		first = self.client.get(url)
+		self.assertEqual(first['X-Catalog-Cache'], 'MISS')
+		with self.assertNumQueries(0):
+			second = self.client.get(url)
+		self.assertEqual(second['X-Catalog-Cache'], 'HIT')
+		self.assertEqual(first.data, second.data)
+		self.assertEqual(catalog_cache.stats()['hits'], 1)
+		self.assertEqual(catalog_cache.stats()['misses'], 1)
+
+	def test_model_save_invalidates_cache(self):
+		url = reverse('product-detail', kwargs={'pk': self.product.id})
+		self.client.get(url)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.product.name = 'Vaccine B'
+			self.product.save()
+		resp = self.client.get(url)
+		self.assertEqual(resp['X-Catalog-Cache'], 'MISS')
+		self.assertEqual(resp.data['name'], 'Vaccine B')
+
+	def test_bulk_update_stock_invalidates_cache(self):
+		url = reverse('product-list')
+		self.client.get(url)
+		version = catalog_cache.stats()['version']
+		self.client.force_authenticate(user=self.admin)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.post(reverse('batch-bulk-update-stock'), {'updates': [{'batch_id': self.batch.id, 'quantity': 4}]}, format='json')
+		self.assertGreater(catalog_cache.stats()['version'], version)
+		resp = self.client.get(url)
+		self.assertEqual(resp.data[0]['total_stock'], 4)
+
+	def test_lru_backend_evicts_oldest_entry(self):
+		backend = LocMemLRUBackend(max_entries=2)
+		backend.set('a', 1)
+		backend.set('b', 2)
+		backend.get('a')
+		backend.set('c', 3)
+		self.assertIsNone(backend.get('b'))
+		self.assertEqual(backend.get('a'), 1)
+		self.assertEqual(len(backend), 2)
+
+	def test_lru_backend_entries_expire(self):
+		backend = LocMemLRUBackend(timeout=0)
+		backend.set('a', 1)
+		self.assertIsNone(backend.get('a'))
+		backend = LocMemLRUBackend(timeout=60)
+		backend.set('a', 1)
+		self.assertEqual(backend.get('a'), 1)
+
+	@override_settings(CATALOG_CACHE={'BACKEND': 'locmem', 'TIMEOUT': 0})
+	def test_configured_timeout_bounds_stale_entries(self):
+		catalog_cache.reset(None)
+		catalog_cache._backend = None
+		url = reverse('product-list')
+		self.client.get(url)
+		# A bump made by another process never reaches this one; the TTL does
+		Product.objects.filter(pk=self.product.pk).update(name='Renamed elsewhere')
+		resp = self.client.get(url)
+		self.assertEqual(resp['X-Catalog-Cache'], 'MISS')
+		self.assertEqual(resp.data[0]['name'], 'Renamed elsewhere')
+
+
+@override_settings(CATALOG_CACHE={'ENABLED': False})
+class ConditionalGetTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.user = User.objects.create_user(username='tester', password='pass')
+		self.product = Product.objects.create(
+			name='Vaccine A', brand='BrandX', species='poultry', product_type='live',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes'
+		)
+		self.dose_pack = DosePack.objects.create(product=self.product, doses=10, units_per_pack=1)
+
+	def test_product_list_returns_304_for_matching_etag(self):
+		url = reverse('product-list')
+		first = self.client.get(url)
+		self.assertEqual(first.status_code, 200)
+		etag = first['ETag']
+		self.assertTrue(first.has_header('Last-Modified'))
+		# only the validator aggregates run, nothing is serialized
+		with self.assertNumQueries(3):
+			second = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(second.status_code, 304)
+		self.assertEqual(second['ETag'], etag)
+
+	def test_nested_change_invalidates_product_etag(self):
+		url = reverse('product-detail', kwargs={'pk': self.product.id})
+		etag = self.client.get(url)['ETag']
+		Batch.objects.create(product=self.product, batch_number='B1', expiry_date=date(2030, 1, 1), quantity=5)
+		resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(resp.status_code, 200)
+		self.assertNotEqual(resp['ETag'], etag)
+
+	def test_order_list_and_detail_conditional(self):
+		self.client.force_authenticate(user=self.user)
+		payload = {'items': [{'product': self.product.id, 'dose_pack': self.dose_pack.id, 'quantity': 1, 'unit_price': '5.00', 'requested_delivery_date': '2026-01-10'}]}
+		order_id = self.client.post(reverse('order-list'), payload, format='json').data['id']
+		for url in (reverse('order-list'), reverse('order-detail', kwargs={'pk': order_id})):
+			first = self.client.get(url)
+			self.assertIn('private', first['Cache-Control'])
+			resp = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+			self.assertEqual(resp.status_code, 304)
+
+	def test_missing_object_still_404s(self):
+		resp = self.client.get(reverse('product-detail', kwargs={'pk': 9999}))
+		self.assertEqual(resp.status_code, 404)
+
+
+class StockTotalsTests(TestCase):
+	def setUp(self):
+		self.product = Product.objects.create(
+			name='Vaccine A', brand='BrandX', species='poultry', product_type='live',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes'
+		)
+		self.other = Product.objects.create(
+			name='Vaccine B', brand='BrandX', species='swine', product_type='killed',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes'
+		)
+
+	def _totals(self, product):
+		product.refresh_from_db()
+		return (product.available_packs, product.reserved_packs, product.total_units, product.nearest_expiry)
+
+	def test_batch_writes_maintain_totals(self):
+		early = Batch.objects.create(product=self.product, batch_number='B1', expiry_date=date(2030, 1, 1), quantity=10)
+		Batch.objects.create(product=self.product, batch_number='B2', expiry_date=date(2031, 1, 1), quantity=5)
+		self.assertEqual(self._totals(self.product), (15, 0, 0, date(2030, 1, 1)))
+
+		# reserving the whole early batch moves nearest expiry to the next batch
+		early = Batch.objects.get(pk=early.pk)
+		early.quantity_reserved = 10
+		early.save()
+		self.assertEqual(self._totals(self.product), (5, 10, 0, date(2031, 1, 1)))
+
+		early.product = self.other
+		early.save()
+		self.assertEqual(self._totals(self.product), (5, 0, 0, date(2031, 1, 1)))
+		self.assertEqual(self._totals(self.other), (0, 10, 0, None))
+
+		early.delete()
+		self.assertEqual(self._totals(self.other), (0, 0, 0, None))
+
+	def test_dose_pack_writes_maintain_units(self):
+		pack = DosePack.objects.create(product=self.product, doses=10, units_per_pack=4)
+		DosePack.objects.create(product=self.product, doses=20, units_per_pack=6)
+		pack.units_per_pack = 1
+		pack.save()
+		self.assertEqual(self._totals(self.product)[2], 7)
+		pack.delete()
+		self.assertEqual(self._totals(self.product)[2], 6)
+
+	def test_stale_product_save_keeps_totals(self):
+		stale = Product.objects.get(pk=self.product.pk)
+		Batch.objects.create(product=self.product, batch_number='B1', expiry_date=date(2030, 1, 1), quantity=10)
+		stale.name = 'Renamed'
+		stale.save()
+		self.assertEqual(self._totals(self.product)[0], 10)
+
+	def test_verify_command_detects_and_fixes_drift(self):
+		Batch.objects.create(product=self.product, batch_number='B1', expiry_date=date(2030, 1, 1), quantity=10)
+		Product.objects.filter(pk=self.product.pk).update(available_packs=99)
+		out = StringIO()
+		call_command('verify_stock_totals', stdout=out)
+		self.assertIn('1 of 2 products have drifted', out.getvalue())
+		call_command('verify_stock_totals', '--fix', stdout=StringIO())
+		self.assertEqual(self._totals(self.product)[0], 10)
+		out = StringIO()
+		call_command('verify_stock_totals', stdout=out)
+		self.assertIn('All 2 products', out.getvalue())
+
+
+class KeysetPaginationTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.admin = User.objects.create_user(username='admin', password='pass', is_staff=True)
+		self.product = Product.objects.create(
+			name='Vaccine A', brand='BrandX', species='poultry', product_type='live',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes'
+		)
+		self.orders = [
+			Order.objects.create(user=self.admin, order_number=f'ORD{i}', total_amount=Decimal('1.00'))
+			for i in range(5)
+		]
+		self.client.force_authenticate(user=self.admin)
+
+	def test_unpaginated_by_default(self):
+		resp = self.client.get(reverse('order-list'))
+		self.assertIsInstance(resp.data, list)
+		self.assertEqual(len(resp.data), 5)
+
+	def test_orders_walk_forward_and_back(self):
+		resp = self.client.get(reverse('order-list'), {'page_size': 2})
+		self.assertIsNone(resp.data['previous'])
+		seen = [o['id'] for o in resp.data['results']]
+		first_page = list(seen)
+		while resp.data['next']:
+			resp = self.client.get(resp.data['next'])
+			seen += [o['id'] for o in resp.data['results']]
+		# newest first, every order exactly once
+		self.assertEqual(seen, [o.id for o in reversed(self.orders)])
+
+		resp = self.client.get(reverse('order-list'), {'page_size': 2})
+		resp = self.client.get(resp.data['next'])
+		resp = self.client.get(resp.data['previous'])
+		self.assertEqual([o['id'] for o in resp.data['results']], first_page)
+		self.assertIsNone(resp.data['previous'])
+
+	@skipUnless(connection.vendor == 'sqlite', 'asserts on the SQLite query plan')
+	def test_deep_pages_seek_the_index(self):
+		ordering = ('-created_at', '-id')
+		last = self.orders[2]
+		page = Order.objects.filter(_seek_filter(ordering, [last.created_at, last.id])).order_by(*ordering)[:3]
+		# One range seek: no index scan from the newest order down, no MULTI-INDEX OR
+		steps = [line.split(' ', 3)[-1] for line in page.explain().splitlines()]
+		self.assertEqual(steps, ['SEARCH api_order USING INDEX order_created_id_idx (created_at<?)'])
+		self.assertEqual(list(page), [self.orders[1], self.orders[0]])
+
+	def test_inventory_logs_and_batches_paginate(self):
+		for i in range(3):
+			batch = Batch.objects.create(product=self.product, batch_number=f'B{i}', expiry_date=date(2030, 1, 3 - i), quantity=1)
+			InventoryLog.objects.create(product=self.product, batch=batch, action='received', quantity_changed=1)
+		resp = self.client.get(reverse('inventory-log-list'), {'page_size': 2})
+		self.assertEqual(len(resp.data['results']), 2)
+		resp = self.client.get(resp.data['next'])
+		self.assertEqual(len(resp.data['results']), 1)
+		self.assertIsNone(resp.data['next'])
+
+		resp = self.client.get(reverse('batch-list'), {'page_size': 2})
+		self.assertEqual([b['batch_number'] for b in resp.data['results']], ['B2', 'B1'])
+
+	def test_invalid_cursor(self):
+		resp = self.client.get(reverse('order-list'), {'cursor': 'garbage'})
+		self.assertEqual(resp.status_code, 404)
+
+	def test_status_history_is_scoped_to_own_orders(self):
+		other = User.objects.create_user(username='other', password='pass')
+		mine = Order.objects.create(user=other, order_number='ORDX', total_amount=Decimal('1.00'))
+		OrderStatusHistory.objects.create(order=mine, status='requested')
+		OrderStatusHistory.objects.create(order=self.orders[0], status='requested')
+		self.client.force_authenticate(user=other)
+		resp = self.client.get(reverse('order-status-history-list'), {'page_size': 10})
+		self.assertEqual(len(resp.data['results']), 1)
+
+
+class AllocationEngineTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.admin = User.objects.create_user(username='admin', password='pass', is_staff=True)
+		self.client.force_authenticate(user=self.admin)
+
+	def _product(self, name, batches=(), with_dose_pack=True):
+		product = Product.objects.create(
+			name=name, brand='BrandX', species='poultry', product_type='live',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes'
+		)
+		dose_pack = DosePack.objects.create(product=product, doses=10, units_per_pack=2) if with_dose_pack else None
+		for i, (expiry, quantity) in enumerate(batches):
+			Batch.objects.create(product=product, batch_number=f'{name}-{i}', expiry_date=expiry, quantity=quantity)
+		return product, dose_pack
+
+	def _order(self, lines):
+		order = Order.objects.create(user=self.admin, order_number=f'ORD{Order.objects.count()}', total_amount=Decimal('0'))
+		for product, dose_pack, quantity in lines:
+			order.items.create(
+				product=product, product_name=product.name, dose_pack=dose_pack, doses=10,
+				quantity=quantity, unit_price=Decimal('1.00'), requested_delivery_date=date(2026, 1, 10)
+			)
+		return order
+
+	def _confirm(self, order):
+		return self.client.post(reverse('order-set-status', kwargs={'pk': order.id}), {'status': 'confirmed'}, format='json')
+
+	def test_allocates_fefo_across_lines_and_batches(self):
+		product, dose_pack = self._product('A', [(date(2031, 1, 1), 10), (date(2030, 1, 1), 4)])
+		order = self._order([(product, dose_pack, 3), (product, dose_pack, 5)])
+		self.assertEqual(self._confirm(order).status_code, 200)
+		reserved = dict(Batch.objects.values_list('batch_number', 'quantity_reserved'))
+		self.assertEqual(reserved, {'A-1': 4, 'A-0': 4})
+		logs = InventoryLog.objects.filter(related_order=order).order_by('id')
+		self.assertEqual([log.quantity_changed for log in logs], [-6, -2, -8])
+		product.refresh_from_db()
+		self.assertEqual((product.available_packs, product.reserved_packs), (6, 8))
+		self.assertEqual(product.nearest_expiry, date(2031, 1, 1))
+		self.assertEqual(product.available_stock, 2 + 6)
+
+	def test_query_count_independent_of_line_count(self):
+		def count_for(lines):
+			products = [self._product(f'P{lines}-{i}', [(date(2030, 1, 1), 5), (date(2031, 1, 1), 5)]) for i in range(lines)]
+			order = self._order([(p, dp, 7) for p, dp in products])
+			with CaptureQueriesContext(connection) as ctx:
+				self.assertEqual(self._confirm(order).status_code, 200)
+			return len(ctx.captured_queries)
+		self.assertEqual(count_for(2), count_for(8))
+
+	def test_insufficient_stock_rolls_back(self):
+		product, _ = self._product('A', [(date(2030, 1, 1), 2)], with_dose_pack=False)
+		order = self._order([(product, None, 5)])
+		resp = self._confirm(order)
+		self.assertEqual(resp.status_code, 400)
+		self.assertIn('Insufficient stock', resp.data['detail'])
+		self.assertEqual(Batch.objects.get().quantity_reserved, 0)
+		self.assertFalse(InventoryLog.objects.exists())
+
+
+@override_settings(CATALOG_CACHE={'ENABLED': False})
+class OrderListTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.admin = User.objects.create_user(username='admin', password='pass', is_staff=True)
+		self.product = Product.objects.create(
+			name='Vaccine A', brand='BrandX', species='poultry', product_type='live',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes'
+		)
+		self.client.force_authenticate(user=self.admin)
+
+	def _make_orders(self, count):
+		for i in range(count):
+			user = User.objects.create_user(username=f'customer{Order.objects.count()}')
+			UserProfile.objects.create(user=user, company_name=f'Farm {i}')
+			order = Order.objects.create(user=user, order_number=f'ORD{Order.objects.count()}', total_amount=Decimal('3.00'))
+			for quantity in (1, 2):
+				order.items.create(
+					product=self.product, product_name=self.product.name, doses=10, quantity=quantity,
+					unit_price=Decimal('1.00'), requested_delivery_date=date(2026, 1, 10)
+				)
+			OrderStatusHistory.objects.create(order=order, status='requested', changed_by=self.admin)
+
+	def test_list_query_count_is_constant(self):
+		url = reverse('order-list')
+		self._make_orders(2)
+		with CaptureQueriesContext(connection) as small:
+			resp = self.client.get(url)
+		self.assertEqual(resp.data[0]['user_company_name'], 'Farm 0')
+		self.assertEqual(resp.data[0]['user']['company_name'], 'Farm 0')
+		self.assertEqual(resp.data[0]['status_history'][0]['changed_by_username'], 'admin')
+		self.assertEqual(len(resp.data[0]['items']), 2)
+		self._make_orders(8)
+		with CaptureQueriesContext(connection) as large:
+			resp = self.client.get(url)
+		self.assertEqual(len(resp.data), 10)
+		self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+	def test_summary_view(self):
+		self._make_orders(3)
+		resp = self.client.get(reverse('order-list'), {'view': 'summary'})
+		row = resp.data[0]
+		self.assertNotIn('items', row)
+		self.assertNotIn('status_history', row)
+		self.assertEqual((row['item_count'], row['total_quantity']), (2, 3))
+		self.assertEqual(row['user_company_name'], 'Farm 0')
+		# Existing clients keep the nested list unless they opt in
+		row = self.client.get(reverse('order-list')).data[0]
+		self.assertEqual(len(row['items']), 2)
+		self.assertEqual(row['user']['company_name'], 'Farm 0')
+
+	def test_retrieve_keeps_full_representation(self):
+		self._make_orders(1)
+		order = Order.objects.get()
+		resp = self.client.get(reverse('order-detail', kwargs={'pk': order.id}))
+		self.assertEqual(len(resp.data['items']), 2)
+		self.assertEqual(len(resp.data['status_history']), 1)
+
+
+class ProductSearchTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+
+	def _product(self, name, **kwargs):
+		fields = dict(
+			brand='BrandX', species='poultry', product_type='live', manufacturer='Mfg',
+			description='desc', active_ingredients='ing', storage_temp_range='2-8C', administration_notes='notes'
+		)
+		fields.update(kwargs)
+		return Product.objects.create(name=name, **fields)
+
+	def _search(self, q):
+		resp = self.client.get(reverse('product-search'), {'q': q})
+		self.assertEqual(resp.status_code, 200)
+		return [p['name'] for p in resp.data]
+
+	def test_prefix_match_ranked_by_field_weight(self):
+		self._product('Gumboro Vaccine', description='protects against newcastle exposure')
+		self._product('Newcastle Disease Vaccine')
+		self._product('Swine Fever Vaccine', species='swine')
+		self.assertEqual(self._search('newc'), ['Newcastle Disease Vaccine', 'Gumboro Vaccine'])
+		self.assertEqual(self._search('vacc swi'), ['Swine Fever Vaccine'])
+		self.assertEqual(self._search(''), [])
+
+	def test_index_follows_updates_and_deletes(self):
+		product = self._product('Marek Vaccine', tags='["hvt"]')
+		self.assertEqual(self._search('hvt'), ['Marek Vaccine'])
+		product.tags = '["rispens"]'
+		product.save()
+		self.assertEqual(self._search('hvt'), [])
+		self.assertEqual(self._search('risp'), ['Marek Vaccine'])
+		product.delete()
+		self.assertEqual(self._search('risp'), [])
+
+	def test_fts_syntax_is_not_interpreted(self):
+		self._product('Coryza Vaccine')
+		self.assertEqual(self._search('coryza" OR "x'), [])
+		self.assertEqual(self._search('NEAR(coryza'), [])
+
+
+@override_settings(CATALOG_CACHE={'ENABLED': False})
+class ProductTagTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+
+	def _product(self, name, tags):
+		return Product.objects.create(
+			name=name, brand='BrandX', species='poultry', product_type='live', manufacturer='Mfg',
+			description='desc', active_ingredients='ing', storage_temp_range='2-8C',
+			administration_notes='notes', tags=tags
+		)
+
+	def _names(self, params):
+		resp = self.client.get(reverse('product-list'), params)
+		self.assertEqual(resp.status_code, 200)
+		return sorted(p['name'] for p in resp.data)
+
+	def test_tags_are_mirrored_and_output_unchanged(self):
+		product = self._product('A', '["Live", "poultry", "live"]')
+		self.assertEqual(sorted(ProductTag.objects.values_list('tag__name', flat=True)), ['live', 'poultry'])
+		product.tags = '["poultry", "spray"]'
+		product.save()
+		self.assertEqual(sorted(ProductTag.objects.values_list('tag__name', flat=True)), ['poultry', 'spray'])
+		resp = self.client.get(reverse('product-detail', kwargs={'pk': product.id}))
+		self.assertEqual(resp.data['tags'], '["poultry", "spray"]')
+
+	def test_filter_all_and_any(self):
+		self._product('A', '["live", "poultry"]')
+		self._product('B', '["live", "swine"]')
+		self._product('C', '["killed", "poultry"]')
+		self.assertEqual(self._names({'tag': ['live', 'poultry']}), ['A'])
+		self.assertEqual(self._names({'tag': ['swine', 'killed'], 'tag_mode': 'any'}), ['B', 'C'])
+		self.assertEqual(self._names({'tag': 'POULTRY'}), ['A', 'C'])
+		self.assertEqual(self._names({'tag': 'missing'}), [])
+
+	def test_tag_counts(self):
+		self._product('A', '["live", "poultry"]')
+		self._product('B', '["live"]')
+		resp = self.client.get(reverse('product-tags'))
+		self.assertEqual(resp.data, [{'name': 'live', 'count': 2}, {'name': 'poultry', 'count': 1}])
+
+
+class ProductFacetTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+
+	def _product(self, name, **kwargs):
+		fields = dict(
+			brand='BrandX', species='poultry', product_type='live', manufacturer='Mfg',
+			description='desc', active_ingredients='ing', storage_temp_range='2-8C', administration_notes='notes'
+		)
+		fields.update(kwargs)
+		return Product.objects.create(name=name, **fields)
+
+	def _counts(self, facet):
+		resp = self.client.get(reverse('product-facets'))
+		return {row['value']: row['count'] for row in resp.data['facets'][facet]}
+
+	def test_counts_follow_product_writes(self):
+		a = self._product('A')
+		self._product('B', species='swine', brand='BrandY', cold_chain_required=False)
+		self.assertEqual(self._counts('species'), {'poultry': 1, 'swine': 1})
+		self.assertEqual(self._counts('cold_chain_required'), {'true': 1, 'false': 1})
+		a = Product.objects.get(pk=a.pk)
+		a.species = 'swine'
+		a.save()
+		self.assertEqual(self._counts('species'), {'swine': 2})
+		a.delete()
+		self.assertEqual(self._counts('species'), {'swine': 1})
+		self.assertEqual(self._counts('brand'), {'BrandY': 1})
+
+	def test_filtered_paginated_results(self):
+		for i in range(5):
+			self._product(f'P{i}', brand='BrandX' if i % 2 else 'BrandY', cold_chain_required=i < 3)
+		resp = self.client.get(reverse('product-facets'), {'brand': ['BrandY'], 'cold_chain_required': 'true', 'page_size': 1})
+		self.assertEqual([p['name'] for p in resp.data['results']], ['P0'])
+		resp = self.client.get(resp.data['next'])
+		self.assertEqual([p['name'] for p in resp.data['results']], ['P2'])
+		self.assertIsNone(resp.data['next'])
+		self.assertEqual(len(resp.data['facets']['brand']), 2)
+
+	def test_rebuild_command_matches_incremental_counts(self):
+		self._product('A')
+		self._product('B', species='swine')
+		before = self.client.get(reverse('product-facets')).data['facets']
+		call_command('rebuild_facet_counts', stdout=StringIO())
+		self.assertEqual(self.client.get(reverse('product-facets')).data['facets'], before)
+
+
+@override_settings(CATALOG_CACHE={'ENABLED': False})
+class SparseFieldsetTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.admin = User.objects.create_user(username='admin', password='pass', is_staff=True)
+		self.product = Product.objects.create(
+			name='Vaccine A', brand='BrandX', species='poultry', product_type='live',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes', image_url='http://img/a.png'
+		)
+		DosePack.objects.create(product=self.product, doses=10, units_per_pack=1)
+		Batch.objects.create(product=self.product, batch_number='B1', expiry_date=date(2030, 1, 1), quantity=10)
+
+	def test_product_fields_limit_payload_and_columns(self):
+		url = reverse('product-list')
+		with CaptureQueriesContext(connection) as full:
+			self.client.get(url)
+		with CaptureQueriesContext(connection) as sparse:
+			resp = self.client.get(url, {'fields': 'id,name,image_url'})
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(set(resp.data[0]), {'id', 'name', 'image_url'})
+		self.assertEqual(resp.data[0]['image_url'], 'http://img/a.png')
+		# no dose pack / batch prefetches, and the heavy text columns stay in the database
+		self.assertEqual(len(sparse.captured_queries), len(full.captured_queries) - 2)
+		select = [q['sql'] for q in sparse.captured_queries if 'FROM "api_product"' in q['sql']][-1]
+		self.assertNotIn('description', select)
+
+	def test_expand_adds_nested_lists(self):
+		resp = self.client.get(reverse('product-list'), {'fields': 'id,name', 'expand': 'batches'})
+		self.assertEqual(set(resp.data[0]), {'id', 'name', 'batches'})
+		# nested serializers keep their full representation
+		self.assertEqual(resp.data[0]['batches'][0]['available_quantity'], 10)
+		resp = self.client.get(reverse('product-list'), {'expand': 'dose_packs'})
+		self.assertIn('description', resp.data[0])
+		self.assertIn('dose_packs', resp.data[0])
+		self.assertNotIn('batches', resp.data[0])
+
+	def test_unknown_field_is_rejected(self):
+		resp = self.client.get(reverse('product-list'), {'fields': 'id,price'})
+		self.assertEqual(resp.status_code, 400)
+
+	def test_batch_and_order_fields(self):
+		self.client.force_authenticate(user=self.admin)
+		resp = self.client.get(reverse('batch-list'), {'fields': 'batch_number,available_quantity', 'page_size': 1})
+		self.assertEqual(resp.data['results'], [{'batch_number': 'B1', 'available_quantity': 10}])
+		order = Order.objects.create(user=self.admin, order_number='ORD1', total_amount=Decimal('1.00'))
+		order.items.create(
+			product=self.product, product_name=self.product.name, doses=10, quantity=1,
+			unit_price=Decimal('1.00'), requested_delivery_date=date(2026, 1, 10)
+		)
+		resp = self.client.get(reverse('order-list'), {'fields': 'order_number,status'})
+		self.assertEqual(resp.data, [{'order_number': 'ORD1', 'status': 'requested'}])
+		resp = self.client.get(reverse('order-detail', kwargs={'pk': order.pk}), {'fields': 'id', 'expand': 'items'})
+		self.assertEqual(len(resp.data['items']), 1)
+
+
+def _png_upload(name, size=(800, 400), color=(200, 30, 30, 255)):
+	buffer = BytesIO()
+	Image.new('RGBA', size, color).save(buffer, 'PNG')
+	return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(CATALOG_CACHE={'ENABLED': False})
+class ImageVariantTests(TestCase):
+	def setUp(self):
+		self.media = tempfile.TemporaryDirectory()
+		self.addCleanup(self.media.cleanup)
+		settings_override = override_settings(MEDIA_ROOT=self.media.name)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+		images._index.clear()
+		images._touched.clear()
+		self.client = APIClient()
+
+	def _product(self, **kwargs):
+		return Product.objects.create(
+			name='Vaccine A', brand='BrandX', species='poultry', product_type='live',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes', **kwargs
+		)
+
+	def test_variants_built_on_upload_and_exposed_as_srcset(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			product = self._product(image=_png_upload('a.png'))
+		root = Path(self.media.name) / 'variants'
+		[directory] = [path for path in root.iterdir() if path.name != '_sources']
+		# 1024 would upscale the 800px source, so it is skipped
+		self.assertEqual(sorted(f.name for f in directory.iterdir()), ['160.jpg', '160.webp', '320.jpg', '320.webp', '640.jpg', '640.webp'])
+		with Image.open(directory / '320.jpg') as variant:
+			self.assertEqual(variant.size, (320, 160))
+		srcset = self.client.get(reverse('product-detail', kwargs={'pk': product.pk})).data['image_srcset']
+		self.assertEqual(
+			srcset['webp'],
+			', '.join(f'http://testserver/media/variants/{directory.name}/{w}.webp {w}w' for w in (160, 320, 640)),
+		)
+		self.assertIn('/640.jpg 640w', srcset['jpeg'])
+
+	def test_requests_never_build_variants(self):
+		product = self._product(image=_png_upload('b.png', size=(100, 50)))
+		detail = reverse('product-detail', kwargs={'pk': product.pk})
+		self.assertIsNone(self.client.get(detail).data['image_srcset'])
+		self.assertFalse((Path(self.media.name) / 'variants').exists())
+		call_command('build_image_variants', stdout=StringIO())
+		srcset = self.client.get(detail).data['image_srcset']
+		self.assertTrue(srcset['jpeg'].endswith('/100.jpg 100w'))
+		self.assertIsNone(self.client.get(reverse('product-detail', kwargs={'pk': self._product().pk})).data['image_srcset'])
+
+	def test_lookup_reads_manifest_written_by_another_process(self):
+		product = self._product(image=_png_upload('e.png', size=(100, 50)))
+		digest, widths = images.ensure_variants(product.image)
+		images._index.clear()
+		self.assertEqual(images.lookup_variants(product.image), (digest, widths))
+
+	def test_quota_only_evicts_unreferenced_variants(self):
+		first = self._product(image=_png_upload('c.png', color=(1, 2, 3, 255)))
+		second = self._product(image=_png_upload('d.png', color=(4, 5, 6, 255)))
+		old_digest, _ = images.ensure_variants(first.image)
+		old_dir = Path(self.media.name) / 'variants' / old_digest
+		os.utime(old_dir, (1, 1))
+		used = sum(f.stat().st_size for f in old_dir.iterdir())
+		with override_settings(IMAGE_VARIANTS={'MAX_BYTES': used + 1}):
+			new_digest, _ = images.ensure_variants(second.image)
+			# Both images are still in use, so nothing goes
+			self.assertTrue(old_dir.is_dir())
+			first.delete()
+			self.assertEqual(images.enforce_quota(), 1)
+		self.assertFalse(old_dir.exists())
+		self.assertTrue((Path(self.media.name) / 'variants' / new_digest).is_dir())
+		self.assertEqual(len(list((Path(self.media.name) / 'variants' / '_sources').iterdir())), 1)
+
+
+	def test_quota_evicts_least_recently_served_first(self):
+		first = self._product(image=_png_upload('f.png', color=(7, 8, 9, 255)))
+		second = self._product(image=_png_upload('g.png', color=(10, 11, 12, 255)))
+		first_digest, _ = images.ensure_variants(first.image)
+		second_digest, _ = images.ensure_variants(second.image)
+		root = Path(self.media.name) / 'variants'
+		os.utime(root / first_digest, (1, 1))
+		os.utime(root / second_digest, (2, 2))
+		Product.objects.filter(pk__in=[first.pk, second.pk]).delete()
+		# The older build is still being served, so the other one goes
+		self.assertEqual(self.client.get(f'/media/variants/{first_digest}/160.webp').status_code, 200)
+		used = sum(f.stat().st_size for f in (root / first_digest).iterdir())
+		with override_settings(IMAGE_VARIANTS={'MAX_BYTES': used + 1}):
+			self.assertEqual(images.enforce_quota(), 1)
+		self.assertTrue((root / first_digest).is_dir())
+		self.assertFalse((root / second_digest).exists())
+
+
+class MediaServingTests(TestCase):
+	def setUp(self):
+		self.media = tempfile.TemporaryDirectory()
+		self.addCleanup(self.media.cleanup)
+		settings_override = override_settings(MEDIA_ROOT=self.media.name)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+		Path(self.media.name, 'products').mkdir()
+		Path(self.media.name, 'products', 'a.txt').write_bytes(b'0123456789')
+		Path(self.media.name, 'variants', 'abc').mkdir(parents=True)
+		Path(self.media.name, 'variants', 'abc', '160.webp').write_bytes(b'RIFF')
+
+	def test_full_and_conditional_responses(self):
+		resp = self.client.get('/media/products/a.txt')
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(b''.join(resp.streaming_content), b'0123456789')
+		self.assertEqual(resp['Accept-Ranges'], 'bytes')
+		self.assertIn('max-age=3600', resp['Cache-Control'])
+		resp = self.client.get('/media/products/a.txt', HTTP_IF_MODIFIED_SINCE=resp['Last-Modified'])
+		self.assertEqual(resp.status_code, 304)
+		resp = self.client.get('/media/variants/abc/160.webp')
+		self.assertIn('immutable', resp['Cache-Control'])
+		self.assertEqual(self.client.get('/media/products/missing.txt').status_code, 404)
+		self.assertEqual(self.client.get('/media/..%2F..%2Fsecret.txt').status_code, 404)
+
+	def test_range_requests(self):
+		resp = self.client.get('/media/products/a.txt', HTTP_RANGE='bytes=2-4')
+		self.assertEqual(resp.status_code, 206)
+		self.assertEqual(resp['Content-Range'], 'bytes 2-4/10')
+		self.assertEqual(b''.join(resp.streaming_content), b'234')
+		resp = self.client.get('/media/products/a.txt', HTTP_RANGE='bytes=-3')
+		self.assertEqual(b''.join(resp.streaming_content), b'789')
+		resp = self.client.get('/media/products/a.txt', HTTP_RANGE='bytes=20-')
+		self.assertEqual(resp.status_code, 416)
+		self.assertEqual(resp['Content-Range'], 'bytes */10')
+
+	@override_settings(MEDIA_ACCEL_REDIRECT='/protected-media/')
+	def test_accel_redirect_handoff(self):
+		resp = self.client.get('/media/products/a.txt')
+		self.assertEqual(resp['X-Accel-Redirect'], '/protected-media/products/a.txt')
+		self.assertEqual(resp.content, b'')
+		Path(self.media.name, 'products', 'Impfstoff ä 100%?.txt').write_bytes(b'x')
+		resp = self.client.get('/media/products/Impfstoff%20%C3%A4%20100%25%3F.txt')
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp['X-Accel-Redirect'], '/protected-media/products/Impfstoff%20%C3%A4%20100%25%3F.txt')
+
+
+class FrontendShellTests(TestCase):
+	def setUp(self):
+		from .frontend import shell_cache
+		self.static = tempfile.TemporaryDirectory()
+		self.addCleanup(self.static.cleanup)
+		settings_override = override_settings(STATIC_ROOT=self.static.name, BASE_DIR=Path(self.static.name) / 'backend')
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+		self.index = Path(self.static.name, 'index.html')
+		self.index.write_bytes(b'<html>' + b'<div id="root"></div>' * 50 + b'</html>')
+		self.shell_cache = shell_cache
+		shell_cache.clear()
+		self.addCleanup(shell_cache.clear)
+
+	def test_serves_compressed_shell_with_etag(self):
+		resp = self.client.get('/orders/123', HTTP_ACCEPT_ENCODING='gzip, deflate')
+		self.assertEqual(resp['Content-Encoding'], 'gzip')
+		self.assertEqual(gzip.decompress(resp.content), self.index.read_bytes())
+		self.assertIn('Accept-Encoding', resp['Vary'])
+		resp = self.client.get('/catalog', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=resp['ETag'])
+		self.assertEqual(resp.status_code, 304)
+		resp = self.client.get('/catalog')
+		self.assertFalse(resp.has_header('Content-Encoding'))
+		self.assertEqual(resp.content, self.index.read_bytes())
+
+	def test_reloads_when_file_changes(self):
+		first = self.client.get('/').content
+		self.index.write_bytes(b'<html>new build</html>')
+		os.utime(self.index, ns=(1, 1))
+		self.assertNotEqual(self.client.get('/').content, first)
+		self.assertEqual(self.client.get('/').content, b'<html>new build</html>')
+
+	def test_warmup_writes_precompressed_shell(self):
+		call_command('warmup_frontend', stdout=StringIO())
+		self.assertEqual(gzip.decompress(Path(str(self.index) + '.gz').read_bytes()), self.index.read_bytes())
+		self.assertIsNotNone(self.shell_cache._shell)
+
+
+class BatchFilterTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.admin = User.objects.create_user(username='admin', password='pass', is_staff=True)
+		self.client.force_authenticate(user=self.admin)
+		fields = dict(
+			brand='BrandX', species='poultry', product_type='live', manufacturer='Mfg',
+			description='desc', active_ingredients='ing', storage_temp_range='2-8C', administration_notes='notes'
+		)
+		self.a = Product.objects.create(name='A', **fields)
+		self.b = Product.objects.create(name='B', **fields)
+		Batch.objects.create(product=self.a, batch_number='A1', expiry_date=date(2030, 1, 1), quantity=10, quantity_reserved=10, storage_location='Fridge 1')
+		Batch.objects.create(product=self.a, batch_number='A2', expiry_date=date(2030, 6, 1), quantity=10, storage_location='Fridge 2')
+		Batch.objects.create(product=self.b, batch_number='B1', expiry_date=date(2030, 3, 1), quantity=5, status='reserved')
+
+	def _numbers(self, **params):
+		resp = self.client.get(reverse('batch-list'), params)
+		self.assertEqual(resp.status_code, 200)
+		return [row['batch_number'] for row in resp.data]
+
+	def test_filters(self):
+		self.assertEqual(self._numbers(product=self.a.id), ['A1', 'A2'])
+		self.assertEqual(self._numbers(product=f'{self.a.id},{self.b.id}'), ['A1', 'B1', 'A2'])
+		self.assertEqual(self._numbers(status='reserved'), ['B1'])
+		self.assertEqual(self._numbers(storage_location='Fridge 2'), ['A2'])
+		self.assertEqual(self._numbers(expires_after='2030-02-01', expires_before='2030-03-01'), ['B1'])
+		self.assertEqual(self._numbers(product=self.a.id, available_only='true'), ['A2'])
+
+	def test_invalid_parameters(self):
+		for params in ({'product': 'x'}, {'status': 'gone'}, {'expires_before': '2030-13-01'}, {'expires_after': 'soon'}):
+			self.assertEqual(self.client.get(reverse('batch-list'), params).status_code, 400, params)
+
+	def test_product_filter_uses_composite_index(self):
+		if connection.vendor != 'sqlite':
+			self.skipTest('plan text is backend specific')
+		plan = Batch.objects.filter(product_id=self.a.id).order_by('expiry_date', 'id').explain()
+		self.assertIn('batch_product_expiry_idx', plan)
+
+
+class StockAlertTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.admin = User.objects.create_user(username='admin', password='pass', is_staff=True)
+		self.client.force_authenticate(user=self.admin)
+		self.product = Product.objects.create(
+			name='Vaccine A', brand='BrandX', species='poultry', product_type='live',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes'
+		)
+		self.today = date.today()
+
+	def _alerts(self):
+		return sorted(StockAlert.objects.values_list('kind', 'batch__batch_number', 'value', 'threshold'))
+
+	def test_alerts_follow_batch_writes(self):
+		batch = Batch.objects.create(product=self.product, batch_number='B1', expiry_date=self.today + timedelta(days=10), quantity=40)
+		self.assertEqual(self._alerts(), [('expiring', 'B1', 10, 30), ('low_stock', None, 40, 100)])
+		batch.quantity = 150
+		batch.expiry_date = self.today + timedelta(days=90)
+		batch.save()
+		self.assertEqual(self._alerts(), [])
+		batch.delete()
+		self.assertEqual(self._alerts(), [('low_stock', None, 0, 100)])
+
+	def test_deleting_product_with_batches_leaves_no_dangling_alerts(self):
+		Batch.objects.create(product=self.product, batch_number='B1', expiry_date=self.today + timedelta(days=10), quantity=40)
+		Batch.objects.create(product=self.product, batch_number='B2', expiry_date=self.today + timedelta(days=90), quantity=10)
+		StockThreshold.objects.create(product=self.product, min_available_packs=500)
+		self.product.delete()
+		self.assertEqual(self._alerts(), [])
+		connection.check_constraints()
+		other = Product.objects.create(name='Vaccine B', brand='BrandX', species='poultry', product_type='live')
+		Batch.objects.create(product=other, batch_number='B3', expiry_date=self.today + timedelta(days=10), quantity=40)
+		Product.objects.filter(pk=other.pk).delete()
+		self.assertEqual(self._alerts(), [])
+		connection.check_constraints()
+
+	def test_per_product_thresholds_and_velocity(self):
+		Batch.objects.create(product=self.product, batch_number='B1', expiry_date=self.today + timedelta(days=20), quantity=40)
+		threshold = StockThreshold.objects.create(product=self.product, min_available_packs=10, cover_weeks=Decimal('2'), expiry_warning_days=7)
+		self.assertEqual(self._alerts(), [])
+		order = Order.objects.create(user=self.admin, order_number='ORD1', total_amount=Decimal('0'))
+		order.items.create(
+			product=self.product, product_name=self.product.name, doses=10, quantity=200,
+			unit_price=Decimal('1.00'), requested_delivery_date=self.today
+		)
+		call_command('refresh_stock_alerts', '--weeks', '4', stdout=StringIO())
+		threshold.refresh_from_db()
+		self.assertEqual(threshold.weekly_velocity, Decimal('50.00'))
+		# two weeks of cover at 50 packs/week
+		self.assertEqual(self._alerts(), [('low_stock', None, 40, 100)])
+
+	def test_allocation_and_endpoint(self):
+		Batch.objects.create(product=self.product, batch_number='B1', expiry_date=self.today - timedelta(days=1), quantity=5)
+		Batch.objects.create(product=self.product, batch_number='B2', expiry_date=self.today + timedelta(days=200), quantity=150)
+		StockAlert.objects.all().delete()
+		order = Order.objects.create(user=self.admin, order_number='ORD1', total_amount=Decimal('0'))
+		order.items.create(
+			product=self.product, product_name=self.product.name, doses=10, quantity=100,
+			unit_price=Decimal('1.00'), requested_delivery_date=self.today
+		)
+		resp = self.client.post(reverse('order-set-status', kwargs={'pk': order.pk}), {'status': 'confirmed'}, format='json')
+		self.assertEqual(resp.status_code, 200)
+		resp = self.client.get(reverse('batch-low-stock'))
+		self.assertEqual([(a['kind'], a['batch_number'], a['value']) for a in resp.data], [('expired', 'B1', -1), ('low_stock', None, 55)])
+		resp = self.client.get(reverse('batch-low-stock'), {'kind': 'expired'})
+		self.assertEqual([a['batch_number'] for a in resp.data], ['B1'])
+		with self.assertNumQueries(1):
+			self.client.get(reverse('batch-low-stock'), {'kind': 'low_stock', 'product': self.product.id})
+
+
+class BulkUpdateStockTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.admin = User.objects.create_user(username='admin', password='pass', is_staff=True)
+		self.client.force_authenticate(user=self.admin)
+		self.product = Product.objects.create(
+			name='Vaccine A', brand='BrandX', species='poultry', product_type='live',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes'
+		)
+
+	def _batches(self, count):
+		start = Batch.objects.count()
+		Batch.objects.bulk_create([
+			Batch(product=self.product, batch_number=f'B{start + i}', expiry_date=date(2030, 1, 1), quantity=10, quantity_reserved=2)
+			for i in range(count)
+		])
+		call_command('verify_stock_totals', '--fix', stdout=StringIO())
+		return list(Batch.objects.order_by('-id')[:count])
+
+	def _post(self, updates):
+		return self.client.post(reverse('batch-bulk-update-stock'), {'updates': updates}, format='json')
+
+	def test_per_row_results_and_totals(self):
+		a, b = self._batches(2)
+		resp = self._post([
+			{'batch_id': a.id, 'quantity': 25, 'reason': 'Stock take'},
+			{'batch_id': b.id, 'quantity': 10},
+			{'batch_id': 999999, 'quantity': 1},
+			{'batch_id': b.id, 'quantity': 1},
+			{'batch_id': 'x'},
+		])
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.data['updated'], 1)
+		self.assertEqual([r['status'] for r in resp.data['results']], ['updated', 'unchanged', 'not_found', 'invalid', 'invalid'])
+		self.assertEqual(resp.data['results'][0]['quantity_changed'], 15)
+		log = InventoryLog.objects.get()
+		self.assertEqual((log.batch_id, log.quantity_changed, log.reason, log.action), (a.id, 15, 'Stock take', 'adjusted'))
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.available_packs, 23 + 8)
+		out = StringIO()
+		call_command('verify_stock_totals', stdout=out)
+		self.assertIn('correct stock totals', out.getvalue())
+
+	def test_query_count_does_not_grow_with_rows(self):
+		def run(count):
+			updates = [{'batch_id': batch.id, 'quantity': 20, 'storage_location': 'Cold room'} for batch in self._batches(count)]
+			with CaptureQueriesContext(connection) as ctx:
+				resp = self._post(updates)
+			self.assertEqual(resp.data['updated'], count)
+			return len(ctx.captured_queries)
+		self.assertEqual(run(3), run(60))
+
+
+class AvailabilityTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.today = date.today()
+		fields = dict(
+			brand='BrandX', species='poultry', product_type='live', manufacturer='Mfg',
+			description='desc', active_ingredients='ing', storage_temp_range='2-8C', administration_notes='notes'
+		)
+		self.product = Product.objects.create(name='A', lead_time_days=3, **fields)
+		self.other = Product.objects.create(name='B', lead_time_days=0, **fields)
+		self.dose_pack = DosePack.objects.create(product=self.product, doses=10, units_per_pack=1)
+		Batch.objects.create(product=self.product, batch_number='A1', expiry_date=self.today + timedelta(days=10), quantity=10, quantity_reserved=4)
+		Batch.objects.create(product=self.product, batch_number='A2', expiry_date=self.today + timedelta(days=60), quantity=20)
+		Batch.objects.create(product=self.product, batch_number='A3', expiry_date=self.today + timedelta(days=90), quantity=50, status='expired')
+
+	def _check(self, *lines):
+		resp = self.client.post(reverse('availability'), {'lines': list(lines)}, format='json')
+		self.assertEqual(resp.status_code, 200, resp.data)
+		return resp.data
+
+	def _day(self, days):
+		return (self.today + timedelta(days=days)).isoformat()
+
+	def test_lines_share_stock_fefo(self):
+		data = self._check(
+			{'product': self.product.id, 'dose_pack': self.dose_pack.id, 'quantity': 20, 'requested_delivery_date': self._day(5)},
+			{'product': self.product.id, 'quantity': 6, 'requested_delivery_date': self._day(5)},
+			{'product': self.product.id, 'quantity': 1, 'requested_delivery_date': self._day(5)},
+		)
+		self.assertFalse(data['feasible'])
+		self.assertEqual([line['feasible'] for line in data['lines']], [True, True, False])
+		self.assertEqual((data['lines'][2]['available'], data['lines'][2]['shortfall']), (0, 1))
+
+	def test_expiry_lead_time_and_invalid_lines(self):
+		data = self._check(
+			{'product': self.product.id, 'quantity': 21, 'requested_delivery_date': self._day(30)},
+			{'product': self.product.id, 'quantity': 1, 'requested_delivery_date': self._day(1)},
+			{'product': self.other.id, 'dose_pack': self.dose_pack.id, 'quantity': 1},
+			{'product': 999999, 'quantity': 1},
+		)
+		first, early, wrong_pack, unknown = data['lines']
+		# A1 expires before delivery and A3 is expired, so only A2's 20 packs count
+		self.assertEqual((first['available'], first['reasons']), (20, ['insufficient_stock']))
+		self.assertEqual(early['reasons'], ['lead_time'])
+		self.assertEqual(early['earliest_delivery_date'], self.today + timedelta(days=3))
+		self.assertEqual(wrong_pack['reasons'], ['invalid_dose_pack', 'insufficient_stock'])
+		self.assertEqual(unknown['reasons'], ['unknown_product'])
+
+	def test_query_count_is_constant(self):
+		lines = [{'product': self.product.id, 'dose_pack': self.dose_pack.id, 'quantity': 1}] * 30
+		with self.assertNumQueries(3):
+			self._check(*lines)
+		resp = self.client.post(reverse('availability'), {'lines': [{'product': self.product.id, 'quantity': 0}]}, format='json')
+		self.assertEqual(resp.status_code, 400)
+
+
+class ExpirySweeperTests(TestCase):
+	def setUp(self):
+		self.admin = User.objects.create_user(username='admin', password='pass', is_staff=True)
+		self.product = Product.objects.create(
+			name='Vaccine A', brand='BrandX', species='poultry', product_type='live',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes'
+		)
+		self.dose_pack = DosePack.objects.create(product=self.product, doses=10, units_per_pack=1)
+		self.old = Batch.objects.create(product=self.product, batch_number='OLD', expiry_date=date(2026, 1, 1), quantity=10)
+		self.older = Batch.objects.create(
+			product=self.product, batch_number='OLDER', expiry_date=date(2025, 6, 1), quantity=8, quantity_reserved=3
+		)
+		self.fresh = Batch.objects.create(product=self.product, batch_number='FRESH', expiry_date=date(2027, 1, 1), quantity=5)
+
+	def _sweep(self, **options):
+		out = StringIO()
+		call_command('expire_batches', '--date', '2026-06-01', stdout=out, **options)
+		return out.getvalue()
+
+	def test_expires_due_batches_and_writes_them_off(self):
+		self.assertIn('Expired 2 batches across 1 products', self._sweep(chunk_size=1))
+		statuses = dict(Batch.objects.values_list('batch_number', 'status'))
+		self.assertEqual(statuses, {'OLD': 'expired', 'OLDER': 'expired', 'FRESH': 'available'})
+		logs = dict(InventoryLog.objects.filter(action='expired').values_list('batch__batch_number', 'quantity_changed'))
+		self.assertEqual(logs, {'OLD': -10, 'OLDER': -5})
+
+		self.product.refresh_from_db()
+		self.assertEqual((self.product.available_packs, self.product.reserved_packs), (5, 3))
+		self.assertEqual(self.product.nearest_expiry, date(2027, 1, 1))
+		out = StringIO()
+		call_command('verify_stock_totals', stdout=out)
+		self.assertIn('correct stock totals', out.getvalue())
+
+		# A second run has nothing left to do
+		self.assertIn('Expired 0 batches', self._sweep())
+
+	def test_dry_run_changes_nothing(self):
+		self.assertIn('2 batches are due to expire', self._sweep(dry_run=True))
+		self.assertFalse(Batch.objects.filter(status='expired').exists())
+
+	def test_saving_an_expired_batch_keeps_it_out_of_stock(self):
+		self._sweep()
+		old = Batch.objects.get(pk=self.old.pk)
+		old.quantity = 12
+		old.save()
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.available_packs, 5)
+		self.assertEqual(old.available_quantity(), 0)
+
+	def test_allocation_skips_expired_batches(self):
+		self._sweep()
+		client = APIClient()
+		client.force_authenticate(user=self.admin)
+		order = Order.objects.create(user=self.admin, order_number='ORD1', total_amount=Decimal('0'))
+		order.items.create(
+			product=self.product, product_name=self.product.name, dose_pack=self.dose_pack, doses=10,
+			quantity=5, unit_price=Decimal('1.00'), requested_delivery_date=date(2026, 7, 1)
+		)
+		resp = client.post(reverse('order-set-status', kwargs={'pk': order.id}), {'status': 'confirmed'}, format='json')
+		self.assertEqual(resp.status_code, 200)
+		reserved = dict(Batch.objects.values_list('batch_number', 'quantity_reserved'))
+		self.assertEqual(reserved, {'OLD': 0, 'OLDER': 3, 'FRESH': 5})
+
+
+class CartUpsertTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.user = User.objects.create_user(username='buyer', password='pass')
+		self.client.force_authenticate(user=self.user)
+		self.products = [
+			Product.objects.create(
+				name=f'Vaccine {i}', brand='BrandX', species='poultry', product_type='live',
+				manufacturer='Mfg', description='desc', active_ingredients='ing',
+				storage_temp_range='2-8C', administration_notes='notes'
+			)
+			for i in range(3)
+		]
+		self.packs = [DosePack.objects.create(product=p, doses=10, units_per_pack=1) for p in self.products]
+
+	def _put(self, lines):
+		return self.client.put('/api/cart/', {'items': lines}, format='json')
+
+	def _cart(self):
+		return sorted(self.user.cart.items.values_list('product_id', 'dose_pack_id', 'quantity'))
+
+	def _writes(self, lines):
+		with CaptureQueriesContext(connection) as ctx:
+			self.assertEqual(self._put(lines).status_code, 200)
+		return [q['sql'].split()[0] for q in ctx.captured_queries if 'api_cartitem' in q['sql'] and not q['sql'].startswith('SELECT')]
+
+	def test_quantity_bump_is_one_update(self):
+		lines = [{'product': {'id': p.id}, 'dosePack': {'id': d.id}, 'quantity': 1} for p, d in zip(self.products, self.packs)]
+		self._put(lines)
+		ids = set(self.user.cart.items.values_list('id', flat=True))
+		lines[1]['quantity'] = 4
+		self.assertEqual(self._writes(lines), ['UPDATE'])
+		self.assertEqual(set(self.user.cart.items.values_list('id', flat=True)), ids)
+		self.assertEqual(self._cart()[1][2], 4)
+		# an unchanged cart writes nothing
+		self.assertEqual(self._writes(lines), [])
+
+	def test_diff_adds_updates_and_removes(self):
+		p0, p1, p2 = self.products
+		self._put([{'product': p0.id, 'dose_pack': self.packs[0].id, 'quantity': 1}, {'product': p1.id, 'quantity': 2}])
+		writes = self._writes([
+			{'product': p1.id, 'quantity': 5, 'requestedDeliveryDate': '2030-01-01'},
+			{'product': p2.id, 'dosePack': self.packs[2].id, 'quantity': 3},
+		])
+		self.assertEqual(sorted(writes), ['DELETE', 'INSERT', 'UPDATE'])
+		self.assertEqual(self._cart(), [(p1.id, None, 5), (p2.id, self.packs[2].id, 3)])
+		self.assertEqual(self.user.cart.items.get(product=p1).requested_delivery_date, date(2030, 1, 1))
+
+	def test_unknown_and_mismatched_lines_are_skipped(self):
+		p0, p1, _ = self.products
+		resp = self._put([
+			{'product': 999999, 'quantity': 1},
+			{'product': p0.id, 'dose_pack': self.packs[1].id, 'quantity': 1},
+			{'product': p1.id, 'quantity': 0},
+			{'product': p1.id, 'dose_pack': self.packs[1].id, 'quantity': 2},
+		])
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(self._cart(), [(p1.id, self.packs[1].id, 2)])
+
+	def test_invalid_values_are_rejected(self):
+		resp = self._put([{'product': self.products[0].id, 'quantity': 1, 'requested_delivery_date': 'soon'}])
+		self.assertEqual(resp.status_code, 400)
+		self.assertEqual(self._put([{'product': 'abc', 'quantity': 1}]).status_code, 400)
+
+
+class CartReadTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.user = User.objects.create_user(username='buyer', password='pass')
+		self.client.force_authenticate(user=self.user)
+		self.cart = Cart.objects.create(user=self.user)
+
+	def _add_lines(self, count):
+		start = Product.objects.count()
+		for i in range(start, start + count):
+			product = Product.objects.create(
+				name=f'Vaccine {i}', brand='BrandX', species='poultry', product_type='live',
+				manufacturer='Mfg', description='desc', active_ingredients='ing',
+				storage_temp_range='2-8C', administration_notes='notes'
+			)
+			pack = DosePack.objects.create(product=product, doses=10, units_per_pack=1)
+			Batch.objects.create(product=product, batch_number=f'B{i}', expiry_date=date(2030, 1, 1), quantity=i)
+			self.cart.items.create(product=product, dose_pack=pack, quantity=1)
+
+	def _queries(self, url='/api/cart/'):
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.get(url)
+		self.assertEqual(resp.status_code, 200)
+		return len(ctx.captured_queries), resp.data
+
+	def test_compact_snapshot_in_fixed_queries(self):
+		self._add_lines(2)
+		small, _ = self._queries()
+		self._add_lines(10)
+		large, data = self._queries()
+		self.assertEqual(small, large)
+		self.assertEqual(len(data['items']), 12)
+		line = data['items'][1]
+		self.assertEqual(set(line['product']), {
+			'id', 'name', 'brand', 'species', 'image_url', 'image_alt', 'minimum_order_qty', 'lead_time_days', 'in_stock'
+		})
+		self.assertTrue(line['product']['image_url'].startswith('http://testserver/'))
+		self.assertFalse(data['items'][0]['product']['in_stock'])
+		self.assertTrue(line['product']['in_stock'])
+		self.assertEqual(line['dose_pack']['doses'], 10)
+
+	def test_expand_product_renders_full_product(self):
+		self._add_lines(2)
+		small, _ = self._queries('/api/cart/?expand=product')
+		self._add_lines(5)
+		large, data = self._queries('/api/cart/?expand=product')
+		self.assertEqual(small, large)
+		product = data['items'][0]['product']
+		self.assertEqual(len(product['dose_packs']), 1)
+		self.assertEqual(product['batches'][0]['batch_number'], 'B0')
+
+	def test_put_returns_compact_cart(self):
+		self._add_lines(1)
+		item = self.cart.items.get()
+		resp = self.client.put('/api/cart/', {'items': [{'product': item.product_id, 'dose_pack': item.dose_pack_id, 'quantity': 3}]}, format='json')
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.data['items'][0]['quantity'], 3)
+		self.assertNotIn('batches', resp.data['items'][0]['product'])
+
+
+class CartCheckoutTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.user = User.objects.create_user(username='buyer', password='pass')
+		self.client.force_authenticate(user=self.user)
+		self.product = Product.objects.create(
+			name='Vaccine A', brand='BrandX', species='poultry', product_type='live',
+			manufacturer='Mfg', description='desc', active_ingredients='ing',
+			storage_temp_range='2-8C', administration_notes='notes', lead_time_days=5
+		)
+		self.pack = DosePack.objects.create(product=self.product, doses=500, units_per_pack=1)
+		self.cart = Cart.objects.create(user=self.user)
+
+	def _checkout(self, **data):
+		return self.client.post(reverse('cart-checkout'), data, format='json')
+
+	def test_checkout_places_order_and_empties_cart(self):
+		self.cart.items.create(product=self.product, dose_pack=self.pack, quantity=2, requested_delivery_date=date(2030, 1, 1))
+		self.cart.items.create(product=self.product, quantity=1, special_instructions='keep cold')
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self._checkout(notes='asap')
+		self.assertEqual(resp.status_code, 201)
+		self.assertLessEqual(len(ctx.captured_queries), 11)
+
+		order = Order.objects.get()
+		self.assertEqual((order.user, order.status, order.notes, order.total_amount), (self.user, 'requested', 'asap', Decimal('0.00')))
+		items = list(order.items.order_by('id').values_list('dose_pack_id', 'doses', 'quantity', 'requested_delivery_date', 'special_instructions'))
+		self.assertEqual(items, [
+			(self.pack.id, 500, 2, date(2030, 1, 1), ''),
+			(None, 0, 1, date.today() + timedelta(days=5), 'keep cold'),
+		])
+		self.assertEqual(list(order.status_history.values_list('status', flat=True)), ['requested'])
+		self.assertFalse(self.cart.items.exists())
+		self.assertEqual(resp.data['order_number'], order.order_number)
+		self.assertEqual(len(resp.data['items']), 2)
+
+	def test_empty_cart_is_rejected(self):
+		self.assertEqual(self._checkout().status_code, 400)
+		self.assertFalse(Order.objects.exists())
+
+	def test_failure_rolls_back_and_keeps_cart(self):
+		self.cart.items.create(product=self.product, quantity=1)
+		self.cart.items.create(product=None, quantity=1)
+		self.assertEqual(self._checkout().status_code, 400)
+		self.assertFalse(Order.objects.exists())
+		self.assertEqual(self.cart.items.count(), 2)
+
+	def test_requires_authentication(self):
+		self.client.force_authenticate(user=None)
+		self.assertIn(self._checkout().status_code, (401, 403))
+
+
+class CartMergeTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.user = User.objects.create_user(username='buyer', password='pass')
+		self.client.force_authenticate(user=self.user)
+		self.products = [
+			Product.objects.create(
+				name=f'Vaccine {i}', brand='BrandX', species='poultry', product_type='live',
+				manufacturer='Mfg', description='desc', active_ingredients='ing',
+				storage_temp_range='2-8C', administration_notes='notes'
+			)
+			for i in range(3)
+		]
+		self.pack = DosePack.objects.create(product=self.products[0], doses=10, units_per_pack=1)
+		self.cart = Cart.objects.create(user=self.user)
+		self.cart.items.create(product=self.products[0], dose_pack=self.pack, quantity=2, requested_delivery_date=date(2030, 1, 1))
+		self.cart.items.create(product=self.products[1], quantity=5)
+		self.local = [
+			{'product': {'id': self.products[0].id}, 'dosePack': {'id': self.pack.id}, 'quantity': 3, 'requestedDeliveryDate': '2031-01-01'},
+			{'product': {'id': self.products[2].id}, 'quantity': 1, 'specialInstructions': 'keep cold'},
+		]
+
+	def _merge(self, **data):
+		return self.client.post(reverse('cart-merge'), data, format='json')
+
+	def _cart(self):
+		return sorted(self.cart.items.values_list('product_id', 'quantity', 'requested_delivery_date', 'special_instructions'))
+
+	def test_merge_sums_and_keeps_server_lines(self):
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self._merge(items=self.local)
+		self.assertEqual(resp.status_code, 200)
+		writes = [q['sql'].split()[0] for q in ctx.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+		self.assertEqual(sorted(writes), ['INSERT', 'UPDATE'])
+		p0, p1, p2 = self.products
+		self.assertEqual(self._cart(), [
+			(p0.id, 5, date(2030, 1, 1), ''),
+			(p1.id, 5, None, ''),
+			(p2.id, 1, None, 'keep cold'),
+		])
+		self.assertEqual(len(resp.data['items']), 3)
+		self.assertNotIn('batches', resp.data['items'][0]['product'])
+
+	def test_merge_max_strategy(self):
+		self.assertEqual(self._merge(items=self.local, strategy='max').status_code, 200)
+		self.assertEqual(self._cart()[0][1], 3)
+		# merging the same cart again changes nothing
+		self.assertEqual(self._merge(items=self.local, strategy='max').status_code, 200)
+		self.assertEqual(self.cart.items.count(), 3)
+
+	def test_invalid_payloads(self):
+		self.assertEqual(self._merge(items=self.local, strategy='replace').status_code, 400)
+		self.assertEqual(self._merge(items='nope').status_code, 400)
+		self.assertEqual(self.client.get(reverse('cart-merge')).status_code, 405)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+	def setUp(self):
+		token_cache.clear()
+		self.user = User.objects.create_user(username='buyer', password='pass')
+		self.token = Token.objects.create(user=self.user)
+		self.client = APIClient()
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+	def _get(self):
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.get('/api/auth/user/')
+		return resp.status_code, sum('authtoken_token' in q['sql'] for q in ctx.captured_queries)
+
+	def test_token_lookup_is_cached(self):
+		self.assertEqual(self._get(), (200, 1))
+		self.assertEqual(self._get(), (200, 0))
+		self.assertEqual(token_cache.stats()['hits'], 1)
+
+	def test_deleted_token_stops_authenticating(self):
+		self._get()
+		self.token.delete()
+		self.assertEqual(self._get()[0], 401)
+
+	def test_deactivated_user_stops_authenticating(self):
+		self._get()
+		self.user.is_active = False
+		self.user.save()
+		self.assertEqual(self._get()[0], 401)
+
+	def test_last_login_updates_keep_the_entry(self):
+		self._get()
+		self.user.save(update_fields=['last_login'])
+		self.assertEqual(self._get(), (200, 0))
+
+	def test_cached_user_does_not_keep_request_relations(self):
+		profile = UserProfile.objects.create(user=self.user, company_name='Old')
+		self.assertEqual(self.client.get('/api/auth/user/').data['company_name'], 'Old')
+		profile.company_name = 'New'
+		profile.save()
+		self.assertEqual(self.client.get('/api/auth/user/').data['company_name'], 'New')
+		self.assertEqual(token_cache.stats()['hits'], 1)
+
+	def test_ttl_and_size_bound(self):
+		with override_settings(TOKEN_AUTH_CACHE={'TTL': 0}):
+			self._get()
+			self.assertEqual(self._get(), (200, 1))
+		# Without a shared tier, entries are capped at LOCAL_TTL
+		with override_settings(TOKEN_AUTH_CACHE={'LOCAL_TTL': 0}):
+			self._get()
+			self.assertEqual(self._get(), (200, 1))
+		others = [Token.objects.create(user=User.objects.create_user(username=f'u{i}')) for i in range(3)]
+		with override_settings(TOKEN_AUTH_CACHE={'MAX_ENTRIES': 2}):
+			for token in others:
+				token_cache.set(token.key, token.user)
+			self.assertEqual(token_cache.stats()['entries'], 2)
+			self.assertIsNone(token_cache.get(others[0].key))
+
+	@override_settings(
+		TOKEN_AUTH_CACHE={'BACKEND': 'django'},
+		CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'token-auth-tests'}},
+	)
+	def test_shared_backend(self):
+		self._get()
+		token_cache._data.clear()
+		# another worker's empty LRU is filled from the shared cache
+		self.assertEqual(self._get(), (200, 0))
+		# A write handled by another worker outdates this worker's entry
+		other_worker = dict(token_cache._data)
+		self.user.is_active = False
+		self.user.save()
+		token_cache._data.update(other_worker)
+		self.assertEqual(self._get()[0], 401)
+		self.token.delete()
+		token_cache._data.clear()
+		self.assertEqual(self._get()[0], 401)
+
+	@override_settings(
+		TOKEN_AUTH_CACHE={'BACKEND': 'django'},
+		CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'token-auth-atomic'}},
+	)
+	def test_delete_inside_transaction_invalidates_after_commit(self):
+		key = self.token.key
+		with self.captureOnCommitCallbacks(execute=True):
+			with transaction.atomic():
+				self.token.delete()
+				# A concurrent request re-caches the row before the delete commits
+				token_cache.set(key, self.user, token_cache.generation(key))
+		self.assertIsNone(token_cache.get(key))
+		self.assertEqual(self._get()[0], 401)
+
+
+class RequestLoaderTests(TestCase):
+	def setUp(self):
+		self.users = [User.objects.create_user(username=f'buyer{i}') for i in range(3)]
+		UserProfile.objects.create(user=self.users[0], company_name='Acme Farms')
+		UserProfile.objects.create(user=self.users[1], company_name='Hatchery Ltd')
+		self.request = RequestFactory().get('/api/orders/')
+
+	def _orders(self, count):
+		for i in range(count):
+			Order.objects.create(
+				user=self.users[i % 3], order_number=f'ORD{Order.objects.count()}', total_amount=Decimal('0')
+			)
+
+	def _render(self, serializer_class, queryset):
+		with CaptureQueriesContext(connection) as ctx:
+			data = serializer_class(queryset, many=True, context={'request': self.request}).data
+		tables = [q['sql'].split(' FROM ')[1].split()[0].strip('"') for q in ctx.captured_queries]
+		return data, tables
+
+	def test_profiles_load_once_per_list_regardless_of_nesting(self):
+		self._orders(9)
+		queryset = Order.objects.prefetch_related('items', 'status_history').order_by('id')
+		data, tables = self._render(OrderListSerializer, queryset)
+		self.assertEqual(tables.count('auth_user'), 1)
+		self.assertEqual(tables.count('api_userprofile'), 1)
+		self.assertEqual(len(tables), 5)
+		self.assertEqual([row['user_company_name'] for row in data[:3]], ['Acme Farms', 'Hatchery Ltd', None])
+		self.assertEqual([row['user']['company_name'] for row in data[:3]], ['Acme Farms', 'Hatchery Ltd', 'dada'])
+
+	def test_loaders_are_shared_across_the_request(self):
+		self._orders(3)
+		self._render(OrderSummarySerializer, Order.objects.order_by('id'))
+		_, tables = self._render(UserSerializer, User.objects.order_by('id'))
+		self.assertEqual(tables, ['auth_user'])
+
+	def test_loader_batches_primed_keys_and_memoizes_misses(self):
+		loader = get_loader({}, UserProfile, 'user')
+		loader.prime([user.pk for user in self.users])
+		with CaptureQueriesContext(connection) as ctx:
+			self.assertEqual(loader.load(self.users[0].pk).company_name, 'Acme Farms')
+			self.assertIsNone(loader.load(self.users[2].pk))
+			rows = loader.load_many([user.pk for user in self.users])
+		self.assertEqual(len(ctx.captured_queries), 1)
+		self.assertIs(rows[self.users[0].pk], loader.load(self.users[0].pk))
+
+	def test_sparse_orders_skip_user_loading(self):
+		self._orders(3)
+		client = APIClient()
+		client.force_authenticate(user=User.objects.create_user(username='staff', is_staff=True))
+		with CaptureQueriesContext(connection) as ctx:
+			resp = client.get(reverse('order-list'), {'fields': 'id,order_number'})
+		self.assertEqual(resp.status_code, 200)
+		# (the ETag fingerprint aggregates over profiles, but no rows are loaded)
+		self.assertFalse(any(q['sql'].startswith(('SELECT "auth_user"', 'SELECT "api_userprofile"')) for q in ctx.captured_queries))
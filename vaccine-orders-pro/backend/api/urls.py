@@ -2,9 +2,12 @@ from django.urls import path, include
 from django.conf import settings
 from rest_framework.routers import DefaultRouter
 from .views import ProductViewSet, OrderViewSet, BatchViewSet, DosePackViewSet, InventoryLogViewSet, simple_register
+from .views import OrderStatusHistoryViewSet
 from .views import current_user
 from .views import csrf
-from .views import CartView
+from .views import CartView, CartCheckoutView, CartMergeView
+from .views import catalog_cache_stats
+from .views import availability
 
 router = DefaultRouter()
 router.register(r'products', ProductViewSet)
@@ -12,6 +15,7 @@ router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'batches', BatchViewSet)
 router.register(r'dosepacks', DosePackViewSet)
 router.register(r'inventory-logs', InventoryLogViewSet, basename='inventory-log')
+router.register(r'order-status-history', OrderStatusHistoryViewSet, basename='order-status-history')
 
 urlpatterns = [
     path('auth/user/', current_user),
@@ -20,6 +24,10 @@ urlpatterns = [
     path('auth/register/', simple_register),
     path('', include(router.urls)),
     path('cart/', CartView.as_view()),
+    path('cart/merge/', CartMergeView.as_view(), name='cart-merge'),
+    path('cart/checkout/', CartCheckoutView.as_view(), name='cart-checkout'),
+    path('catalog-cache/stats/', catalog_cache_stats),
+    path('availability/', availability, name='availability'),
 ]
 
 if 'dj_rest_auth.registration' in getattr(settings, 'INSTALLED_APPS', []):
@@ -3,6 +3,7 @@ from rest_framework.response import Response
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.parsers import JSONParser
+from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser
 from django.contrib.auth.models import User
 from django.db import transaction
@@ -11,11 +12,28 @@ import uuid
 from pathlib import Path
 
 from .models import Product, Order, OrderItem, DosePack, UserProfile, Batch, InventoryLog, OrderStatusHistory
-from .models import Cart, CartItem
+from .models import Cart, CartItem, StockAlert
 from .serializers import ProductSerializer, OrderSerializer, UserSerializer, BatchSerializer, DosePackSerializer, InventoryLogSerializer, CartSerializer
+from .serializers import OrderStatusHistorySerializer, OrderListSerializer, OrderSummarySerializer, StockAlertSerializer
+from .serializers import AvailabilityRequestSerializer, split_param
+from .cache import catalog_cache
+from .pagination import KeysetPagination
+from .allocation import allocate_order
+from .stocktake import bulk_adjust_batches
+from .availability import check_availability
+from .cart import MERGE_STRATEGIES, MERGE_SUM, checkout_cart, merge_cart, prefetch_cart
+from .search import search_products
+from .tags import filter_by_tags, tag_counts
+from .facets import facet_counts, filter_by_facets, parse_facet_filters
+from .frontend import shell_cache
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.middleware.csrf import get_token
 from django.http import JsonResponse
+from django.db.models import Max, Count, F, Sum, Prefetch
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.dateparse import parse_date
+import hashlib
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -80,21 +98,247 @@ def simple_register(request):
     serializer = UserSerializer(user)
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def catalog_cache_stats(request):
+    """Hit/miss counters for the catalog response cache (this process only)."""
+    return Response(catalog_cache.stats())
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def availability(request):
+    """Available-to-promise check for a set of prospective order lines.
+
+    Body: {"lines": [{"product", "dose_pack"?, "quantity", "requested_delivery_date"?}, ...]}
+    Returns {"feasible": bool, "lines": [...]} with one result per line;
+    see api/availability.py.
+    """
+    serializer = AvailabilityRequestSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    results = check_availability(serializer.validated_data['lines'])
+    return Response({'feasible': all(line['feasible'] for line in results), 'lines': results})
+
+
+class ConditionalGetMixin:
+    """Answer `list`/`retrieve` with 304 Not Modified when nothing changed.
+
+    Validators come from aggregate queries (max timestamp plus row count) over
+    the same queryset the view would serialize, and over each relation in
+    `conditional_relations` that is nested into the representation, so a
+    304 is decided without serializing anything.
+    """
+    conditional_timestamp_field = 'updated_at'
+    # (relation lookup, timestamp field) pairs for nested related rows
+    conditional_relations = ()
+    conditional_private = False
+    # Optional versioned cache (e.g. `catalog_cache`) used to memoize validators
+    conditional_validators_cache = None
+
+    def get_conditional_validators(self, queryset):
+        aggregates = {
+            'modified': Max(self.conditional_timestamp_field),
+            'count': Count('pk'),
+        }
+        values = queryset.order_by().aggregate(**aggregates)
+        parts = [values['count'], values['modified']]
+        last_modified = values['modified']
+        for relation, field in self.conditional_relations:
+            related = queryset.order_by().aggregate(
+                modified=Max(f'{relation}__{field}'),
+                count=Count(relation, distinct=True),
+            )
+            parts += [related['count'], related['modified']]
+            if related['modified'] and (last_modified is None or related['modified'] > last_modified):
+                last_modified = related['modified']
+        return parts, last_modified
+
+    def _load_conditional_validators(self, request, queryset):
+        cache = self.conditional_validators_cache
+        if cache is None or not cache.enabled():
+            return self.get_conditional_validators(queryset)
+        key = cache.make_key(self.basename, 'validators', request.build_absolute_uri())
+        validators = cache.backend.get(key)
+        if validators is None:
+            validators = self.get_conditional_validators(queryset)
+            cache.backend.set(key, validators)
+        return validators
+
+    def _conditional(self, request, queryset, render, allow_empty=True):
+        parts, last_modified = self._load_conditional_validators(request, queryset)
+        if not parts[0] and not allow_empty:
+            # Let the normal retrieve path produce its 404.
+            return render()
+        fingerprint = '|'.join(
+            [str(p) for p in parts] + [request.build_absolute_uri(), request.META.get('HTTP_ACCEPT', '')]
+        )
+        etag = '"%s"' % hashlib.md5(fingerprint.encode()).hexdigest()
+        last_modified_ts = int(last_modified.timestamp()) if last_modified else None
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified_ts)
+        response = not_modified if not_modified is not None else render()
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if last_modified_ts is not None:
+                response['Last-Modified'] = http_date(last_modified_ts)
+            patch_cache_control(response, no_cache=True, private=self.conditional_private)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self._conditional(request, queryset, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        render = lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs)
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(
+                **{self.lookup_field: kwargs[lookup_url_kwarg]}
+            )
+        except (TypeError, ValueError):
+            return render()
+        return self._conditional(request, queryset, render, allow_empty=False)
+
+
+class CatalogCacheMixin:
+    """Serve `list`/`retrieve` from the versioned catalog cache.
+
+    The key includes the absolute request URI so query parameters and the
+    host used for absolute image URLs are part of the cache identity.
+    """
+
+    def _cached(self, request, render):
+        if not catalog_cache.enabled():
+            return render()
+        key = catalog_cache.make_key(self.basename, self.action, request.build_absolute_uri())
+        data = catalog_cache.get(key)
+        if data is not None:
+            return Response(data, headers={'X-Catalog-Cache': 'HIT'})
+        response = render()
+        if response.status_code == status.HTTP_200_OK:
+            catalog_cache.set(key, response.data)
+        response['X-Catalog-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._cached(request, lambda: super(CatalogCacheMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached(request, lambda: super(CatalogCacheMixin, self).retrieve(request, *args, **kwargs))
+
+
+class SparseFieldsetViewMixin:
+    """Wire `?fields=` / `?expand=` (see `SparseFieldsetMixin`) into a viewset.
+
+    The selection is passed to the serializer through its context, and
+    `get_queryset` implementations use `is_expanded()` to skip unneeded
+    prefetches and `only_sparse_fields()` to load only the columns rendered.
+    """
+    sparse_actions = ('list', 'retrieve')
+
+    def get_sparse_fields(self):
+        if not hasattr(self, '_sparse_fields'):
+            serializer_class = self.get_serializer_class()
+            self._sparse_fields = None
+            if self.action in self.sparse_actions and hasattr(serializer_class, 'sparse_field_names'):
+                self._sparse_fields = serializer_class.sparse_field_names(self.request.query_params)
+        return self._sparse_fields
+
+    def is_expanded(self, name):
+        fields = self.get_sparse_fields()
+        return fields is None or name in fields
+
+    def only_sparse_fields(self, queryset):
+        fields = self.get_sparse_fields()
+        if fields is None:
+            return queryset
+        columns = self.get_serializer_class().sparse_only_fields(fields)
+        if columns is None:
+            return queryset
+        # Keyset cursors read the ordering columns off the first/last row
+        for field in getattr(self, 'keyset_ordering', ()):
+            name = field.lstrip('-')
+            if name not in columns:
+                columns.append(name)
+        return queryset.only(*columns)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['sparse_fields'] = self.get_sparse_fields()
+        return context
+
+
+class ProductFacetPagination(KeysetPagination):
+    opt_in = False
+    page_size = 24
+    ordering = ('name', 'id')
+
+
+class ProductViewSet(SparseFieldsetViewMixin, ConditionalGetMixin, CatalogCacheMixin, viewsets.ModelViewSet):
+    queryset = Product.objects.for_catalog()
     serializer_class = ProductSerializer
+    conditional_relations = (('batches', 'updated_at'), ('dose_packs', 'updated_at'))
+    conditional_validators_cache = catalog_cache
     permission_classes = [permissions.AllowAny]
     parser_classes = [MultiPartParser, FormParser, JSONParser]
+    sparse_actions = ('list', 'retrieve', 'search', 'facets')
+    # Used by ProductFacetPagination
+    keyset_ordering = ('name', 'id')
 
     def get_permissions(self):
         """Allow GET for everyone, POST/PUT/DELETE for authenticated users"""
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'search', 'tags', 'facets']:
             return [permissions.AllowAny()]
         return [permissions.IsAuthenticated()]
 
-class DosePackViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        queryset = Product.objects.for_catalog(
+            relations=[name for name in ProductSerializer.expandable_fields if self.is_expanded(name)]
+        )
+        queryset = self.only_sparse_fields(queryset)
+        if self.action == 'list':
+            # ?tag=a&tag=b matches products with both; add &tag_mode=any for either
+            tags = self.request.query_params.getlist('tag')
+            if tags:
+                match_all = self.request.query_params.get('tag_mode', 'all') != 'any'
+                queryset = filter_by_tags(queryset, tags, match_all=match_all)
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Filtered, keyset-paginated products plus catalog-wide facet counts.
+
+        ?species=poultry&brand=A&brand=B&cold_chain_required=true&page_size=24
+        Values within a facet are ORed, facets are ANDed. Counts are read from
+        the precomputed ProductFacetCount table and cover the whole catalog.
+        """
+        queryset = filter_by_facets(self.get_queryset(), parse_facet_filters(request.query_params))
+        paginator = ProductFacetPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        response = paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+        response.data['facets'] = facet_counts()
+        return response
+
+    @action(detail=False, methods=['get'])
+    def tags(self, request):
+        """Product count per tag, cached until the catalog changes."""
+        return Response(tag_counts())
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked full-text search with prefix matching: ?q=newc&limit=20"""
+        query = request.query_params.get('q', '').strip()
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 20)), 100))
+        except ValueError:
+            return Response({"detail": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        products = search_products(query, limit=limit, queryset=self.get_queryset())
+        serializer = self.get_serializer(products, many=True)
+        return Response(serializer.data)
+
+class DosePackViewSet(ConditionalGetMixin, CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = DosePack.objects.all()
     serializer_class = DosePackSerializer
+    conditional_validators_cache = catalog_cache
     permission_classes = [permissions.AllowAny]
 
     def get_permissions(self):
@@ -103,14 +347,45 @@ class DosePackViewSet(viewsets.ModelViewSet):
             return [permissions.AllowAny()]
         return [permissions.IsAuthenticated()]
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(SparseFieldsetViewMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    conditional_relations = (('status_history', 'changed_at'), ('user__profile', 'updated_at'))
+    conditional_private = True
+    # Opt-in: pass ?page_size= (and then follow `next`) to page through orders
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=self.request.user)
+            queryset = Order.objects.all()
+        else:
+            queryset = Order.objects.filter(user=self.request.user)
+        if self.action == 'list' and self.is_summary_view():
+            return queryset.select_related('user__profile').annotate(
+                item_count=Count('items'),
+                total_quantity=Sum('items__quantity'),
+            )
+        if self.action in ('list', 'retrieve'):
+            if self.is_expanded('user') or self.is_expanded('user_company_name'):
+                queryset = queryset.select_related('user__profile')
+            if self.is_expanded('items'):
+                queryset = queryset.prefetch_related('items')
+            if self.is_expanded('status_history'):
+                queryset = queryset.prefetch_related(
+                    Prefetch('status_history', queryset=OrderStatusHistory.objects.select_related('changed_by'))
+                )
+            return self.only_sparse_fields(queryset)
+        return queryset
+
+    def is_summary_view(self):
+        """Opt-in header-only list rows (`?view=summary`); the nested list stays the default."""
+        return self.request.query_params.get('view') == 'summary'
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return OrderSummarySerializer if self.is_summary_view() else OrderListSerializer
+        return OrderSerializer
 
     def get_object(self):
         """Override to add object-level permission check."""
@@ -141,91 +416,14 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Response({"detail": "Invalid status."}, status=status.HTTP_400_BAD_REQUEST)
         
         # If changing to confirmed, reserve stock for all items in the order.
-        # We allocate from batches (FIFO by expiry) and record InventoryLog entries
-        # in units (doses * units_per_pack). Use a DB transaction and row locking
-        # to avoid race conditions when multiple staff confirm simultaneously.
+        # Batches are allocated FEFO (oldest expiry first) by the set-based
+        # engine in api/allocation.py, with InventoryLog entries in units
+        # (packs * units_per_pack). The engine locks every needed batch in one
+        # ordered query inside this transaction to avoid races between staff.
         if new_status == 'confirmed':
             try:
                 with transaction.atomic():
-                    for item in order.items.select_related('product', 'dose_pack').all():
-                        product = item.product
-                        if not product:
-                            continue
-
-                        # Determine units per pack (default to 1 if missing)
-                        units_per_pack = 1
-                        if item.dose_pack:
-                            units_per_pack = getattr(item.dose_pack, 'units_per_pack', 1) or 1
-
-                        packs_needed = int(item.quantity or 0)
-                        if packs_needed <= 0:
-                            continue
-
-                        # Allocate packs from available batches (oldest expiry first)
-                        batches_qs = Batch.objects.select_for_update().filter(product=product).order_by('expiry_date')
-                        remaining_packs = packs_needed
-
-                        for batch in batches_qs:
-                            available_packs = batch.quantity - batch.quantity_reserved
-                            if available_packs <= 0:
-                                continue
-                            take = min(available_packs, remaining_packs)
-                            # Reserve these packs
-                            batch.quantity_reserved = batch.quantity_reserved + take
-                            batch.save()
-
-                            # Log units reserved (packs * units_per_pack)
-                            units_reserved = take * int(units_per_pack)
-                            InventoryLog.objects.create(
-                                product=product,
-                                batch=batch,
-                                action='reserved',
-                                quantity_changed=-units_reserved,
-                                reason=f'Confirmed order {order.order_number}',
-                                related_order=order,
-                                performed_by=request.user
-                            )
-
-                            remaining_packs -= take
-                            if remaining_packs <= 0:
-                                break
-
-                        # If there are remaining packs but no batches exist, deduct from dose pack
-                        if remaining_packs > 0:
-                            has_dose_packs = product.dose_packs.exists()
-                            if not has_dose_packs:
-                                # No batches and no dose pack specs - actually insufficient
-                                raise Exception(f"Insufficient stock for product {product.id} - needs {packs_needed}, short {remaining_packs}")
-                            # Otherwise, dose packs exist but no inventory batches - deduct from dose pack
-                            if item.dose_pack:
-                                dose_pack = item.dose_pack
-                                # Deduct from dose pack units
-                                units_to_deduct = remaining_packs  # remaining_packs = packs for this item
-                                dose_pack.units_per_pack = max(0, dose_pack.units_per_pack - units_to_deduct)
-                                dose_pack.save()
-                                
-                                # Log the deduction
-                                InventoryLog.objects.create(
-                                    product=product,
-                                    batch=None,
-                                    action='confirmed',
-                                    quantity_changed=-units_to_deduct,
-                                    reason=f'Confirmed order {order.order_number} (no batches, deducted from dose pack)',
-                                    related_order=order,
-                                    performed_by=request.user
-                                )
-
-                        # Keep product.available_stock in sync (sum of units from remaining dose packs)
-                        try:
-                            # Sum remaining units from dose packs
-                            dose_pack_units = sum(dp.units_per_pack for dp in product.dose_packs.all())
-                            # Also add available packs from batches
-                            batch_packs = sum(b.quantity - b.quantity_reserved for b in Batch.objects.filter(product=product))
-                            product.available_stock = int(dose_pack_units + batch_packs)
-                            product.save()
-                        except Exception:
-                            # Non-fatal: if computing available units fails, skip sync
-                            pass
+                    allocate_order(order, performed_by=request.user)
             except Exception as e:
                 return Response({"detail": f"Error confirming order: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
         
@@ -260,83 +458,147 @@ class OrderViewSet(viewsets.ModelViewSet):
         return Response({"detail": "Internal note added."}, status=status.HTTP_200_OK)
 
 
-class BatchViewSet(viewsets.ModelViewSet):
+class BatchViewSet(SparseFieldsetViewMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet for managing inventory batches. Staff only."""
     queryset = Batch.objects.all()
     serializer_class = BatchSerializer
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser, JSONParser]
-    
+    conditional_private = True
+    pagination_class = KeysetPagination
+    # Batches are listed soonest-expiry first; created_at is nullable on old rows.
+    keyset_ordering = ('expiry_date', 'id')
+
     def get_permissions(self):
         """Only staff can create/update/delete batches"""
         if self.action in ['list', 'retrieve']:
             return [permissions.IsAuthenticated()]
         return [permissions.IsAdminUser()]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = self.filter_batches(queryset, self.request.query_params)
+        return self.only_sparse_fields(queryset)
+
+    def filter_batches(self, queryset, params):
+        """?product=<id>[,<id>] &status= &storage_location= &expires_after=&expires_before=
+        (ISO dates, inclusive) &available_only=true
+
+        `product` is served by the (product, expiry_date, id) index.
+        """
+        product = params.get('product')
+        if product:
+            try:
+                ids = [int(value) for value in product.split(',') if value.strip()]
+            except ValueError:
+                raise ValidationError({'product': 'Expected a product id or comma separated ids.'})
+            queryset = queryset.filter(product_id=ids[0]) if len(ids) == 1 else queryset.filter(product_id__in=ids)
+        batch_status = params.get('status')
+        if batch_status:
+            if batch_status not in dict(Batch.BATCH_STATUS_CHOICES):
+                raise ValidationError({'status': 'Invalid status.'})
+            queryset = queryset.filter(status=batch_status)
+        storage_location = params.get('storage_location')
+        if storage_location:
+            queryset = queryset.filter(storage_location=storage_location)
+        for param, lookup in (('expires_after', 'expiry_date__gte'), ('expires_before', 'expiry_date__lte')):
+            value = params.get(param)
+            if not value:
+                continue
+            try:
+                parsed = parse_date(value)
+            except ValueError:
+                parsed = None
+            if parsed is None:
+                raise ValidationError({param: 'Expected a date (YYYY-MM-DD).'})
+            queryset = queryset.filter(**{lookup: parsed})
+        if params.get('available_only', '').lower() in ('1', 'true', 'yes'):
+            queryset = queryset.filter(quantity__gt=F('quantity_reserved'))
+        return queryset
     
     @action(detail=False, methods=['get'])
     def low_stock(self, request):
-        """Get all batches with low stock or approaching expiry"""
-        from datetime import timedelta
-        from django.utils import timezone
-        
-        batches = Batch.objects.filter(
-            quantity__lte=100  # Low stock threshold
-        ) | Batch.objects.filter(
-            expiry_date__lt=timezone.now().date() + timedelta(days=30)  # Approaching expiry
-        )
-        serializer = self.get_serializer(batches, many=True)
-        return Response(serializer.data)
+        """Current stock alerts from the materialized StockAlert table (see api/alerts.py).
+
+        ?kind=low_stock|expiring|expired (repeatable) &product=<id>
+        """
+        alerts = StockAlert.objects.select_related('product', 'batch')
+        kinds = request.query_params.getlist('kind')
+        if kinds:
+            if not set(kinds) <= set(dict(StockAlert.KIND_CHOICES)):
+                return Response({"detail": "Invalid kind."}, status=status.HTTP_400_BAD_REQUEST)
+            alerts = alerts.filter(kind__in=kinds)
+        product_id = request.query_params.get('product')
+        if product_id:
+            if not product_id.isdigit():
+                return Response({"detail": "product must be an id."}, status=status.HTTP_400_BAD_REQUEST)
+            alerts = alerts.filter(product_id=product_id)
+        return Response(StockAlertSerializer(alerts, many=True).data)
     
     @action(detail=False, methods=['post'])
     def bulk_update_stock(self, request):
-        """Bulk update stock for multiple batches"""
+        """Bulk update stock for multiple batches in one transaction.
+
+        Body: {"updates": [{"batch_id", "quantity"?, "storage_location"?, "reason"?}, ...]}
+        Returns a result per row (updated / unchanged / not_found / invalid);
+        see api/stocktake.py.
+        """
         if not request.user.is_staff:
             return Response({"detail": "Only staff can update stock."}, status=status.HTTP_403_FORBIDDEN)
         
         updates = request.data.get('updates', [])
-        for update in updates:
-            try:
-                batch = Batch.objects.get(id=update['batch_id'])
-                old_quantity = batch.quantity
-                batch.quantity = update.get('quantity', batch.quantity)
-                batch.storage_location = update.get('storage_location', batch.storage_location)
-                batch.save()
-                
-                # Log the change
-                InventoryLog.objects.create(
-                    product=batch.product,
-                    batch=batch,
-                    action='adjusted',
-                    quantity_changed=batch.quantity - old_quantity,
-                    reason=update.get('reason', 'Bulk adjustment'),
-                    performed_by=request.user
-                )
-            except Batch.DoesNotExist:
-                continue
-        
-        return Response({"detail": f"Updated {len(updates)} batches"})
+        if not isinstance(updates, list):
+            return Response({"detail": "updates must be a list."}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            results = bulk_adjust_batches(updates, performed_by=request.user)
+        updated = sum(1 for result in results if result['status'] == 'updated')
+        return Response({"detail": f"Updated {updated} batches", "updated": updated, "results": results})
 
 
 class InventoryLogViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for viewing inventory logs. Staff only."""
     serializer_class = InventoryLogSerializer
     permission_classes = [permissions.IsAdminUser]
-    
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', '-id')
+
     def get_queryset(self):
-        queryset = InventoryLog.objects.all()
+        queryset = InventoryLog.objects.select_related('product', 'batch', 'related_order', 'performed_by')
         product_id = self.request.query_params.get('product', None)
         if product_id:
             queryset = queryset.filter(product_id=product_id)
         return queryset
 
 
+class OrderStatusHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+    """Status changes across orders, oldest first. Filter with ?order=<id>."""
+    serializer_class = OrderStatusHistorySerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('changed_at', 'id')
+
+    def get_queryset(self):
+        queryset = OrderStatusHistory.objects.select_related('changed_by')
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(order__user=self.request.user)
+        order_id = self.request.query_params.get('order', None)
+        if order_id:
+            queryset = queryset.filter(order_id=order_id)
+        return queryset
+
+
 # Frontend catchall view
 from django.views.generic import View
 from django.http import HttpResponse, Http404, JsonResponse
 import os
 
 class FrontendCatchallView(View):
-    """Serve the React frontend's index.html for SPA routing."""
+    """Serve the React frontend's index.html for SPA routing.
+
+    The shell comes from the in-memory `shell_cache` (api/frontend.py),
+    already compressed, with a strong ETag so revisits get a 304.
+    """
     
     def get(self, request, path=''):
         """Handle GET requests. The 'path' parameter is captured from the URL pattern."""
@@ -346,21 +608,22 @@ class FrontendCatchallView(View):
             raise Http404()
         
         # For all other routes, serve index.html for React routing
-        index_path = os.path.join(BASE_DIR, 'staticfiles/index.html')
-        
-        # Fallback to dist folder during development
-        if not os.path.exists(index_path):
-            index_path = os.path.join(BASE_DIR.parent, 'dist/index.html')
-        
-        if os.path.exists(index_path):
-            try:
-                with open(index_path, 'rb') as f:
-                    return HttpResponse(f.read(), content_type='text/html')
-            except Exception as e:
-                return JsonResponse({'error': f'Could not read frontend: {str(e)}'}, status=500)
-        
-        # If no index.html found, return a 404
-        return JsonResponse({'error': f'Frontend not found at {index_path}'}, status=404)
+        shell = shell_cache.get()
+        if shell is None:
+            # If no index.html found, return a 404
+            return JsonResponse({'error': 'Frontend not found (run the frontend build or collectstatic)'}, status=404)
+
+        encoding, body, etag = shell.negotiate(request.META.get('HTTP_ACCEPT_ENCODING'))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type='text/html; charset=utf-8')
+            if encoding != 'identity':
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        # The shell names hashed assets, so it must be revalidated on every navigation
+        patch_cache_control(response, no_cache=True)
+        return response
 
 
 from rest_framework.views import APIView
@@ -374,24 +637,42 @@ class CartView(APIView):
     PUT/POST: replace the user's cart with the provided items (requires auth)
     
     Frontend sends items with nested product/dosePack objects; we extract IDs and save.
-    On GET, we return items with full product/dosePack objects.
+    Responses carry a compact product snapshot per line; `?expand=product`
+    returns the full product objects instead.
     """
+    def get_serializer_context(self):
+        expand = split_param(self.request.query_params.getlist('expand'))
+        return {'request': self.request, 'expand_products': 'product' in expand}
+
+    def cart_response(self, cart):
+        context = self.get_serializer_context()
+        prefetch_cart(cart, expand_products=context['expand_products'])
+        return Response(CartSerializer(cart, context=context).data, status=status.HTTP_200_OK)
+
     def get(self, request):
         user = request.user if hasattr(request, 'user') else None
         if not user or not user.is_authenticated:
             return Response({'items': []}, status=status.HTTP_200_OK)
         cart, _ = Cart.objects.get_or_create(user=user)
-        serializer = CartSerializer(cart, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.cart_response(cart)
 
     def put(self, request):
         if not request.user or not request.user.is_authenticated:
             return Response({'detail': 'Authentication required.'}, status=status.HTTP_401_UNAUTHORIZED)
-        items = request.data.get('items', [])
-        
-        # Convert frontend format to backend format
-        # Frontend sends: { product: {id, ...}, dosePack: {id, ...}, quantity, ... }
-        # We need: { product: id, dose_pack: id, quantity, ... }
+        cart = CartSerializer().create_or_update_for_user(request.user, self.convert_items(request.data.get('items', [])))
+        return self.cart_response(cart)
+
+    post = put
+
+    @staticmethod
+    def convert_items(items):
+        """Convert frontend format to backend format.
+
+        Frontend sends: { product: {id, ...}, dosePack: {id, ...}, quantity, ... }
+        We need: { product: id, dose_pack: id, quantity, ... }
+        """
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValidationError({'items': 'Expected a list of objects.'})
         converted_items = []
         for item in items:
             converted = {
@@ -406,7 +687,7 @@ class CartView(APIView):
                 converted['product'] = product.get('id')
             else:
                 converted['product'] = product
-            
+
             # Extract dosePack ID (could be nested object or plain ID)
             dose_pack = item.get('dosePack') or item.get('dose_pack')
             if dose_pack:
@@ -414,11 +695,51 @@ class CartView(APIView):
                     converted['dose_pack'] = dose_pack.get('id')
                 else:
                     converted['dose_pack'] = dose_pack
-            
+
             converted_items.append(converted)
-        
-        cart = CartSerializer().create_or_update_for_user(request.user, converted_items)
-        serializer = CartSerializer(cart, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return converted_items
 
-    post = put
+
+class CartMergeView(CartView):
+    """POST: merge the client-side (anonymous) cart into the user's server cart on login.
+
+    Body: `{"items": [...], "strategy": "sum" | "max"}` in the same item
+    format as PUT /api/cart/. Lines already on the server keep their other
+    lines; matching lines combine quantities by `strategy` (default sum).
+    Returns the merged cart in the compact representation.
+    """
+    permission_classes = [IsAuthenticated]
+    http_method_names = ['post', 'options']
+
+    def post(self, request):
+        strategy = request.data.get('strategy') or MERGE_SUM
+        if strategy not in MERGE_STRATEGIES:
+            return Response(
+                {'strategy': f"Expected one of: {', '.join(MERGE_STRATEGIES)}."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        cart = merge_cart(request.user, self.convert_items(request.data.get('items', [])), strategy)
+        return self.cart_response(cart)
+
+
+class CartCheckoutView(APIView):
+    """POST: place the current user's server-side cart as an order.
+
+    Replaces reading the cart, POSTing /api/orders/ and PUTting an empty
+    cart: the order, its items and status history are created and the cart
+    is emptied in one transaction. Prices are resolved server-side.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        notes = request.data.get('notes') or ''
+        if not isinstance(notes, str):
+            return Response({'notes': 'Expected a string.'}, status=status.HTTP_400_BAD_REQUEST)
+        order = checkout_cart(request.user, notes=notes)
+        order = (
+            Order.objects.select_related('user__profile')
+            .prefetch_related(
+                'items', Prefetch('status_history', queryset=OrderStatusHistory.objects.select_related('changed_by'))
+            )
+            .get(pk=order.pk)
+        )
+        return Response(OrderSerializer(order, context={'request': request}).data, status=status.HTTP_201_CREATED)
@@ -128,6 +128,11 @@ if os.environ.get('RENDER'):
     MEDIA_ROOT = Path('/var/data/media')
 else:
     MEDIA_ROOT = BASE_DIR / 'media'
+# Cache lifetime for uploaded media; content-hashed image variants are immutable.
+MEDIA_MAX_AGE = config('MEDIA_MAX_AGE', default=3600, cast=int)
+# Set to an nginx `internal` location (e.g. '/protected-media/') aliased to
+# MEDIA_ROOT to let the proxy send media files instead of a Python worker.
+MEDIA_ACCEL_REDIRECT = config('MEDIA_ACCEL_REDIRECT', default='')
 
 # Silence JSONField checks on SQLite for local development where we
 # provide lightweight JSON helpers.
@@ -139,7 +144,7 @@ SILENCED_SYSTEM_CHECKS = [
 # DRF Settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -147,6 +152,52 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Catalog response cache (see api/cache.py). With 'locmem', invalidations
+# made by other processes (extra workers, cron management commands) are not
+# seen and entries are only bounded by TIMEOUT seconds; for immediate
+# cross-process invalidation use BACKEND='django' with a shared cache
+# (Redis/Memcached/database) configured in CACHES.
+CATALOG_CACHE = {
+    'ENABLED': config('CATALOG_CACHE_ENABLED', default=True, cast=bool),
+    'BACKEND': config('CATALOG_CACHE_BACKEND', default='locmem'),
+    'MAX_ENTRIES': config('CATALOG_CACHE_MAX_ENTRIES', default=256, cast=int),
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': config('CATALOG_CACHE_TIMEOUT', default=60, cast=int),
+}
+
+# Token -> user lookups cached by CachedTokenAuthentication (see
+# api/authentication.py). BACKEND='django' also shares them between workers
+# and makes logout/deactivation visible to every worker at once (needs a
+# CACHES backend shared by the workers). With 'locmem', other workers may keep
+# authenticating a logged-out token or deactivated user for up to LOCAL_TTL
+# seconds.
+TOKEN_AUTH_CACHE = {
+    'ENABLED': config('TOKEN_AUTH_CACHE_ENABLED', default=True, cast=bool),
+    'BACKEND': config('TOKEN_AUTH_CACHE_BACKEND', default='locmem'),
+    'MAX_ENTRIES': config('TOKEN_AUTH_CACHE_MAX_ENTRIES', default=1024, cast=int),
+    'TTL': config('TOKEN_AUTH_CACHE_TTL', default=60, cast=int),
+    'LOCAL_TTL': config('TOKEN_AUTH_CACHE_LOCAL_TTL', default=5, cast=int),
+    'CACHE_ALIAS': 'default',
+}
+
+# Defaults for products without a StockThreshold row (see api/alerts.py)
+STOCK_ALERTS = {
+    'LOW_STOCK_PACKS': 100,
+    'EXPIRY_WARNING_DAYS': 30,
+    # Order history window used for weekly_velocity
+    'VELOCITY_WEEKS': 8,
+}
+
+# Resized WebP/JPEG variants of uploaded images (see api/images.py)
+IMAGE_VARIANTS = {
+    'ENABLED': config('IMAGE_VARIANTS_ENABLED', default=True, cast=bool),
+    'WIDTHS': (160, 320, 640, 1024),
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'DIRECTORY': 'variants',
+    'MAX_BYTES': config('IMAGE_VARIANTS_MAX_BYTES', default=512 * 1024 * 1024, cast=int),
+}
+
 # CORS Settings
 CORS_ALLOW_ALL_ORIGINS = DEBUG  # Only allow all origins in development
 if not DEBUG: